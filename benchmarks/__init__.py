@@ -0,0 +1,4 @@
+"""Benchmarks for the ledger, its repositories and the datastores.
+
+Run them with `python -m benchmarks.run --help`.
+"""
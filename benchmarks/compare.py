@@ -0,0 +1,63 @@
+"""Compare two benchmark result files.
+
+Example:
+    python -m benchmarks.compare baseline.json results.json --threshold 0.1
+
+Exits with status 1 if any case common to both files got slower by more
+than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def load_results(path):
+    with open(path) as result_file:
+        report = json.load(result_file)
+    return report, dict(((result['scenario'], result['datastore'], result['rows']), result)
+                        for result in report['results'])
+
+
+def compare(baseline, current, threshold):
+    """Compare the ops/s of the cases found in both result sets.
+
+    :param baseline: dict mapping (scenario, datastore, rows) to results
+    :param current: dict mapping (scenario, datastore, rows) to results
+    :param threshold: relative slowdown considered a regression, e.g. 0.1
+    :returns: list of (case, baseline ops/s, current ops/s, ratio, regressed) tuples
+    """
+    rows = []
+    for case in sorted(set(baseline) & set(current)):
+        before = baseline[case]['ops_per_sec']
+        after = current[case]['ops_per_sec']
+        if not before or not after:
+            continue
+        ratio = after / before
+        rows.append((case, before, after, ratio, ratio < 1 - threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as a regression')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    baseline_report, baseline = load_results(args.baseline)
+    current_report, current = load_results(args.current)
+    print('{0} -> {1}'.format(baseline_report.get('commit'), current_report.get('commit')))
+
+    regressed = False
+    for (scenario, datastore, rows), before, after, ratio, slower in compare(
+            baseline, current, args.threshold):
+        regressed = regressed or slower
+        print('{0:>20} {1:>8} {2:>9} {3:12.1f} {4:12.1f} {5:6.2f}x{6}'.format(
+            scenario, datastore, rows, before, after, ratio, '  REGRESSION' if slower else ''))
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
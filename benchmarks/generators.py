@@ -0,0 +1,58 @@
+"""Synthetic ledger generators.
+
+The generated rows have the same `date,payer,recipient,amount` layout as
+sample_ledger.csv.
+"""
+import bisect
+import random
+from datetime import date, timedelta
+
+
+def generate_ledger(rows, accounts=1000, skew=1.0, start='2017-01-01', days=365, seed=0):
+    """Generate csv ledger lines.
+
+    Accounts are picked following a Zipf-like distribution, with `skew`
+    0 every account is equally likely while higher values concentrate the
+    transactions on a few hot accounts. Dates are spread evenly over the
+    span and come in order.
+
+    :param rows: number of lines to generate
+    :param accounts: number of distinct account names
+    :param skew: Zipf exponent of the account popularity
+    :param start: first 'YYYY-MM-DD' date of the ledger
+    :param days: number of days the ledger spans
+    :param seed: random seed, the same arguments always generate the same lines
+    :returns: generator of csv lines without line terminators
+    """
+    rng = random.Random(seed)
+    weights = [1.0 / (rank ** skew) for rank in range(1, accounts + 1)]
+    cumulative = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+
+    def pick():
+        return 'account{0}'.format(bisect.bisect_left(cumulative, rng.random() * total))
+
+    first = date(*map(int, start.split('-')))
+    for i in xrange(rows):
+        day = first + timedelta(days=i * days // rows)
+        payer = pick()
+        recipient = pick()
+        while recipient == payer and accounts > 1:
+            recipient = pick()
+        yield '{0},{1},{2},{3:.2f}'.format(
+            day.isoformat(), payer, recipient, rng.randint(1, 100000) / 100.0)
+
+
+def write_ledger(path, rows, **kwargs):
+    """Write a generated ledger to a csv file.
+
+    :param path: path of the csv file
+    :param rows: number of lines to generate
+    :param kwargs: see `generate_ledger`
+    """
+    with open(path, 'w') as csv_file:
+        for line in generate_ledger(rows, **kwargs):
+            csv_file.write(line + '\n')
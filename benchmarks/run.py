@@ -0,0 +1,336 @@
+"""Run the ledger benchmarks and write machine readable results.
+
+Every (datastore, scenario, rows) case runs in its own python process so
+the reported memory isn't polluted by the previous cases. Results are
+written as JSON, see `benchmarks.compare` to diff two result files.
+
+Example:
+    python -m benchmarks.run --rows 1000 100000 --datastore json sqlite --output results.json
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+from benchmarks.generators import write_ledger
+from moazna.ledger import Ledger
+
+DEFAULT_ROWS = [1000, 100000, 1000000]
+# number of rows imported per batch when preparing a ledger for the other scenarios
+SETUP_BATCH_SIZE = 1000
+
+SCENARIOS = OrderedDict()
+
+
+def scenario(name):
+    """Register a benchmark scenario.
+
+    Scenarios receive an Environment and return a tuple of (number of
+    operations, elapsed seconds), only the measured part is timed. The
+    measured part starts with `Environment.start`.
+    """
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def make_datastore(name, directory):
+    """Create a datastore by short name or dotted class path.
+
+    :param name: 'json', 'log', 'sqlite' or a 'package.module.Class' path
+                 of a Datastore implementation taking no arguments
+    :param directory: directory for the datastores persisting to files
+    """
+    if name == 'json':
+        from moazna.datastores.json_datastore import JsonDatastore
+        return JsonDatastore()
+    if name == 'log':
+        from moazna.datastores.log_datastore import LogDatastore
+        return LogDatastore(os.path.join(directory, 'ledger.log'))
+    if name == 'sqlite':
+        from moazna.datastores.sqlite_datastore import SqliteDatastore
+        return SqliteDatastore(os.path.join(directory, 'ledger.db'))
+
+    module_name, _, class_name = name.rpartition('.')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class Environment(object):
+    """Inputs shared by the scenarios of a benchmark case."""
+
+    def __init__(self, datastore, rows, directory, accounts, skew, days, queries, seed):
+        self.datastore = datastore
+        self.rows = rows
+        self.directory = directory
+        self.accounts = accounts
+        self.queries = queries
+        self.random = random.Random(seed)
+        # peak memory of the process when the measured part started
+        self.baseline_kib = None
+        self.csv_path = os.path.join(directory, 'ledger.csv')
+        write_ledger(self.csv_path, rows, accounts=accounts, skew=skew,
+                     days=days, seed=seed)
+
+    def start(self):
+        """Start the measured part of a scenario, once its setup is done.
+
+        :returns: the current time
+        """
+        self.baseline_kib = peak_memory_kib()
+        return time.time()
+
+    def new_ledger(self, **options):
+        return Ledger(make_datastore(self.datastore, self.directory), **options)
+
+    def loaded_ledger(self, **options):
+        """Create a ledger holding the generated transactions.
+
+        :param options: keyword arguments of the Ledger
+        """
+        ledger = self.new_ledger(**options)
+        with open(self.csv_path) as csv_file:
+            ledger.import_stream(csv_file, batch_size=SETUP_BATCH_SIZE)
+        return ledger
+
+    def account_names(self, count):
+        return ['account{0}'.format(self.random.randrange(self.accounts))
+                for _ in xrange(count)]
+
+
+@scenario('import_txns')
+def bench_import_txns(env):
+    ledger = env.new_ledger()
+    started = env.start()
+    ledger.import_txns(env.csv_path)
+    return env.rows, time.time() - started
+
+
+@scenario('import_batch')
+def bench_import_batch(env):
+    ledger = env.new_ledger()
+    started = env.start()
+    ledger.import_txns(env.csv_path, batch_size=SETUP_BATCH_SIZE)
+    return env.rows, time.time() - started
+
+
+@scenario('import_parallel')
+def bench_import_parallel(env):
+    ledger = env.new_ledger()
+    started = env.start()
+    ledger.import_parallel(env.csv_path, batch_size=SETUP_BATCH_SIZE)
+    return env.rows, time.time() - started
+
+
+@scenario('record_txn')
+def bench_record_txn(env):
+    ledger = env.loaded_ledger()
+    names = env.account_names(2 * env.queries)
+    started = env.start()
+    for i in xrange(env.queries):
+        ledger.record_txn(10.0, names[2 * i], names[2 * i + 1], '2018-01-01')
+    return env.queries, time.time() - started
+
+
+@scenario('get_account_balance')
+def bench_get_account_balance(env):
+    ledger = env.loaded_ledger()
+    names = env.account_names(env.queries)
+    started = env.start()
+    for name in names:
+        ledger.get_account_balance(name, '2017-06-30', as_of=True)
+    return env.queries, time.time() - started
+
+
+@scenario('list_by_payer')
+def bench_list_by_payer(env):
+    ledger = env.loaded_ledger()
+    names = env.account_names(env.queries)
+    started = env.start()
+    for name in names:
+        ledger.txn_repository.list_by_payer(name)
+    return env.queries, time.time() - started
+
+
+@scenario('list_by_name')
+def bench_list_by_name(env):
+    ledger = env.loaded_ledger()
+    names = env.account_names(env.queries)
+    started = env.start()
+    for name in names:
+        ledger.txn_repository.list_by_name(name)
+    return env.queries, time.time() - started
+
+
+@scenario('get_rollups')
+def bench_get_rollups(env):
+    ledger = env.loaded_ledger(rollups=True)
+    names = env.account_names(env.queries)
+    started = env.start()
+    for name in names:
+        ledger.get_rollups(name, '2017-01-01', '2017-12-31', period='month')
+    return env.queries, time.time() - started
+
+
+@scenario('top_counterparties')
+def bench_top_counterparties(env):
+    ledger = env.loaded_ledger(flows=True)
+    names = env.account_names(env.queries)
+    started = env.start()
+    for name in names:
+        ledger.top_counterparties(name, 5)
+    return env.queries, time.time() - started
+
+
+@scenario('accounts')
+def bench_accounts(env):
+    ledger = env.loaded_ledger()
+    started = env.start()
+    accounts = ledger.accounts
+    return len(accounts), time.time() - started
+
+
+@scenario('transactions')
+def bench_transactions(env):
+    ledger = env.loaded_ledger()
+    started = env.start()
+    txns = ledger.transactions
+    return len(txns), time.time() - started
+
+
+@scenario('transactions_page')
+def bench_transactions_page(env):
+    ledger = env.loaded_ledger()
+    started = env.start()
+    for offset in xrange(0, 50 * env.queries, 50):
+        txns = list(ledger.iter_transactions(limit=50, offset=offset % env.rows))
+    return env.queries, time.time() - started
+
+
+def peak_memory_kib():
+    """Peak resident memory of the process so far, in KiB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(name, datastore, rows, accounts=1000, skew=1.0, days=365, queries=1000, seed=0):
+    """Run a single benchmark case in the current process.
+
+    Two memory figures are reported. `process_peak_memory_kib` is the peak
+    of the whole process, generating the ledger and the scenario's setup
+    included. `measured_peak_growth_kib` is how much the measured part
+    raised that peak, 0 if it never used more than the setup did.
+
+    :returns: dict with the case parameters, wall time, operations per
+              second and the memory figures in KiB
+    """
+    directory = tempfile.mkdtemp(prefix='moazna-bench-')
+    try:
+        env = Environment(datastore, rows, directory, accounts, skew, days, queries, seed)
+        ops, elapsed = SCENARIOS[name](env)
+    finally:
+        shutil.rmtree(directory)
+
+    peak = peak_memory_kib()
+    return OrderedDict([
+        ('scenario', name),
+        ('datastore', datastore),
+        ('rows', rows),
+        ('ops', ops),
+        ('wall_time', elapsed),
+        ('ops_per_sec', ops / elapsed if elapsed else None),
+        ('process_peak_memory_kib', peak),
+        ('measured_peak_growth_kib', peak - env.baseline_kib),
+    ])
+
+
+def summary_line(result):
+    """Format a case result as a line of the progress output."""
+    ops_per_sec = result['ops_per_sec']
+    if ops_per_sec is None:
+        ops_per_sec = '{0:>12}'.format('n/a')
+    else:
+        ops_per_sec = '{0:12.1f}'.format(ops_per_sec)
+    return ('{scenario:>20} {datastore:>8} {rows:>9} rows  {wall_time:9.3f}s '
+            '{0} ops/s {process_peak_memory_kib:9d} KiB peak '
+            '{measured_peak_growth_kib:+9d} KiB measured\n').format(ops_per_sec, **result)
+
+
+def current_commit():
+    with open(os.devnull, 'w') as devnull:
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS,
+                        help='ledger sizes to benchmark')
+    parser.add_argument('--datastore', nargs='+', default=['json'],
+                        help="'json', 'log', 'sqlite' or dotted Datastore class paths")
+    parser.add_argument('--scenario', nargs='+', default=list(SCENARIOS),
+                        choices=list(SCENARIOS), help='scenarios to run')
+    parser.add_argument('--accounts', type=int, default=1000,
+                        help='number of distinct accounts in the generated ledgers')
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='Zipf exponent of the account popularity')
+    parser.add_argument('--days', type=int, default=365,
+                        help='number of days the generated ledgers span')
+    parser.add_argument('--queries', type=int, default=1000,
+                        help='number of operations of the query scenarios')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--single', action='store_true',
+                        help='run a single case in this process and print its JSON result')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    params = dict(accounts=args.accounts, skew=args.skew, days=args.days,
+                  queries=args.queries, seed=args.seed)
+
+    if args.single:
+        print(json.dumps(run_case(args.scenario[0], args.datastore[0], args.rows[0], **params)))
+        return
+
+    results = []
+    for datastore in args.datastore:
+        for rows in args.rows:
+            for name in args.scenario:
+                command = [sys.executable, '-m', 'benchmarks.run', '--single',
+                           '--scenario', name, '--datastore', datastore,
+                           '--rows', str(rows)]
+                for key, value in sorted(params.items()):
+                    command.extend(['--' + key, str(value)])
+                result = json.loads(subprocess.check_output(command))
+                sys.stderr.write(summary_line(result))
+                results.append(result)
+
+    report = OrderedDict([
+        ('commit', current_commit()),
+        ('python', platform.python_version()),
+        ('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('parameters', params),
+        ('results', results),
+    ])
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,214 @@
 """Account classes."""
+import bisect
+import threading
+from array import array
+from collections import OrderedDict
 from datetime import datetime
 
+from moazna.dates import from_ordinal, to_ordinal
+
 DEFAULT_BALANCE = 0.0
 
 
+# days per chunk of a BalanceIndex, chunks are split at twice the size
+CHUNK_SIZE = 256
+
+
+class BalanceIndex(object):
+    """Prefix sums of per day balance changes over the days holding a change.
+
+    The days with a change and their changes are kept sorted in chunks of
+    bounded size, with a Fenwick tree over the chunk totals. Adding a change
+    on any day shifts the values of one chunk and updates O(log chunks)
+    tree nodes, summing the changes up to any day adds O(log chunks) nodes
+    and part of one chunk. Memory and the serialized index grow with the
+    number of days holding a change, not with the span of their dates.
+    """
+
+    __slots__ = ('_days', '_changes', '_maxes', '_tree')
+
+    def __init__(self):
+        self._days = []
+        self._changes = []
+        self._maxes = []
+        self._tree = array('d')
+
+    def __len__(self):
+        return sum(len(days) for days in self._days)
+
+    def __iter__(self):
+        """Iterate over the (day ordinal, change) pairs in ascending order."""
+        for days, changes in zip(self._days, self._changes):
+            for pair in zip(days, changes):
+                yield pair
+
+    @property
+    def dates(self):
+        """Array of the days holding a change, in ascending order."""
+        dates = array('l')
+        for days in self._days:
+            dates.extend(days)
+        return dates
+
+    def add(self, ordinal, amount):
+        """Add a balance change on a day.
+
+        :param ordinal: day ordinal
+        :param amount: amount added to the balance of that day and the following ones
+        """
+        if not self._days:
+            self._days.append(array('l', [ordinal]))
+            self._changes.append(array('d', [amount]))
+            self._maxes.append(ordinal)
+            self._tree.append(amount)
+            return
+
+        index = min(bisect.bisect_left(self._maxes, ordinal), len(self._days) - 1)
+        days = self._days[index]
+        changes = self._changes[index]
+        position = bisect.bisect_left(days, ordinal)
+        if position < len(days) and days[position] == ordinal:
+            changes[position] += amount
+        else:
+            days.insert(position, ordinal)
+            changes.insert(position, amount)
+            self._maxes[index] = days[-1]
+            if len(days) > 2 * CHUNK_SIZE:
+                # the rebuilt tree includes the amount
+                self._split(index)
+                return
+
+        tree = self._tree
+        i = index + 1
+        while i <= len(tree):
+            tree[i - 1] += amount
+            i += i & -i
+
+    def prefix(self, ordinal):
+        """Sum of the changes on or before a day."""
+        index = bisect.bisect_left(self._maxes, ordinal)
+        tree = self._tree
+        total = 0.0
+        i = index
+        while i > 0:
+            total += tree[i - 1]
+            i -= i & -i
+        if index < len(self._days):
+            days = self._days[index]
+            total += sum(self._changes[index][:bisect.bisect_right(days, ordinal)])
+        return total
+
+    def floor(self, ordinal):
+        """Return the last day holding a change on or before a day, or None."""
+        index = bisect.bisect_left(self._maxes, ordinal)
+        if index < len(self._days):
+            days = self._days[index]
+            position = bisect.bisect_right(days, ordinal)
+            if position:
+                return days[position - 1]
+        if index:
+            return self._maxes[index - 1]
+
+    def following(self, ordinal):
+        """Return the first day holding a change after a day, or None."""
+        index = bisect.bisect_right(self._maxes, ordinal)
+        if index < len(self._days):
+            days = self._days[index]
+            return days[bisect.bisect_right(days, ordinal)]
+
+    def dumps(self):
+        """Serialize the index to a tuple of the days and the changes as strings."""
+        return self.dates.tostring(), array('d', (change for _, change in self)).tostring()
+
+    @classmethod
+    def loads(cls, data):
+        """Create a BalanceIndex from the output of `dumps`."""
+        if len(data) == 3:
+            return cls._load_dense(*data)
+
+        days = array('l')
+        days.fromstring(data[0])
+        changes = array('d')
+        changes.fromstring(data[1])
+        index = cls()
+        for start in xrange(0, len(days), CHUNK_SIZE):
+            index._days.append(days[start:start + CHUNK_SIZE])
+            index._changes.append(changes[start:start + CHUNK_SIZE])
+        index._maxes = [chunk[-1] for chunk in index._days]
+        index._build_tree()
+        return index
+
+    @classmethod
+    def _load_dense(cls, base, tree_data, dates_data):
+        """Convert an index saved as a dense Fenwick tree over all days."""
+        tree = array('d')
+        tree.fromstring(tree_data)
+        dates = array('l')
+        dates.fromstring(dates_data)
+
+        def prefix(ordinal):
+            i = min(ordinal - base + 1, len(tree))
+            total = 0.0
+            while i > 0:
+                total += tree[i - 1]
+                i -= i & -i
+            return total
+
+        index = cls()
+        previous = 0.0
+        for ordinal in dates:
+            balance = prefix(ordinal)
+            index.add(ordinal, balance - previous)
+            previous = balance
+        return index
+
+    def _split(self, index):
+        days = self._days[index]
+        changes = self._changes[index]
+        self._days[index:index + 1] = [days[:CHUNK_SIZE], days[CHUNK_SIZE:]]
+        self._changes[index:index + 1] = [changes[:CHUNK_SIZE], changes[CHUNK_SIZE:]]
+        self._maxes[index:index + 1] = [days[CHUNK_SIZE - 1], days[-1]]
+        self._build_tree()
+
+    def _build_tree(self):
+        """Build the Fenwick tree of the chunk totals in O(chunks)."""
+        tree = self._tree = array('d', [sum(changes) for changes in self._changes])
+        size = len(tree)
+        for i in xrange(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent - 1] += tree[i - 1]
+
+
 class Account(object):
-    """A class to perform the account's different logical operations."""
+    """A class to perform the account's different logical operations.
+
+    The balance an account is opened with precedes all of its dated
+    changes, the balance on any date is the opening balance plus the
+    changes up to it.
+    """
+
+    __slots__ = ('name', 'balance', 'opening', '_index', '_raw_history', '_load_changes', '_unsaved')
 
     def __init__(self, name, balance):
         self.name = name
         self.balance = balance
-        # balance history is private to be only modified by the internal functions
-        self._balance_history = []
-        self.update_history(self.balance, datetime.now().strftime('%Y-%m-%d'))
+        self.opening = balance
+        # balance history is private to be only modified by the internal functions.
+        # It's kept as an index of the balance changes by date
+        self._index = BalanceIndex()
+        self._raw_history = None
+        self._load_changes = None
+        # day ordinal -> change posted since the account was last saved
+        self._unsaved = {}
+        # an entry of the opening balance on the day the account is opened
+        self._change(to_ordinal(datetime.now().strftime('%Y-%m-%d')), 0.0)
 
     def __iter__(self):
-        KEYS = ['name', 'balance', '_balance_history']
+        KEYS = ['name', 'balance', 'balance_history']
 
-        for key in self.__dict__:
-            if key in KEYS:
-                new_key = key
-                if(key.startswith('_')):
-                    new_key = key[1:]
-                yield new_key, self.__getattribute__(key)
+        for key in KEYS:
+            yield key, self.__getattribute__(key)
 
     def __str__(self):
         return 'name: {0}, balance: {1}, balance_history: {2}'.format(self.name, self.balance, self.balance_history)
@@ -51,100 +237,445 @@ class Account(object):
     def from_dict(cls, data):
         """Create an Account instance from dict.
 
-        :param data: Dict containing name, balance and possibly balance_history attrs
+        Dicts carrying a balance_history, or the serialized balance index of
+        `to_record`, skip __init__ and its opening history entry. A
+        balance_history is only parsed once it's used, its balances include
+        the opening balance.
+
+        :param data: Dict containing name, balance and possibly balance_history,
+                     history and opening attrs
         :returns: Account instance
         """
 
-        instance = cls(data['name'], data['balance'])
-        if 'balance_history' in data:
-            instance._balance_history = data['balance_history']
+        if 'history' in data:
+            instance = cls._restore(data['name'], data['balance'], data.get('opening', 0.0))
+            instance._index = BalanceIndex.loads(data['history'])
+            return instance
+
+        if 'balance_history' not in data:
+            return cls(data['name'], data['balance'])
+
+        instance = cls._restore(data['name'], data['balance'], 0.0)
+        instance._raw_history = data['balance_history']
         return instance
 
+    @classmethod
+    def _restore(cls, name, balance, opening, loadChanges=None):
+        """Create an Account instance without a balance history, skipping __init__.
+
+        :param loadChanges: callable returning the saved (day ordinal, change)
+                            pairs of the history, called on its first use
+        """
+        instance = cls.__new__(cls)
+        instance.name = name
+        instance.balance = balance
+        instance.opening = opening
+        instance._index = None if loadChanges is not None else BalanceIndex()
+        instance._raw_history = None
+        instance._load_changes = loadChanges
+        instance._unsaved = {}
+        return instance
+
+    def to_record(self, history=True):
+        """Build a compact dict of the account for a datastore.
+
+        :param history: include the balance history as its serialized index,
+                        see `from_dict`. Repositories saving the changes on
+                        their own leave it out.
+        """
+        record = {'name': self.name, 'balance': self.balance, 'opening': self.opening}
+        if history:
+            record['history'] = self._history().dumps()
+        return record
+
+    def _history(self):
+        """Parse or load the balance history, if not done yet.
+
+        Changes posted before are added to it.
+
+        :returns: BalanceIndex of the balance history
+        """
+        if self._index is None or self._raw_history is not None:
+            if self._raw_history is not None:
+                self._load_history(self._raw_history)
+            else:
+                self._index = BalanceIndex()
+                for ordinal, change in self._load_changes():
+                    self._index.add(ordinal, change)
+                self._load_changes = None
+            for ordinal, change in self._unsaved.iteritems():
+                self._index.add(ordinal, change)
+        return self._index
+
+    def _change(self, ordinal, amount):
+        """Add a change on a day to the history and to the unsaved changes."""
+        if self._index is not None and self._raw_history is None:
+            self._index.add(ordinal, amount)
+        self._unsaved[ordinal] = self._unsaved.get(ordinal, 0.0) + amount
+
+    def _load_history(self, entries):
+        """Replace the balance history with a list of history entries.
+
+        :param entries: list of dicts with date and balance keys, in any order
+        """
+        self._raw_history = None
+        self._index = BalanceIndex()
+        previous = 0.0
+        for entry in sorted(entries, key=lambda entry: entry['date']):
+            self._index.add(to_ordinal(entry['date']), entry['balance'] - previous)
+            previous = entry['balance']
+
+    def post(self, amount, date):
+        """Record a balance change in the balance history.
+
+        Changes can be posted in any date order, the balances of the date
+        and all the dates after it move by the amount.
+
+        :param amount: amount added to the balance, negative for decreases
+        :param date: date of the change
+        """
+        self._change(to_ordinal(date), amount)
+
     def update_history(self, balance, date):
         """Update account's balance history.
 
-        NOTE: Date granuality is by day
+        NOTE: Date granuality is by day, recording a balance for a date that
+              already has an entry replaces it. The balances of the later
+              dates are left as they are.
 
         :param balance: balance amount
         :param date: date of recording the balance amount
         """
-        try:
-            self._balance_history.remove({
-                'date': date,
-                'balance': balance
-            })
-        except ValueError:
-            self._balance_history.append({
-                'date': date,
-                'balance': balance
-            })
-        else:
-            self._balance_history.append({
-                'date': date,
-                'balance': balance
-            })
-
-    def get_balance(self, date=None):
+        ordinal = to_ordinal(date)
+        index = self._history()
+        change = balance - self.opening - index.prefix(ordinal)
+        self._change(ordinal, change)
+        following = index.following(ordinal)
+        if following is not None and change:
+            self._change(following, -change)
+
+    def get_balance(self, date=None, as_of=False):
         """Retrieve account's balance in a specific date.
 
         :param date: date of the desired balance entry
+        :param as_of: if True, return the last known balance on or before the date
+                      instead of requiring an entry on that exact date
         :returns: balance amount if the entry exists, defaults to the current balance
         """
         if date is not None:
-            for entry in self._balance_history:
-                if entry['date'] == date:
-                    return entry['balance']
+            ordinal = to_ordinal(date)
+            index = self._history()
+            day = index.floor(ordinal)
+            if day is not None and (as_of or day == ordinal):
+                return self.opening + index.prefix(ordinal)
         else:
             return self.balance
 
     @property
     def balance_history(self):
-        return self._balance_history
+        history = []
+        balance = self.opening
+        for ordinal, change in self._history():
+            balance += change
+            history.append({'date': from_ordinal(ordinal), 'balance': balance})
+        return history
 
 
-class AccountRepository(object):
-    """A class to help persist accounts in a datastore/database."""
+class AccountRegistry(object):
+    """Interns account names and assigns every account a compact integer id.
+
+    Ids are handed out in order of first sight and never reused, the
+    mapping is persisted in the datastore so records can key on the id and
+    the name is only resolved when it's shown. Repositories sharing a
+    datastore should share a registry, a registry still falls back to the
+    datastore for names assigned by another one.
+
+    Registries are safe to use from several threads. Pass the lock guarding
+    the datastore, if any, as `lock` so the two are always taken together.
+    """
 
-    def __init__(self, datastore):
+    def __init__(self, datastore, lock=None):
         self._datastore = datastore
+        self._lock = lock or threading.Lock()
+        self.__entity = 'account_ids'
+        self._datastore.add_entity(self.__entity, 'id', {'name': 'name'})
+        # id -> name, None for ids not seen by this registry yet
+        self.names = []
+        self._ids = {}
+        for record in self._datastore.filter(self.__entity, 'id'):
+            self.__add(record['id'], record['name'])
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get_id(self, name):
+        """Return the id of an account name or None if it has none yet."""
+        account_id = self._ids.get(name)
+        if account_id is None:
+            record = self._datastore.retrieve(self.__entity, 'name', name)
+            if record is not None:
+                with self._lock:
+                    account_id = self.__add(record['id'], record['name'])
+        return account_id
+
+    def id_for(self, name):
+        """Return the id of an account name, assigning a new one if needed."""
+        account_id = self.get_id(name)
+        if account_id is None:
+            with self._lock:
+                account_id = self._ids.get(name)
+                if account_id is None:
+                    account_id = self._datastore.count(self.__entity)
+                    self._datastore.create(self.__entity, {'id': account_id, 'name': name})
+                    self.__add(account_id, name)
+        return account_id
+
+    def name(self, account_id):
+        """Return the account name of an id or None if it's unknown."""
+        if account_id < len(self.names) and self.names[account_id] is not None:
+            return self.names[account_id]
+        record = self._datastore.retrieve(self.__entity, 'id', account_id)
+        if record is not None:
+            with self._lock:
+                return self.names[self.__add(account_id, record['name'])]
+
+    def __add(self, account_id, name):
+        if isinstance(name, str):
+            name = intern(name)
+        if account_id >= len(self.names):
+            self.names.extend([None] * (account_id + 1 - len(self.names)))
+        self.names[account_id] = name
+        self._ids[name] = account_id
+        return account_id
+
+
+class AccountRepository(object):
+    """A class to help persist accounts in a datastore/database.
+
+    With a `cache_size` the repository keeps an identity map of up to that
+    many recently used Account instances, evicting the least recently used.
+    Cached accounts are written through to the datastore, `get_by_name`
+    returns the cached instance itself so repeated lookups of hot accounts
+    don't hit the datastore or rebuild the Account.
+
+    Account records are keyed by the integer id the AccountRegistry assigns
+    to their name. The balance history is saved apart from them, as a
+    'balance_changes' record per account and day holding a change, so saving
+    an account only writes the days changed since it was loaded and the
+    history is only read once it's used.
+    """
+
+    def __init__(self, datastore, cache_size=0, registry=None):
+        self._datastore = datastore
+        self.registry = registry if registry is not None else AccountRegistry(datastore)
         self.__entity = 'accounts'
-        self.__id_attr = 'name'
-        self._datastore.add_entity(self.__entity)
+        self.__id_attr = 'id'
+        self._datastore.add_entity(self.__entity, self.__id_attr)
+        self.__change_entity = 'balance_changes'
+        self._datastore.add_entity(self.__change_entity, 'id', {'account_id': 'account_id'})
+
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def create(self, name, balance=DEFAULT_BALANCE):
         instance = Account(name, balance)
 
-        return Account.from_dict(self._datastore.create(self.__entity, dict(instance)))
+        record = self._datastore.create(self.__entity, self._record(instance))
+        self._save_changes([instance])
+        if self._cache_size:
+            self._remember(instance)
+            return instance
+        return self._instance(record)
+
+    def create_many(self, instances):
+        """Save new Account instances in bulk.
+
+        :param instances: list of Account instances
+        :returns: number of created accounts
+        """
+        count = self._datastore.create_many(
+            self.__entity, [self._record(instance) for instance in instances])
+        self._save_changes(instances)
+        for instance in instances:
+            self._remember(instance)
+        return count
 
     def list(self):
         records = self._datastore.filter(self.__entity, self.__id_attr)
         accounts = []
         for record in records:
-            account = Account.from_dict(record)
+            account = self._instance(record)
             accounts.append(account)
         return accounts
 
+    def iterate(self, order_by=None, after=None, limit=None, offset=0):
+        """Iterate over the saved accounts lazily.
+
+        Only the records read from the iterator are turned into Account
+        instances. For keyset pagination order by 'name' and pass the name
+        of the last account of a page as `after`.
+
+        :param order_by: None for insertion order or 'name'
+        :param after: keyset cursor, requires `order_by`
+        :param limit: maximum number of accounts
+        :param offset: number of accounts to skip
+        :returns: generator of Account instances
+        """
+        if order_by not in (None, 'name'):
+            raise ValueError("unknown order {0!r}, expected None or 'name'".format(order_by))
+        records = self._datastore.scan(self.__entity, order_by, after, limit, offset)
+        return (self._instance(record) for record in records)
+
+    def balances(self):
+        """Map the names of all saved accounts to their current balance."""
+        records = self._datastore.filter(self.__entity, self.__id_attr)
+        return dict((record['name'], record['balance']) for record in records)
+
+    def balances_by_id(self):
+        """Map the ids of all saved accounts to their current balance."""
+        records = self._datastore.filter(self.__entity, self.__id_attr)
+        return dict((record[self.__id_attr], record['balance']) for record in records)
+
+    def count(self):
+        """Count the saved accounts."""
+        return self._datastore.count(self.__entity)
+
     def get_by_name(self, name):
-        record = self._datastore.retrieve(self.__entity, 'name', name)
+        account_id = self.registry.get_id(name)
+        if account_id is None:
+            if self._cache_size:
+                self.cache_misses += 1
+            return None
+        return self.get_by_id(account_id)
+
+    def get_by_id(self, accountId):
+        """Retrieve an account by the id its name is registered with.
+
+        :param accountId: integer account id
+        :returns: Account instance if found or None otherwise
+        """
+        if self._cache_size:
+            instance = self._cache.pop(accountId, None)
+            if instance is not None:
+                self.cache_hits += 1
+                self._cache[accountId] = instance
+                return instance
+            self.cache_misses += 1
+
+        record = self._datastore.retrieve(self.__entity, self.__id_attr, accountId)
         if record is not None:
-            return Account.from_dict(record)
+            return self._remember(self._instance(record))
 
     def update(self, instance):
-        record = self._datastore.update(
-            self.__entity, dict(instance), self.__id_attr)
-        return Account.from_dict(record)
+        record = self._datastore.update(self.__entity, self._record(instance), self.__id_attr)
+        self._save_changes([instance])
+        if self._cache_size:
+            return self._remember(instance)
+        return self._instance(record)
+
+    def update_many(self, instances):
+        """Update Account instances in bulk.
+
+        :param instances: list of Account instances
+        :returns: number of updated accounts
+        """
+        count = self._datastore.update_many(
+            self.__entity, [self._record(instance) for instance in instances], self.__id_attr)
+        self._save_changes(instances)
+        for instance in instances:
+            self._remember(instance)
+        return count
 
     def delete(self, instance):
-        self._datastore.delete(
-            self.__entity, self.__id_attr, instance[self.__id_attr])
+        account_id = self.registry.get_id(instance.name)
+        self._cache.pop(account_id, None)
+        self._datastore.delete(self.__entity, self.__id_attr, account_id)
+        for record in self._datastore.filter(self.__change_entity, 'account_id', [account_id]):
+            self._datastore.delete(self.__change_entity, 'id', record['id'])
 
-    def get_balance(self, name, date):
-        record = self.get_by_name(name)
-        if record is not None:
-            instance = Account.from_dict(dict(record))
-            return instance.get_balance(date)
+    def get_balance(self, name, date, as_of=False):
+        instance = self.get_by_name(name)
+        if instance is not None:
+            return instance.get_balance(date, as_of)
 
     def update_balance_history(self, accountName, balance, date):
         instance = self.get_by_name(accountName)
         instance.update_history(balance, date)
-        self._datastore.update(self.__entity, dict(instance), self.__id_attr)
+        self.update(instance)
+
+    def cache_stats(self):
+        """Report the account cache counters.
+
+        :returns: dict with hits, misses, size and capacity of the cache
+        """
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'size': len(self._cache),
+            'capacity': self._cache_size,
+        }
+
+    def _record(self, instance):
+        """Build the datastore record of an Account instance, without its history.
+
+        The history of records saved with it is cleared.
+        """
+        record = instance.to_record(history=False)
+        record[self.__id_attr] = self.registry.id_for(instance.name)
+        record['history'] = record['balance_history'] = None
+        return record
+
+    def _instance(self, record):
+        """Build an Account instance from its datastore record.
+
+        Accounts saved with their whole history get all of its days saved
+        as balance changes on their next write.
+        """
+        if record.get('history') is not None or record.get('balance_history') is not None:
+            instance = Account.from_dict(record)
+            instance._unsaved = dict(instance._history())
+            return instance
+
+        account_id = record[self.__id_attr]
+        return Account._restore(record['name'], record['balance'], record['opening'],
+                                lambda: self._changes(account_id))
+
+    def _changes(self, account_id):
+        """Read the saved (day ordinal, change) pairs of an account."""
+        return [(record['day'], record['change']) for record in
+                self._datastore.filter(self.__change_entity, 'account_id', [account_id])]
+
+    def _save_changes(self, instances):
+        """Write the balance changes posted to Account instances since they were saved.
+
+        Only the records of the changed days are read and written.
+        """
+        created = []
+        updated = []
+        for instance in instances:
+            if not instance._unsaved:
+                continue
+            account_id = self.registry.id_for(instance.name)
+            for ordinal, change in instance._unsaved.iteritems():
+                change_id = '{0}:{1}'.format(account_id, ordinal)
+                record = self._datastore.retrieve(self.__change_entity, 'id', change_id)
+                if record is None:
+                    created.append({'id': change_id, 'account_id': account_id,
+                                    'day': ordinal, 'change': change})
+                else:
+                    updated.append(dict(record, change=record['change'] + change))
+            instance._unsaved = {}
+        self._datastore.create_many(self.__change_entity, created)
+        self._datastore.update_many(self.__change_entity, updated, 'id')
+
+    def _remember(self, instance):
+        """Put an Account instance in the cache, evicting the least recently used."""
+        if self._cache_size:
+            account_id = self.registry.id_for(instance.name)
+            self._cache.pop(account_id, None)
+            self._cache[account_id] = instance
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return instance
@@ -0,0 +1,153 @@
+"""Periodic snapshots of the account balances."""
+import bisect
+import threading
+import time
+from array import array
+
+
+class Checkpoint(object):
+    """Balances of all accounts at a position of the transaction log.
+
+    The balances include every transaction logged before `position` and
+    none after, `balances` maps account ids to their balance.
+    """
+
+    __slots__ = ('position', 'created', 'balances')
+
+    def __init__(self, position, balances, created=None):
+        self.position = position
+        self.balances = balances
+        self.created = created if created is not None else time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    def __repr__(self):
+        return '{0}(position={1}, accounts={2})'.format(
+            self.__class__.__name__, self.position, len(self.balances))
+
+    @classmethod
+    def from_dict(cls, data):
+        ids = array('l')
+        ids.fromstring(data['ids'])
+        balances = array('d')
+        balances.fromstring(data['balances'])
+        return cls(data['position'], dict(zip(ids, balances)), data['created'])
+
+    def to_record(self):
+        """Build a compact dict of the checkpoint for a datastore.
+
+        Account ids and balances are stored as the bytes of typed arrays.
+        """
+        ids = sorted(self.balances)
+        return {
+            'position': self.position,
+            'created': self.created,
+            'ids': array('l', ids).tostring(),
+            'balances': array('d', [self.balances[account_id] for account_id in ids]).tostring(),
+        }
+
+
+class CheckpointRepository(object):
+    """A class to help persist checkpoints in a datastore/database.
+
+    Checkpoints are keyed by their log position. The sorted positions are
+    loaded once and kept in memory, so finding the checkpoint nearest to a
+    position only retrieves that one.
+    """
+
+    def __init__(self, datastore):
+        self._datastore = datastore
+        self.__entity = 'checkpoints'
+        self.__id_attr = 'position'
+        self._datastore.add_entity(self.__entity, self.__id_attr)
+        self._positions = None
+        self._lock = threading.Lock()
+
+    def create(self, position, balances):
+        """Save a checkpoint, replacing any previous one at the same position.
+
+        :param position: log position of the next transaction
+        :param balances: dict mapping account ids to their balance
+        :returns: Checkpoint instance
+        """
+        instance = Checkpoint(position, balances)
+        positions = self.positions()
+        with self._lock:
+            index = bisect.bisect_left(positions, position)
+            if index < len(positions) and positions[index] == position:
+                self._datastore.update(self.__entity, instance.to_record(), self.__id_attr)
+            else:
+                self._datastore.create(self.__entity, instance.to_record())
+                positions.insert(index, position)
+        return instance
+
+    def adjust(self, changes):
+        """Add balance changes of logged transactions to the checkpoints after them.
+
+        Used when transactions are deleted from the log, every checkpoint
+        taken after a change's position is rewritten once with the sum of
+        the changes before it.
+
+        :param changes: list of (log position, account id, amount) tuples
+        :returns: number of rewritten checkpoints
+        """
+        changes = sorted(changes)
+        if not changes:
+            return 0
+
+        positions = self.positions()
+        balances = {}
+        pending = 0
+        rewritten = 0
+        with self._lock:
+            for position in positions[bisect.bisect_right(positions, changes[0][0]):]:
+                while pending < len(changes) and changes[pending][0] < position:
+                    _, account_id, amount = changes[pending]
+                    balances[account_id] = balances.get(account_id, 0.0) + amount
+                    pending += 1
+                record = self._datastore.retrieve(self.__entity, self.__id_attr, position)
+                if record is None:
+                    continue
+                checkpoint = Checkpoint.from_dict(record)
+                for account_id, amount in balances.iteritems():
+                    checkpoint.balances[account_id] = checkpoint.balances.get(account_id, 0.0) + amount
+                self._datastore.update(self.__entity, checkpoint.to_record(), self.__id_attr)
+                rewritten += 1
+        return rewritten
+
+    def positions(self):
+        """List the log positions of the saved checkpoints in ascending order."""
+        if self._positions is None:
+            with self._lock:
+                if self._positions is None:
+                    self._positions = sorted(
+                        record[self.__id_attr]
+                        for record in self._datastore.filter(self.__entity, self.__id_attr))
+        return self._positions
+
+    def latest(self):
+        """Retrieve the checkpoint with the highest log position.
+
+        :returns: Checkpoint instance or None if there's none
+        """
+        return self.nearest(None)
+
+    def nearest(self, position):
+        """Retrieve the last checkpoint taken at or before a log position.
+
+        :param position: log position, None for the latest checkpoint
+        :returns: Checkpoint instance or None if there's none
+        """
+        positions = self.positions()
+        if position is None:
+            index = len(positions)
+        else:
+            index = bisect.bisect_right(positions, position)
+        if index == 0:
+            return None
+
+        record = self._datastore.retrieve(self.__entity, self.__id_attr, positions[index - 1])
+        if record is not None:
+            return Checkpoint.from_dict(record)
+
+    def count(self):
+        """Count the saved checkpoints."""
+        return len(self.positions())
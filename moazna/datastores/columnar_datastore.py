@@ -0,0 +1,290 @@
+"""Columnar in-memory store for transactions."""
+
+import bisect
+import heapq
+import itertools
+import uuid
+from array import array
+
+import datastore
+from moazna.dates import DAY_BITS, from_ordinal, to_ordinal
+from moazna.reports import TransactionFrame
+from ordered import OrderedBuckets
+
+try:
+    array('q')
+    CENTS_TYPECODE = 'q'
+except ValueError:
+    # python 2 has no 'q', 'l' is 64 bit on LP64 platforms
+    CENTS_TYPECODE = 'l'
+
+ID_SIZE = 16
+# (account, day) indexes -> the account id attribute they key on
+ACCOUNT_DAY_KEYS = {'payer_day': 'payer_id', 'recipient_day': 'recipient_id'}
+
+
+class ColumnarTransactionStore(datastore.Datastore):
+    """Datastore keeping transactions in contiguous typed arrays.
+
+    Every transaction is a row across the columns:
+        - ids: 16 byte uuids packed in a bytearray
+        - amounts: int64 cents
+        - days: int32 day ordinals
+        - payers, recipients: int32 account ids
+        - positions: int64 transaction log positions, ascending as rows are
+          appended in order
+        - live: one byte flag per row, cleared when the row is deleted
+
+    Rows are only turned into transaction dicts when they're read, while
+    aggregates run over the arrays directly. Live rows are found by id
+    through a dict, by account and by day through lists of their rows. The
+    store holds a single entity of transaction records, with `id`, `amount`,
+    `payer_id`, `recipient_id`, `date` and `position` attributes. Amounts
+    are rounded to cents.
+    """
+
+    def __init__(self):
+        self.ids = bytearray()
+        self.amounts = array(CENTS_TYPECODE)
+        self.days = array('i')
+        self.payers = array('i')
+        self.recipients = array('i')
+        self.positions = array(CENTS_TYPECODE)
+        self.live = bytearray()
+        # account id -> array of the rows the account pays/receives in, ascending
+        self._payer_rows = {}
+        self._recipient_rows = {}
+        # day ordinal -> array of the rows on that day, ascending
+        self._day_rows = OrderedBuckets(lambda: array('i'))
+        # packed id -> row of the live transactions
+        self._rows = {}
+        self._deleted = 0
+
+    def create(self, entity, instance):
+        self.__append(instance)
+        return instance
+
+    def retrieve(self, entity, key, value):
+        if key == 'id':
+            row = self.__find(value)
+            if row is not None:
+                return self.__record(row)
+            return None
+
+        for record in self.filter(entity, key, [value]):
+            return record
+
+    def update(self, entity, instance, id_attr):
+        row = self.__find(instance[id_attr])
+        if row is None:
+            return None
+
+        record = self.__record(row)
+        record.update(instance)
+        self.amounts[row] = _to_cents(record['amount'])
+        day = to_ordinal(record['date'])
+        if self.days[row] != day:
+            self.__unindex_day(row)
+            bisect.insort(self._day_rows.bucket(day), row)
+            self.days[row] = day
+        self.__move(self._payer_rows, self.payers, row, record['payer_id'])
+        self.__move(self._recipient_rows, self.recipients, row, record['recipient_id'])
+        return record
+
+    def delete(self, entity, id_attr, value):
+        row = self.__find(value)
+        if row is not None:
+            self.live[row] = 0
+            self._deleted += 1
+            del self._rows[uuid.UUID(value).bytes]
+            self.__unindex_day(row)
+            self._payer_rows[self.payers[row]].remove(row)
+            self._recipient_rows[self.recipients[row]].remove(row)
+
+    def add_entity(self, entity, id_attr=None, indexes=None):
+        pass
+
+    def count(self, entity):
+        return len(self.live) - self._deleted
+
+    def filter(self, entity, key, values=[]):
+        if not isinstance(values, (list, tuple, set, frozenset)):
+            values = [values]
+        if key is None or len(values) == 0:
+            rows = self.__live_rows()
+        elif key in ('payer_id', 'recipient_id', 'party_id'):
+            rows = self.__rows_by_account(key, values)
+        elif key == 'position':
+            rows = sorted(self.__rows_by_position(values))
+        elif key == 'date':
+            days = set(to_ordinal(value) for value in values)
+            rows = sorted(row for day in days for row in self._day_rows.get(day, ()))
+        else:
+            rows = (row for row in self.__live_rows()
+                    if self.__record(row)[key] in values)
+        return [self.__record(row) for row in rows]
+
+    def filter_range(self, entity, key, start, end):
+        """Filter the transactions by a range of days.
+
+        Supports the 'day' attribute and the `account_day` keys of the
+        'payer_day' and 'recipient_day' indexes, whose range must be within
+        a single account.
+        Days are looked up in the ordered day index, for an account the day
+        column of its rows is scanned.
+        """
+        if key == 'day':
+            return [self.__record(row) for _, rows in self._day_rows.range(start, end)
+                    for row in rows]
+        elif key in ACCOUNT_DAY_KEYS and start >> DAY_BITS == end >> DAY_BITS:
+            rows = self.__rows_by_account(ACCOUNT_DAY_KEYS[key], [start >> DAY_BITS])
+            start &= (1 << DAY_BITS) - 1
+            end &= (1 << DAY_BITS) - 1
+        else:
+            return super(ColumnarTransactionStore, self).filter_range(entity, key, start, end)
+
+        days = self.days
+        rows = [row for row in rows if start <= days[row] <= end]
+        rows.sort(key=days.__getitem__)
+        return [self.__record(row) for row in rows]
+
+    def scan(self, entity, order_by=None, after=None, limit=None, offset=0):
+        attrs, after = datastore.scan_order(order_by, after)
+        if attrs == ('position',):
+            # rows are appended in log position order
+            start = 0 if after is None else bisect.bisect_right(self.positions, after[0])
+            rows = (row for row in xrange(start, len(self.live)) if self.live[row])
+        elif not attrs:
+            rows = self.__live_rows()
+        else:
+            return super(ColumnarTransactionStore, self).scan(entity, order_by, after, limit, offset)
+        return datastore.page((self.__record(row) for row in rows), limit, offset)
+
+    def net_by_account(self):
+        """Net flow of every account over all transactions.
+
+        :returns: dict mapping account ids to the received minus paid amount
+        """
+        net = {}
+        for amount, payer, recipient, live in itertools.izip(
+                self.amounts, self.payers, self.recipients, self.live):
+            if live:
+                net[payer] = net.get(payer, 0) - amount
+                net[recipient] = net.get(recipient, 0) + amount
+        return dict((account_id, cents / 100.0) for account_id, cents in net.iteritems())
+
+    def sum_by_date_range(self, start, end):
+        """Total amount of the transactions between two dates, inclusive.
+
+        Only the rows of the days in the range are summed, looked up in the
+        ordered day index.
+
+        :param start: first 'YYYY-MM-DD' date of the range
+        :param end: last 'YYYY-MM-DD' date of the range
+        """
+        amounts = self.amounts
+        return sum(amounts[row] for _, rows in self._day_rows.range(to_ordinal(start), to_ordinal(end))
+                   for row in rows) / 100.0
+
+    def to_frame(self, names):
+        """Build a TransactionFrame of the live rows without going through dicts.
+
+        :param names: list of account names indexed by account id
+        """
+        frame = TransactionFrame(names)
+
+        if self._deleted:
+            select = lambda column: itertools.compress(column, self.live)
+        else:
+            select = iter
+        frame.amounts = array('d', (cents / 100.0 for cents in select(self.amounts)))
+        frame.dates = array('l', select(self.days))
+        frame.payers = array('l', select(self.payers))
+        frame.recipients = array('l', select(self.recipients))
+        return frame
+
+    def __append(self, instance):
+        row = len(self.live)
+        txn_id = uuid.UUID(instance['id']).bytes
+        self.ids.extend(txn_id)
+        self._rows[txn_id] = row
+        self.amounts.append(_to_cents(instance['amount']))
+        day = to_ordinal(instance['date'])
+        self.days.append(day)
+        self._day_rows.bucket(day).append(row)
+        payer = instance['payer_id']
+        recipient = instance['recipient_id']
+        self.payers.append(payer)
+        self.recipients.append(recipient)
+        self.positions.append(instance.get('position', row))
+        self.live.append(1)
+        self._payer_rows.setdefault(payer, array('i')).append(row)
+        self._recipient_rows.setdefault(recipient, array('i')).append(row)
+        return row
+
+    def __find(self, txn_id):
+        try:
+            needle = uuid.UUID(txn_id).bytes
+        except (ValueError, TypeError, AttributeError):
+            return None
+        return self._rows.get(needle)
+
+    def __record(self, row):
+        offset = row * ID_SIZE
+        return {
+            'id': str(uuid.UUID(bytes=str(self.ids[offset:offset + ID_SIZE]))),
+            'amount': self.amounts[row] / 100.0,
+            'payer_id': self.payers[row],
+            'recipient_id': self.recipients[row],
+            'date': from_ordinal(self.days[row]),
+            'position': self.positions[row],
+        }
+
+    def __live_rows(self):
+        if self._deleted:
+            return itertools.compress(itertools.count(), self.live)
+        return iter(xrange(len(self.live)))
+
+    def __rows_by_account(self, key, account_ids):
+        indexes = []
+        if key in ('payer_id', 'party_id'):
+            indexes.append(self._payer_rows)
+        if key in ('recipient_id', 'party_id'):
+            indexes.append(self._recipient_rows)
+
+        row_lists = [index[account_id] for index in indexes
+                     for account_id in set(account_ids) if account_id in index]
+        if len(row_lists) == 1:
+            return iter(row_lists[0])
+        return _unique(heapq.merge(*row_lists))
+
+    def __rows_by_position(self, values):
+        for value in set(values):
+            row = bisect.bisect_left(self.positions, value)
+            if row < len(self.positions) and self.positions[row] == value and self.live[row]:
+                yield row
+
+    def __unindex_day(self, row):
+        day = self.days[row]
+        rows = self._day_rows[day]
+        rows.remove(row)
+        if not rows:
+            self._day_rows.drop(day)
+
+    def __move(self, index, column, row, account_id):
+        if column[row] != account_id:
+            index[column[row]].remove(row)
+            bisect.insort(index.setdefault(account_id, array('i')), row)
+            column[row] = account_id
+
+
+def _to_cents(amount):
+    return int(round(amount * 100))
+
+
+def _unique(rows):
+    previous = None
+    for row in rows:
+        if row != previous:
+            yield row
+            previous = row
@@ -1,6 +1,9 @@
 """DataStore class for general data persistance operations."""
 
 import abc
+import heapq
+import itertools
+from contextlib import contextmanager
 
 
 class Datastore:
@@ -13,6 +16,15 @@ class Datastore:
 
     __metaclass__ = abc.ABCMeta
 
+    @contextmanager
+    def transaction(self):
+        """Group the operations done inside a `with` block into one unit.
+
+        Datastores supporting transactions should override this to commit
+        the operations together, the default implementation does nothing.
+        """
+        yield
+
     @abc.abstractmethod
     def create(self, entity, **kwargs):
         """Create an new instance.
@@ -23,32 +35,92 @@ class Datastore:
         """
         pass
 
+    def create_many(self, entity, instances):
+        """Create new instances in bulk.
+
+        Datastores able to batch writes should override this, the default
+        implementation creates the instances one by one.
+
+        :param entity: entity collection name
+        :param instances: iterable of instances to be created
+        :returns: number of created instances
+        """
+        count = 0
+        for instance in instances:
+            self.create(entity, instance)
+            count += 1
+        return count
+
     @abc.abstractmethod
-    def retrieve(self, entity, instance_id):
+    def retrieve(self, entity, key, value):
         """Retrieve an existing instance.
 
+        Lookups by the entity's id attribute are expected to be
+        constant time.
+
         :param entity: entity collection name
-        :param instance_: The id of the instance to be retrieved
+        :param key: The attribute to look the instance up by
+        :param value: The value of the attribute
         :returns: python dict representing the retrieved resource
         """
         pass
 
     @abc.abstractmethod
-    def update(self, entity, instance):
+    def update(self, entity, instance, id_attr):
         """Update and existing instance.
 
         :param entity: entity collection name
         :param instance: The instance to be updated
+        :param id_attr: The attribute identifying the instance
         :returns: python dict representing the updated object
         """
         pass
 
+    def update_many(self, entity, instances, id_attr):
+        """Update existing instances in bulk.
+
+        Datastores able to batch writes should override this, the default
+        implementation updates the instances one by one.
+
+        :param entity: entity collection name
+        :param instances: iterable of instances to be updated
+        :param id_attr: The attribute identifying the instances
+        :returns: number of updated instances
+        """
+        count = 0
+        for instance in instances:
+            if self.update(entity, instance, id_attr) is not None:
+                count += 1
+        return count
+
     @abc.abstractmethod
-    def delete(self, entity, instance_id):
+    def delete(self, entity, id_attr, value):
         """Delete an existing instance.
 
         :param entity: entity collection name
-        :param instance_id: The id of the instance to be deleted
+        :param id_attr: The attribute identifying the instance
+        :param value: The id of the instance to be deleted
+        """
+        pass
+
+    @abc.abstractmethod
+    def add_entity(self, entity, id_attr=None, indexes=None):
+        """Register an entity collection.
+
+        :param entity: entity collection name
+        :param id_attr: The attribute uniquely identifying the entity's instances
+        :param indexes: Dict mapping secondary index names to the attribute(s)
+                        they index. An index over several attributes matches
+                        an instance if any of the attributes holds the value
+        """
+        pass
+
+    @abc.abstractmethod
+    def count(self, entity):
+        """Count the instances of an entity collection.
+
+        :param entity: entity collection name
+        :returns: number of instances
         """
         pass
 
@@ -57,6 +129,94 @@ class Datastore:
         """Filter entity collection by values.
 
         :param entity: entity collection name
-        :param key: The key to use for filtering the collection
-        :param values: List of values to filter with
+        :param key: The key or secondary index name to use for filtering the collection
+        :param values: List of values to filter with, or a single value
+        :returns: list of matching python dicts in insertion order
+        """
+
+    def filter_range(self, entity, key, start, end):
+        """Filter entity collection by a range of values.
+
+        Datastores keeping their indexed values sorted should override this,
+        the default implementation scans the whole collection and only
+        supports attribute names as keys.
+
+        :param entity: entity collection name
+        :param key: The key or secondary index name to use for filtering the collection
+        :param start: lowest value of the range
+        :param end: highest value of the range, inclusive
+        :returns: list of matching python dicts ordered by the value, in
+                  insertion order for equal values
+        """
+        records = [elem for elem in self.filter(entity, None) or []
+                   if key in elem and start <= elem[key] <= end]
+        records.sort(key=lambda elem: elem[key])
+        return records
+
+    def scan(self, entity, order_by=None, after=None, limit=None, offset=0):
+        """Iterate over an entity collection lazily, a page at a time.
+
+        Instances are returned in insertion order, or ordered by the
+        attributes in `order_by`, which should identify an instance, e.g.
+        ('date', 'id'). Keyset pagination passes the `order_by` values of
+        the last instance of a page as `after` to get the next page.
+
+        Datastores able to iterate in order without loading the whole
+        collection should override this, the default implementation filters
+        all instances and sorts them. Don't write to the entity while
+        consuming the iterator.
+
+        :param entity: entity collection name
+        :param order_by: attribute name or tuple of attribute names
+        :param after: value or tuple of values of the `order_by` attributes,
+                      only instances ordered after them are returned
+        :param limit: maximum number of instances
+        :param offset: number of instances to skip
+        :returns: iterator of python dicts
         """
+        attrs, after = scan_order(order_by, after)
+        records = self.filter(entity, None) or []
+        if attrs:
+            key = lambda record: tuple(record[attr] for attr in attrs)
+            if after is not None:
+                records = (record for record in records if key(record) > after)
+            if limit is None:
+                records = sorted(records, key=key)
+            else:
+                records = heapq.nsmallest(offset + limit, records, key=key)
+        return page(records, limit, offset)
+
+
+def is_transactional(datastore):
+    """Whether a datastore undoes the operations of a failed `transaction` block.
+
+    Datastores overriding `transaction` roll back, wrappers holding the
+    datastore they call as `wrapped` do whatever it does.
+    """
+    while hasattr(datastore, 'wrapped'):
+        datastore = datastore.wrapped
+    return type(datastore).transaction.__func__ is not Datastore.transaction.__func__
+
+
+def scan_order(order_by, after):
+    """Normalize the `order_by` and `after` arguments of `Datastore.scan`.
+
+    :returns: tuple of (tuple of attribute names, tuple of values or None)
+    :raises ValueError: if `after` doesn't match the `order_by` attributes
+    """
+    if order_by is None:
+        if after is not None:
+            raise ValueError('keyset pagination needs order_by attributes')
+        return (), None
+
+    attrs = (order_by,) if isinstance(order_by, basestring) else tuple(order_by)
+    if after is not None:
+        after = tuple(after) if isinstance(after, (list, tuple)) else (after,)
+        if len(after) != len(attrs):
+            raise ValueError('expected {0} values after, got {1}'.format(len(attrs), len(after)))
+    return attrs, after
+
+
+def page(records, limit, offset):
+    """Slice an iterable of records lazily by `limit` and `offset`."""
+    return itertools.islice(records, offset, None if limit is None else offset + limit)
@@ -0,0 +1,147 @@
+"""Datastore wrapper collecting call statistics."""
+
+import time
+from contextlib import contextmanager
+
+import datastore
+from moazna.instrumentation import Stats
+
+
+class InstrumentedDatastore(datastore.Datastore):
+    """Datastore counting and timing every call to a wrapped datastore.
+
+    The calls, the records they read, wrote and examined, whole entity
+    scans and latency histograms are collected per (operation, entity) in a
+    Stats instance, see `Stats.to_dict`. Lookups and filters on a key that
+    isn't the id attribute or an index declared through `add_entity`, and
+    filters without values, scan the whole entity: all of its records are
+    counted as examined. Transactions are counted and timed however they
+    end. Only wrap a datastore while measuring, an unwrapped datastore has
+    no overhead at all.
+
+    Attributes the Datastore interface doesn't define, like `close`, are
+    passed through to the wrapped datastore without being counted.
+    """
+
+    def __init__(self, wrapped, stats=None):
+        self.wrapped = wrapped
+        self.stats = stats if stats is not None else Stats()
+        # entity -> keys looked up without scanning, the id attribute and index names
+        self._indexed = {}
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    @contextmanager
+    def transaction(self):
+        started = time.time()
+        try:
+            with self.wrapped.transaction():
+                yield
+        finally:
+            self.stats.record_call('transaction', None, time.time() - started)
+
+    def create(self, entity, instance):
+        started = time.time()
+        record = self.wrapped.create(entity, instance)
+        self.stats.record_call('create', entity, time.time() - started, written=1)
+        return record
+
+    def create_many(self, entity, instances):
+        instances = list(instances)
+        started = time.time()
+        count = self.wrapped.create_many(entity, instances)
+        self.stats.record_call('create_many', entity, time.time() - started,
+                               written=len(instances))
+        return count
+
+    def retrieve(self, entity, key, value):
+        started = time.time()
+        record = self.wrapped.retrieve(entity, key, value)
+        elapsed = time.time() - started
+        read = int(record is not None)
+        self.stats.record_call('retrieve', entity, elapsed, read=read,
+                               **self.__scan_counts(entity, key, read))
+        return record
+
+    def update(self, entity, instance, id_attr):
+        started = time.time()
+        record = self.wrapped.update(entity, instance, id_attr)
+        self.stats.record_call('update', entity, time.time() - started, written=1)
+        return record
+
+    def update_many(self, entity, instances, id_attr):
+        instances = list(instances)
+        started = time.time()
+        count = self.wrapped.update_many(entity, instances, id_attr)
+        self.stats.record_call('update_many', entity, time.time() - started,
+                               written=len(instances))
+        return count
+
+    def delete(self, entity, id_attr, value):
+        started = time.time()
+        result = self.wrapped.delete(entity, id_attr, value)
+        self.stats.record_call('delete', entity, time.time() - started)
+        return result
+
+    def add_entity(self, entity, id_attr=None, indexes=None):
+        keys = self._indexed.setdefault(entity, set())
+        if id_attr is not None:
+            keys.add(id_attr)
+        keys.update(indexes or ())
+        return self.wrapped.add_entity(entity, id_attr, indexes)
+
+    def count(self, entity):
+        started = time.time()
+        count = self.wrapped.count(entity)
+        self.stats.record_call('count', entity, time.time() - started)
+        return count
+
+    def filter(self, entity, key, values=[]):
+        started = time.time()
+        records = self.wrapped.filter(entity, key, values)
+        elapsed = time.time() - started
+        read = len(records) if records is not None else 0
+        if isinstance(values, (list, tuple, set, frozenset)) and not values:
+            key = None
+        self.stats.record_call('filter', entity, elapsed, read=read,
+                               **self.__scan_counts(entity, key, read))
+        return records
+
+    def filter_range(self, entity, key, start, end):
+        started = time.time()
+        records = self.wrapped.filter_range(entity, key, start, end)
+        elapsed = time.time() - started
+        read = len(records) if records is not None else 0
+        self.stats.record_call('filter_range', entity, elapsed, read=read,
+                               **self.__scan_counts(entity, key, read))
+        return records
+
+    def scan(self, entity, order_by=None, after=None, limit=None, offset=0):
+        started = time.time()
+        records = self.wrapped.scan(entity, order_by, after, limit, offset)
+        return self.__count_scan(entity, records, time.time() - started, limit is None, offset)
+
+    def __scan_counts(self, entity, key, read):
+        """Flag a lookup on a key without an index as a scan of all the records of the entity.
+
+        :returns: dict of the `scan` and `scanned` arguments of `Stats.record_call`
+        """
+        if key is not None and key in self._indexed.get(entity, ()):
+            return {'scan': False, 'scanned': read}
+        return {'scan': True, 'scanned': self.wrapped.count(entity) or 0}
+
+    def __count_scan(self, entity, records, elapsed, scan, offset):
+        """Pass scanned records through, recording the call once iteration stops."""
+        read = 0
+        mark = time.time()
+        try:
+            for record in records:
+                elapsed += time.time() - mark
+                read += 1
+                yield record
+                mark = time.time()
+            elapsed += time.time() - mark
+        finally:
+            self.stats.record_call('scan', entity, elapsed, read=read, scan=scan,
+                                   scanned=offset + read)
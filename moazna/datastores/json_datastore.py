@@ -1,57 +1,89 @@
 """In-memory JSON datastore."""
 
+import itertools
+from collections import OrderedDict
+
 import datastore
+from ordered import OrderedBuckets
 
 
 class JsonDatastore(datastore.Datastore):
+    """In-memory datastore keeping every entity as an ordered hash map.
+
+    Records are keyed by the entity's id attribute (declared through
+    `add_entity`) so that lookups by id don't need to scan the whole
+    collection, while the map still preserves insertion order for `filter`.
+    Entities without an id attribute are keyed by an internal counter and
+    fall back to scanning.
+
+    Secondary indexes declared through `add_entity` map every indexed value
+    to the records holding it, so equality filters on them cost O(matches).
+    The indexed values are also kept sorted once an index is first used by
+    `filter_range`, range filters then cost O(log n + matches).
+
+    Like a primary key, the id attribute is unique: creating a record with
+    the id of an existing one raises a ValueError instead of overwriting it.
+    """
+
     def __init__(self):
         self._data = {}
+        self._id_attrs = {}
+        self._indexes = {}
+        self._seqs = {}
+        self._counter = itertools.count()
 
     def create(self, entity, instance):
         if not self.__has_entity(entity):
             self.add_entity(entity)
 
-        self._data[entity].append(instance)
-        return self._data[entity][-1]
+        key = self.__key_for(entity, instance)
+        records = self._data[entity]
+        if key in records:
+            raise ValueError('duplicate {0} id {1!r}'.format(entity, key))
+        records[key] = instance
+        self._seqs[entity][key] = next(self._counter)
+        self.__index(entity, key, instance)
+        return instance
 
     def retrieve(self, entity, key, value):
-        instance = None
         if self.__has_entity(entity):
-            entity_list = self._data[entity]
-
-            for elem in entity_list:
-                if elem[key] == value:
-                    return elem
+            return self.__find(entity, key, value)[1]
 
     def update(self, entity, instance, id_attr):
         if self.__has_entity(entity):
-            entity_list = self._data[entity]
-            elem = self.retrieve(entity, id_attr, instance[id_attr])
+            key, elem = self.__find(entity, id_attr, instance[id_attr])
 
             if elem is not None:
-                entity_list.remove(elem)
-                for key, value in instance.iteritems():
-                    try:
-                        if elem[key] != value:
-                            elem[key] = value
-                    except KeyError:
-                        elem[key] = value
-
-            entity_list.append(elem)
+                indexes = self._indexes[entity].values()
+                old_values = [self.__indexed_values(attrs, elem)
+                              for attrs, _ in indexes]
+                elem.update(instance)
+                for index, old in zip(indexes, old_values):
+                    self.__reindex_one(index, key, elem, old)
 
             return elem
 
     def delete(self, entity, id_attr, value):
         if self.__has_entity(entity):
-            entity_list = self._data[entity]
-            elem = self.retrieve(entity, id_attr, value)
+            key, elem = self.__find(entity, id_attr, value)
 
             if elem is not None:
-                entity_list.remove(elem)
+                self.__unindex(entity, key, elem)
+                del self._data[entity][key]
+                del self._seqs[entity][key]
 
-    def add_entity(self, entity):
+    def add_entity(self, entity, id_attr=None, indexes=None):
         if not self.__has_entity(entity):
-            self._data[entity] = []
+            self._data[entity] = OrderedDict()
+            self._id_attrs[entity] = id_attr
+            self._indexes[entity] = {}
+            self._seqs[entity] = {}
+        elif id_attr is not None and self._id_attrs[entity] != id_attr:
+            self.__rekey(entity, id_attr)
+
+        for name, attrs in (indexes or {}).iteritems():
+            if name not in self._indexes[entity]:
+                self.__build_index(entity, name, attrs)
 
     def count(self, entity):
         if self.__has_entity(entity):
@@ -60,9 +92,122 @@ class JsonDatastore(datastore.Datastore):
     def __has_entity(self, entity):
         return entity in self._data
 
+    def __key_for(self, entity, instance):
+        id_attr = self._id_attrs[entity]
+        if id_attr is None:
+            return next(self._counter)
+        return instance[id_attr]
+
+    def __find(self, entity, key, value):
+        """Find a record and its internal key.
+
+        :returns: tuple of (internal key, record) or (None, None) if not found
+        """
+        records = self._data[entity]
+        if key == self._id_attrs[entity]:
+            return value, records.get(value)
+
+        for record_key, elem in records.iteritems():
+            if elem[key] == value:
+                return record_key, elem
+        return None, None
+
+    def __rekey(self, entity, id_attr):
+        records = self._data[entity]
+        seqs = self._seqs[entity]
+        self._data[entity] = OrderedDict(
+            (elem[id_attr], elem) for elem in records.itervalues())
+        self._seqs[entity] = dict(
+            (elem[id_attr], seqs[key]) for key, elem in records.iteritems())
+        self._id_attrs[entity] = id_attr
+
+        for name, (attrs, _) in self._indexes[entity].items():
+            self.__build_index(entity, name, attrs)
+
+    def __build_index(self, entity, name, attrs):
+        if isinstance(attrs, basestring):
+            attrs = (attrs,)
+        self._indexes[entity][name] = (tuple(attrs), OrderedBuckets(OrderedDict))
+        for key, elem in self._data[entity].iteritems():
+            self.__index_one(self._indexes[entity][name], key, elem)
+
+    def __indexed_values(self, attrs, elem):
+        return set(elem[attr] for attr in attrs if attr in elem)
+
+    def __index_one(self, index, key, elem):
+        attrs, buckets = index
+        for value in self.__indexed_values(attrs, elem):
+            buckets.bucket(value)[key] = elem
+
+    def __reindex_one(self, index, key, elem, old_values):
+        attrs, buckets = index
+        new_values = self.__indexed_values(attrs, elem)
+        for value in old_values - new_values:
+            self.__remove_from_bucket(buckets, value, key)
+        for value in new_values - old_values:
+            buckets.bucket(value)[key] = elem
+
+    def __remove_from_bucket(self, buckets, value, key):
+        bucket = buckets[value]
+        del bucket[key]
+        if not bucket:
+            buckets.drop(value)
+
+    def __index(self, entity, key, elem):
+        for index in self._indexes[entity].itervalues():
+            self.__index_one(index, key, elem)
+
+    def __unindex(self, entity, key, elem):
+        for attrs, buckets in self._indexes[entity].itervalues():
+            for value in self.__indexed_values(attrs, elem):
+                self.__remove_from_bucket(buckets, value, key)
+
+    def __lookup(self, entity, index, values):
+        buckets = index[1]
+        if len(values) == 1:
+            return buckets.get(next(iter(values)), {}).values()
+
+        matches = {}
+        for value in set(values):
+            matches.update(buckets.get(value, {}))
+        seqs = self._seqs[entity]
+        return [matches[key] for key in sorted(matches, key=seqs.__getitem__)]
+
     def filter(self, entity, key, values=[]):
         if self.__has_entity(entity):
+            records = self._data[entity]
+            if not isinstance(values, (list, tuple, set, frozenset)):
+                values = [values]
             if key is None or len(values) == 0:
-                return self._data[entity]
+                return records.values()
+
+            index = self._indexes[entity].get(key)
+            if index is not None:
+                return self.__lookup(entity, index, values)
 
-            return [elem for elem in self._data[entity] if elem[key] in values]
+            return [elem for elem in records.itervalues() if elem[key] in values]
+
+    def filter_range(self, entity, key, start, end):
+        if self.__has_entity(entity):
+            index = self._indexes[entity].get(key)
+            if index is None:
+                return super(JsonDatastore, self).filter_range(entity, key, start, end)
+
+            attrs, buckets = index
+            records = []
+            seen = set()
+            for _, bucket in buckets.range(start, end):
+                for record_key, elem in bucket.iteritems():
+                    # records indexed under several values of the range are listed once
+                    if len(attrs) == 1 or record_key not in seen:
+                        seen.add(record_key)
+                        records.append(elem)
+            return records
+
+    def scan(self, entity, order_by=None, after=None, limit=None, offset=0):
+        if order_by is not None:
+            return super(JsonDatastore, self).scan(entity, order_by, after, limit, offset)
+        datastore.scan_order(order_by, after)
+        if not self.__has_entity(entity):
+            return iter([])
+        return datastore.page(self._data[entity].itervalues(), limit, offset)
@@ -0,0 +1,587 @@
+"""Persistent datastore backed by an append-only log file."""
+
+import itertools
+import marshal
+import mmap
+import os
+import struct
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+import datastore
+from ordered import OrderedBuckets
+
+MAGIC = 'MOAZNALG'
+FILE_HEADER = struct.Struct('<8s16s')
+ENTRY_HEADER = struct.Struct('<BII')
+MARSHAL_VERSION = 2
+
+PUT = 1
+DELETE = 2
+META = 3
+BEGIN = 4
+COMMIT = 5
+
+
+class LogDatastore(datastore.Datastore):
+    """Datastore persisting records to an append-only log file.
+
+    Every create/update appends the whole record to the log in marshal's
+    binary encoding, deletes append a tombstone. An in-memory index maps
+    the id of every record to the position of its latest version in the
+    log, records themselves are only decoded when they're read, through a
+    memory map of the log. Opening a log only goes over the entry headers
+    and ids, not the records.
+
+    The index is saved to a hint file next to the log by `close` and
+    `compact`, opening the log afterwards only scans the entries appended
+    since. The index can always be rebuilt from the log alone.
+
+    Secondary indexes are built on their first use, as building them
+    requires decoding every record of the entity. Range filters keep the
+    values of an index sorted from their first use on.
+
+    Creating a record with the id of an existing one raises a ValueError,
+    updates are the only way to overwrite a record.
+
+    Overwritten and deleted records keep taking space in the log until
+    `compact` rewrites it with the latest version of every record.
+
+    The entries appended inside `transaction` are enclosed in begin and
+    commit markers. If the block raises they're cut off the log, and a
+    group left without its commit marker by a crash is dropped when the
+    log is opened, so a transaction is applied whole or not at all. The
+    commit is flushed to the OS, `sync` also makes it durable.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._hint_path = path + '.hint'
+        self._id_attrs = {}
+        # entity -> OrderedDict mapping record keys to (offset, length, seq) in
+        # insertion order, seq sorts the keys found through an index
+        self._locations = {}
+        # entity -> {index name: [attrs, buckets or None until built]}
+        self._indexes = {}
+        self._seq = itertools.count()
+        self._next_key = 0
+        self.dead_bytes = 0
+        # nesting of transaction blocks, and log offset of the begin marker of
+        # the current transaction once it has appended something
+        self._depth = 0
+        self._begin = None
+
+        self._map = None
+        self._file = open(path, 'ab+')
+        self._size = os.fstat(self._file.fileno()).st_size
+        if self._size == 0:
+            self._generation = os.urandom(16)
+            self._file.write(FILE_HEADER.pack(MAGIC, self._generation))
+            self._size = FILE_HEADER.size
+        self.__load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def transaction(self):
+        if self._depth == 0:
+            self._begin = None
+        self._depth += 1
+        try:
+            yield
+        except:
+            exc_info = sys.exc_info()
+            self._depth -= 1
+            if self._depth == 0 and self._begin is not None:
+                self.__rollback()
+            raise exc_info[0], exc_info[1], exc_info[2]
+        else:
+            self._depth -= 1
+            if self._depth == 0 and self._begin is not None:
+                self.__append([(COMMIT, None, None, '')])
+                self._file.flush()
+
+    def create(self, entity, instance):
+        if not self.__has_entity(entity):
+            self.add_entity(entity)
+
+        self.__put_many(entity, self.__new_items(entity, [instance]))
+        return instance
+
+    def create_many(self, entity, instances):
+        if not self.__has_entity(entity):
+            self.add_entity(entity)
+
+        items = self.__new_items(entity, instances)
+        self.__put_many(entity, items)
+        return len(items)
+
+    def retrieve(self, entity, key, value):
+        if self.__has_entity(entity):
+            return self.__find(entity, key, value)[1]
+
+    def update(self, entity, instance, id_attr):
+        if self.__has_entity(entity):
+            key, elem = self.__find(entity, id_attr, instance[id_attr])
+
+            if elem is not None:
+                elem.update(instance)
+                self.__put_many(entity, [(key, elem)])
+
+            return elem
+
+    def delete(self, entity, id_attr, value):
+        if self.__has_entity(entity):
+            key, elem = self.__find(entity, id_attr, value)
+
+            if elem is not None:
+                self.__unindex(entity, key, elem)
+                self.__append([(DELETE, entity, key, '')])
+                self.__forget(entity, key)
+
+    def add_entity(self, entity, id_attr=None, indexes=None):
+        if not self.__has_entity(entity):
+            self._locations[entity] = OrderedDict()
+            self.__set_id_attr(entity, id_attr)
+        elif id_attr is not None and self._id_attrs.get(entity) != id_attr:
+            self.__rekey(entity, id_attr)
+
+        entity_indexes = self._indexes.setdefault(entity, {})
+        for name, attrs in (indexes or {}).iteritems():
+            if name not in entity_indexes:
+                if isinstance(attrs, basestring):
+                    attrs = (attrs,)
+                entity_indexes[name] = [tuple(attrs), None]
+
+    def count(self, entity):
+        if self.__has_entity(entity):
+            return len(self._locations[entity])
+
+    def filter(self, entity, key, values=[]):
+        if self.__has_entity(entity):
+            if not isinstance(values, (list, tuple, set, frozenset)):
+                values = [values]
+            if key is None or len(values) == 0:
+                return [self.__read(location)
+                        for _, location in self.__ordered(entity)]
+
+            index = self._indexes.get(entity, {}).get(key)
+            if index is not None:
+                return self.__lookup(entity, index, values)
+
+            return [elem for elem in self.__records(entity) if elem[key] in values]
+
+    def filter_range(self, entity, key, start, end):
+        if self.__has_entity(entity):
+            index = self._indexes.get(entity, {}).get(key)
+            if index is None:
+                return super(LogDatastore, self).filter_range(entity, key, start, end)
+            if index[1] is None:
+                self.__build_index(entity, index)
+
+            locations = self._locations[entity]
+            records = []
+            seen = set()
+            for _, keys in index[1].range(start, end):
+                keys = keys - seen
+                seen.update(keys)
+                for location in sorted((locations[key] for key in keys),
+                                       key=lambda location: location[2]):
+                    records.append(self.__read(location))
+            return records
+
+    def scan(self, entity, order_by=None, after=None, limit=None, offset=0):
+        if order_by is not None:
+            return super(LogDatastore, self).scan(entity, order_by, after, limit, offset)
+        datastore.scan_order(order_by, after)
+        if not self.__has_entity(entity):
+            return iter([])
+        # only the records of the page are decoded
+        return datastore.page(self.__records(entity), limit, offset)
+
+    def compact(self):
+        """Rewrite the log keeping only the latest version of every record.
+
+        :raises ValueError: if the log is closed or a transaction is in progress
+        """
+        self.__check_open()
+        if self._depth:
+            raise ValueError('cannot compact {0} inside a transaction'.format(self._path))
+        self.__remap()
+        generation = os.urandom(16)
+        compact_path = self._path + '.compact'
+        locations = {}
+
+        with open(compact_path, 'wb') as compact_file:
+            compact_file.write(FILE_HEADER.pack(MAGIC, generation))
+            offset = FILE_HEADER.size
+            for entity in self._locations:
+                payload = marshal.dumps(
+                    {'id_attr': self._id_attrs.get(entity)}, MARSHAL_VERSION)
+                chunk, _, offset = _encode(META, entity, None, payload, offset)
+                compact_file.write(chunk)
+
+                locations[entity] = OrderedDict()
+                for key, (value_offset, length, seq) in self.__ordered(entity):
+                    payload = self._map[value_offset:value_offset + length]
+                    chunk, value_offset, offset = _encode(
+                        PUT, entity, key, payload, offset)
+                    compact_file.write(chunk)
+                    locations[entity][key] = (value_offset, length, seq)
+
+            compact_file.flush()
+            os.fsync(compact_file.fileno())
+
+        self.__close_files()
+        os.rename(compact_path, self._path)
+        self._file = open(self._path, 'ab+')
+        self._size = offset
+        self._generation = generation
+        self._locations = locations
+        self.dead_bytes = 0
+        self.__write_hint()
+
+    def sync(self):
+        """Flush the appended entries to disk.
+
+        :raises ValueError: if the log is closed
+        """
+        self.__check_open()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """Save the index to the hint file and close the log."""
+        if self._file is not None:
+            self.__write_hint()
+            self.__close_files()
+
+    def __check_open(self):
+        if self._file is None:
+            raise ValueError('{0} is closed'.format(self._path))
+
+    def __has_entity(self, entity):
+        return entity in self._locations
+
+    def __key_for(self, entity, instance):
+        id_attr = self._id_attrs.get(entity)
+        if id_attr is None:
+            key = self._next_key
+            self._next_key += 1
+            return key
+        return instance[id_attr]
+
+    def __new_items(self, entity, instances):
+        """Key new records, all of them or none are created.
+
+        :returns: list of (log key, record) tuples
+        :raises ValueError: if an id is already taken
+        """
+        items = [(self.__key_for(entity, instance), instance) for instance in instances]
+        locations = self._locations[entity]
+        keys = set()
+        for key, _ in items:
+            if key in locations or key in keys:
+                raise ValueError('duplicate {0} id {1!r}'.format(entity, key))
+            keys.add(key)
+        return items
+
+    def __set_id_attr(self, entity, id_attr):
+        self._id_attrs[entity] = id_attr
+        payload = marshal.dumps({'id_attr': id_attr}, MARSHAL_VERSION)
+        self.__append([(META, entity, None, payload)])
+
+    def __find(self, entity, key, value):
+        """Find a record and its key in the log.
+
+        :returns: tuple of (log key, record) or (None, None) if not found
+        """
+        locations = self._locations[entity]
+        if key == self._id_attrs.get(entity):
+            location = locations.get(value)
+            if location is None:
+                return None, None
+            return value, self.__read(location)
+
+        for record_key, location in self.__ordered(entity):
+            elem = self.__read(location)
+            if elem[key] == value:
+                return record_key, elem
+        return None, None
+
+    def __ordered(self, entity):
+        """Iterate over the (key, location) pairs of an entity in insertion order."""
+        return self._locations[entity].iteritems()
+
+    def __records(self, entity):
+        for _, location in self.__ordered(entity):
+            yield self.__read(location)
+
+    def __rekey(self, entity, id_attr):
+        records = [(key, self.__read(location))
+                   for key, location in self.__ordered(entity)]
+        self.__append([(DELETE, entity, key, '') for key, _ in records])
+        self._locations[entity] = OrderedDict()
+        self.__set_id_attr(entity, id_attr)
+        self.__put_many(entity, [(elem[id_attr], elem) for _, elem in records])
+        for index in self._indexes.get(entity, {}).itervalues():
+            index[1] = None
+
+    def __put_many(self, entity, items):
+        """Append new versions of records to the log.
+
+        :param items: list of (log key, record) tuples
+        """
+        previous = []
+        for key, elem in items:
+            old = None
+            if self.__has_built_index(entity) and key in self._locations[entity]:
+                old = self.__read(self._locations[entity][key])
+            previous.append(old)
+
+        locations = self.__append([
+            (PUT, entity, key, marshal.dumps(elem, MARSHAL_VERSION))
+            for key, elem in items])
+
+        entity_locations = self._locations[entity]
+        for (key, elem), old, (offset, length) in zip(items, previous, locations):
+            current = entity_locations.get(key)
+            if current is None:
+                seq = next(self._seq)
+            else:
+                seq = current[2]
+                self.dead_bytes += current[1]
+            entity_locations[key] = (offset, length, seq)
+            if old is not None:
+                self.__unindex(entity, key, old)
+            self.__index(entity, key, elem)
+
+    def __forget(self, entity, key):
+        location = self._locations[entity].pop(key, None)
+        if location is not None:
+            self.dead_bytes += location[1]
+
+    def __append(self, entries):
+        """Append entries to the log.
+
+        :param entries: list of (operation, entity, key, payload) tuples
+        :returns: list of (offset, length) tuples locating the entries' payloads
+        """
+        chunks = []
+        locations = []
+        offset = self._size
+        if self._depth and self._begin is None:
+            self._begin = offset
+            chunk, _, offset = _encode(BEGIN, None, None, '', offset)
+            chunks.append(chunk)
+        for op, entity, key, payload in entries:
+            chunk, value_offset, offset = _encode(op, entity, key, payload, offset)
+            chunks.append(chunk)
+            locations.append((value_offset, len(payload)))
+
+        self._file.write(''.join(chunks))
+        self._size = offset
+        return locations
+
+    def __read(self, location):
+        offset, length = location[0], location[1]
+        if self._map is None or offset + length > len(self._map):
+            self.__remap()
+        return marshal.loads(self._map[offset:offset + length])
+
+    def __rollback(self):
+        """Cut the current transaction off the log and reload the index."""
+        self._file.flush()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.truncate(self._begin)
+        self._size = self._begin
+        self._begin = None
+
+        self._id_attrs = {}
+        self._locations = {}
+        self._seq = itertools.count()
+        self._next_key = 0
+        self.dead_bytes = 0
+        for entity_indexes in self._indexes.itervalues():
+            for index in entity_indexes.itervalues():
+                index[1] = None
+        self.__load()
+
+    def __remap(self):
+        self._file.flush()
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __close_files(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        self._file = None
+
+    def __has_built_index(self, entity):
+        for _, buckets in self._indexes.get(entity, {}).itervalues():
+            if buckets is not None:
+                return True
+        return False
+
+    def __build_index(self, entity, index):
+        index[1] = OrderedBuckets(set)
+        for key, location in self.__ordered(entity):
+            self.__index_one(index, key, self.__read(location))
+
+    def __index_one(self, index, key, elem):
+        attrs, buckets = index
+        for value in set(elem[attr] for attr in attrs if attr in elem):
+            buckets.bucket(value).add(key)
+
+    def __index(self, entity, key, elem):
+        for index in self._indexes.get(entity, {}).itervalues():
+            if index[1] is not None:
+                self.__index_one(index, key, elem)
+
+    def __unindex(self, entity, key, elem):
+        for attrs, buckets in self._indexes.get(entity, {}).itervalues():
+            if buckets is None:
+                continue
+            for value in set(elem[attr] for attr in attrs if attr in elem):
+                bucket = buckets[value]
+                bucket.discard(key)
+                if not bucket:
+                    buckets.drop(value)
+
+    def __lookup(self, entity, index, values):
+        if index[1] is None:
+            self.__build_index(entity, index)
+
+        buckets = index[1]
+        keys = set()
+        for value in set(values):
+            keys.update(buckets.get(value, ()))
+        locations = self._locations[entity]
+        ordered = sorted((locations[key] for key in keys), key=lambda location: location[2])
+        return [self.__read(location) for location in ordered]
+
+    def __load(self):
+        """Rebuild the in-memory index from the hint file and the log."""
+        self.__remap()
+        magic, self._generation = FILE_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('{0} is not a moazna log file'.format(self._path))
+
+        offset = self.__read_hint()
+        if offset is None:
+            offset = FILE_HEADER.size
+
+        data = self._map
+        # entries of the transaction being read, replayed once it's committed
+        pending = None
+        while offset + ENTRY_HEADER.size <= self._size:
+            op, key_length, value_length = ENTRY_HEADER.unpack_from(data, offset)
+            key_offset = offset + ENTRY_HEADER.size
+            value_offset = key_offset + key_length
+            end = value_offset + value_length
+            if end > self._size:
+                break
+            entity, key = marshal.loads(data[key_offset:value_offset])
+            if op == BEGIN:
+                pending, begin = [], offset
+            elif op == COMMIT:
+                for entry in pending or ():
+                    self.__replay(*entry)
+                pending = None
+            elif pending is not None:
+                pending.append((op, entity, key, value_offset, value_length))
+            else:
+                self.__replay(op, entity, key, value_offset, value_length)
+            offset = end
+
+        if pending is not None:
+            # the last transaction wasn't committed, drop all of it
+            offset = begin
+        if offset < self._size:
+            # the last entry was only partially written, drop it
+            self._file.truncate(offset)
+            self._size = offset
+            self.__remap()
+
+    def __replay(self, op, entity, key, offset, length):
+        locations = self._locations.setdefault(entity, OrderedDict())
+        if op == META:
+            self._id_attrs[entity] = self.__read((offset, length))['id_attr']
+        elif op == PUT:
+            current = locations.get(key)
+            if current is None:
+                seq = next(self._seq)
+            else:
+                seq = current[2]
+                self.dead_bytes += current[1]
+            locations[key] = (offset, length, seq)
+            self.__track_key(key)
+        elif op == DELETE:
+            self.__forget(entity, key)
+
+    def __track_key(self, key):
+        if isinstance(key, (int, long)) and key >= self._next_key:
+            self._next_key = key + 1
+
+    def __read_hint(self):
+        """Load the index saved in the hint file.
+
+        :returns: log offset the hint covers, or None if there's no valid hint
+        """
+        try:
+            with open(self._hint_path, 'rb') as hint_file:
+                hint = marshal.loads(hint_file.read())
+        except (IOError, EOFError, ValueError, TypeError):
+            return None
+
+        if hint.get('generation') != self._generation or hint['size'] > self._size:
+            return None
+
+        self._id_attrs.update(hint['id_attrs'])
+        self.dead_bytes = hint['dead_bytes']
+        for entity, entries in hint['entities']:
+            locations = self._locations.setdefault(entity, OrderedDict())
+            for key, offset, length in entries:
+                locations[key] = (offset, length, next(self._seq))
+            for key in locations:
+                self.__track_key(key)
+        return hint['size']
+
+    def __write_hint(self):
+        self._file.flush()
+        hint = {
+            'generation': self._generation,
+            'size': self._size,
+            'dead_bytes': self.dead_bytes,
+            'id_attrs': self._id_attrs,
+            'entities': [
+                (entity, [(key, offset, length)
+                          for key, (offset, length, _) in self.__ordered(entity)])
+                for entity in self._locations
+            ],
+        }
+        hint_path = self._hint_path + '.tmp'
+        with open(hint_path, 'wb') as hint_file:
+            hint_file.write(marshal.dumps(hint, MARSHAL_VERSION))
+        os.rename(hint_path, self._hint_path)
+
+
+def _encode(op, entity, key, payload, offset):
+    """Encode a log entry.
+
+    :param offset: log offset the entry is written at
+    :returns: tuple of (entry bytes, payload offset, offset after the entry)
+    """
+    key_bytes = marshal.dumps((entity, key), MARSHAL_VERSION)
+    header = ENTRY_HEADER.pack(op, len(key_bytes), len(payload))
+    value_offset = offset + ENTRY_HEADER.size + len(key_bytes)
+    return header + key_bytes + payload, value_offset, value_offset + len(payload)
@@ -0,0 +1,113 @@
+"""Ordered index structures for range lookups."""
+
+import bisect
+
+# values per chunk of a SortedValues, chunks are split at twice the size
+CHUNK_SIZE = 512
+
+
+class SortedValues(object):
+    """Set of values kept in ascending order.
+
+    The values are stored in a list of sorted chunks of bounded size, so
+    adding or removing a value only shifts the values of one chunk and
+    listing the values in a range costs O(log n + k).
+    """
+
+    def __init__(self, values=()):
+        values = sorted(set(values))
+        self._chunks = [values[start:start + CHUNK_SIZE]
+                        for start in xrange(0, len(values), CHUNK_SIZE)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._len = len(values)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            for value in chunk:
+                yield value
+
+    def add(self, value):
+        """Add a value that isn't in the set yet."""
+        if not self._chunks:
+            self._chunks.append([value])
+            self._maxes.append(value)
+            self._len += 1
+            return
+
+        index = min(bisect.bisect_left(self._maxes, value), len(self._chunks) - 1)
+        chunk = self._chunks[index]
+        bisect.insort(chunk, value)
+        self._maxes[index] = chunk[-1]
+        self._len += 1
+        if len(chunk) > 2 * CHUNK_SIZE:
+            self._chunks[index:index + 1] = [chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:]]
+            self._maxes[index:index + 1] = [chunk[CHUNK_SIZE - 1], chunk[-1]]
+
+    def remove(self, value):
+        """Remove a value of the set."""
+        index = bisect.bisect_left(self._maxes, value)
+        chunk = self._chunks[index]
+        del chunk[bisect.bisect_left(chunk, value)]
+        self._len -= 1
+        if chunk:
+            self._maxes[index] = chunk[-1]
+        else:
+            del self._chunks[index]
+            del self._maxes[index]
+
+    def irange(self, start, end):
+        """Iterate over the values between two bounds, inclusive, in ascending order."""
+        index = bisect.bisect_left(self._maxes, start)
+        if index == len(self._chunks):
+            return
+        offset = bisect.bisect_left(self._chunks[index], start)
+        for chunk in self._chunks[index:]:
+            for value in chunk[offset:] if offset else chunk:
+                if value > end:
+                    return
+                yield value
+            offset = 0
+
+
+class OrderedBuckets(dict):
+    """Buckets of a secondary index keyed by the indexed values.
+
+    Besides the equality lookups of a dict, the buckets of a range of values
+    can be listed in order. The sorted values are only built by the first
+    range lookup and maintained from then on, so indexes never looked up by
+    range don't pay for them.
+    """
+
+    def __init__(self, factory):
+        """Create empty buckets.
+
+        :param factory: callable creating an empty bucket
+        """
+        dict.__init__(self)
+        self._factory = factory
+        self._sorted = None
+
+    def bucket(self, value):
+        """Return the bucket of a value, creating it if needed."""
+        bucket = self.get(value)
+        if bucket is None:
+            bucket = self[value] = self._factory()
+            if self._sorted is not None:
+                self._sorted.add(value)
+        return bucket
+
+    def drop(self, value):
+        """Remove the bucket of a value, once it's empty."""
+        del self[value]
+        if self._sorted is not None:
+            self._sorted.remove(value)
+
+    def range(self, start, end):
+        """Iterate over the (value, bucket) pairs of a range of values, inclusive, in order."""
+        if self._sorted is None:
+            self._sorted = SortedValues(self)
+        for value in self._sorted.irange(start, end):
+            yield value, self[value]
@@ -0,0 +1,318 @@
+"""SQLite datastore."""
+
+import marshal
+import sqlite3
+from contextlib import contextmanager
+
+import datastore
+
+MARSHAL_VERSION = 2
+
+
+class SqliteDatastore(datastore.Datastore):
+    """Datastore persisting every entity to a table of an SQLite database.
+
+    Each table has an auto incremented `seq` column keeping the insertion
+    order, a unique `key` column holding the value of the entity's id
+    attribute and the marshal encoded record. Creating a record with the id
+    of an existing one raises a ValueError. Every attribute covered by a
+    secondary index gets its own indexed column, so `retrieve` and `filter`
+    on them are index lookups.
+
+    The database is opened in WAL mode. Statements are built once per
+    entity and reused through the connection's statement cache. Use
+    `transaction` to group several operations into a single commit.
+
+    The connection can be used from any thread but by a single thread at a
+    time, share the datastore between threads through a
+    SynchronizedDatastore, e.g. with Ledger's concurrent mode.
+    """
+
+    def __init__(self, path=':memory:'):
+        self._connection = sqlite3.connect(
+            path, isolation_level=None, cached_statements=256, check_same_thread=False)
+        self._connection.text_factory = str
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS _entities (entity TEXT PRIMARY KEY, id_attr TEXT)')
+        self._depth = 0
+
+        self._id_attrs = {}
+        # entity -> list of indexed attributes, in column order
+        self._columns = {}
+        # entity -> {index name: tuple of attributes}
+        self._indexes = {}
+        # entity -> {statement name: sql}
+        self._sql = {}
+        for entity, id_attr in self._connection.execute('SELECT entity, id_attr FROM _entities'):
+            self.__load_entity(entity, id_attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def transaction(self):
+        if self._depth == 0:
+            self._connection.execute('BEGIN')
+        self._depth += 1
+        try:
+            yield
+        except:
+            self._depth -= 1
+            if self._depth == 0:
+                self._connection.execute('ROLLBACK')
+            raise
+        else:
+            self._depth -= 1
+            if self._depth == 0:
+                self._connection.execute('COMMIT')
+
+    def create(self, entity, instance):
+        self.create_many(entity, [instance])
+        return instance
+
+    def create_many(self, entity, instances):
+        if not self.__has_entity(entity):
+            self.add_entity(entity)
+
+        rows = [self.__row(entity, instance) for instance in instances]
+        try:
+            with self.transaction():
+                self._connection.executemany(self._sql[entity]['insert'], rows)
+        except sqlite3.IntegrityError as error:
+            raise ValueError('duplicate {0} id: {1}'.format(entity, error))
+        return len(rows)
+
+    def retrieve(self, entity, key, value):
+        if self.__has_entity(entity):
+            return self.__find(entity, key, value)[1]
+
+    def update(self, entity, instance, id_attr):
+        if self.__has_entity(entity):
+            seq, elem = self.__find(entity, id_attr, instance[id_attr])
+
+            if elem is not None:
+                elem.update(instance)
+                self._connection.execute(
+                    self._sql[entity]['update'], self.__row(entity, elem)[1:] + (seq,))
+
+            return elem
+
+    def update_many(self, entity, instances, id_attr):
+        count = 0
+        with self.transaction():
+            for instance in instances:
+                if self.update(entity, instance, id_attr) is not None:
+                    count += 1
+        return count
+
+    def delete(self, entity, id_attr, value):
+        if self.__has_entity(entity):
+            seq, elem = self.__find(entity, id_attr, value)
+
+            if elem is not None:
+                self._connection.execute(self._sql[entity]['delete'], (seq,))
+
+    def add_entity(self, entity, id_attr=None, indexes=None):
+        with self.transaction():
+            if not self.__has_entity(entity):
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS {0} (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                    'key UNIQUE, data BLOB NOT NULL)'.format(_quote(entity)))
+                self._connection.execute(
+                    'INSERT INTO _entities (entity, id_attr) VALUES (?, ?)', (entity, id_attr))
+                self.__load_entity(entity, id_attr)
+            elif id_attr is not None and self._id_attrs[entity] != id_attr:
+                self._connection.execute(
+                    'UPDATE _entities SET id_attr = ? WHERE entity = ?', (id_attr, entity))
+                self._id_attrs[entity] = id_attr
+                self.__backfill(entity)
+
+            for name, attrs in (indexes or {}).iteritems():
+                if isinstance(attrs, basestring):
+                    attrs = (attrs,)
+                self._indexes[entity][name] = tuple(attrs)
+                for attr in attrs:
+                    if attr not in self._columns[entity]:
+                        self.__add_column(entity, attr)
+
+    def count(self, entity):
+        if self.__has_entity(entity):
+            return self._connection.execute(self._sql[entity]['count']).fetchone()[0]
+
+    def filter(self, entity, key, values=[]):
+        if self.__has_entity(entity):
+            if not isinstance(values, (list, tuple, set, frozenset)):
+                values = [values]
+            if key is None or len(values) == 0:
+                return self.__select(entity, '', ())
+
+            attrs = self._indexes[entity].get(key)
+            if attrs is None and key in self._columns[entity]:
+                attrs = (key,)
+            if attrs is None:
+                return [elem for elem in self.__select(entity, '', ())
+                        if elem[key] in values]
+
+            values = list(values)
+            placeholders = ', '.join('?' * len(values))
+            where = ' OR '.join('{0} IN ({1})'.format(_quote(attr), placeholders)
+                                for attr in attrs)
+            return self.__select(entity, 'WHERE ' + where, tuple(values) * len(attrs))
+
+    def filter_range(self, entity, key, start, end):
+        if self.__has_entity(entity):
+            attrs = self._indexes[entity].get(key)
+            if attrs is None and key in self._columns[entity]:
+                attrs = (key,)
+            if attrs is None:
+                return super(SqliteDatastore, self).filter_range(entity, key, start, end)
+
+            columns = [_quote(attr) for attr in attrs]
+            where = ' OR '.join('{0} BETWEEN ? AND ?'.format(column) for column in columns)
+            # order by the value of the first column in the range
+            value = columns[0] if len(columns) == 1 else 'CASE {0} END'.format(' '.join(
+                'WHEN {0} BETWEEN ? AND ? THEN {0}'.format(column) for column in columns))
+            cursor = self._connection.execute(
+                'SELECT data FROM {0} WHERE {1} ORDER BY {2}, seq'.format(
+                    _quote(entity), where, value),
+                (start, end) * len(columns) * (1 if len(columns) == 1 else 2))
+            return [marshal.loads(str(data)) for data, in cursor]
+
+    def scan(self, entity, order_by=None, after=None, limit=None, offset=0):
+        attrs, after = datastore.scan_order(order_by, after)
+        if not self.__has_entity(entity):
+            return iter([])
+
+        columns = []
+        for attr in attrs:
+            if attr == self._id_attrs[entity]:
+                columns.append('key')
+            elif attr in self._columns[entity]:
+                columns.append(_quote(attr))
+            else:
+                # ordering by attributes without a column needs decoding every record
+                return super(SqliteDatastore, self).scan(entity, order_by, after, limit, offset)
+
+        where, params = _keyset(columns, after)
+        sql = 'SELECT data FROM {0} {1} ORDER BY {2} LIMIT ? OFFSET ?'.format(
+            _quote(entity), where, ', '.join(columns + ['seq']))
+        cursor = self._connection.execute(
+            sql, params + (-1 if limit is None else limit, offset))
+        return (marshal.loads(str(data)) for data, in cursor)
+
+    def close(self):
+        """Close the database connection."""
+        self._connection.close()
+
+    def __has_entity(self, entity):
+        return entity in self._id_attrs
+
+    def __load_entity(self, entity, id_attr):
+        self._id_attrs[entity] = id_attr
+        self._indexes[entity] = {}
+        table_info = self._connection.execute(
+            'PRAGMA table_info({0})'.format(_quote(entity))).fetchall()
+        self._columns[entity] = [column[1] for column in table_info
+                                 if column[1] not in ('seq', 'key', 'data')]
+        self.__prepare(entity)
+
+    def __prepare(self, entity):
+        table = _quote(entity)
+        columns = ''.join(', ' + _quote(column) for column in self._columns[entity])
+        assignments = ''.join(', {0} = ?'.format(_quote(column))
+                              for column in self._columns[entity])
+        placeholders = ', ?' * (len(self._columns[entity]) + 1)
+        self._sql[entity] = {
+            'insert': 'INSERT INTO {0} (key, data{1}) VALUES (?{2})'.format(
+                table, columns, placeholders),
+            'update': 'UPDATE {0} SET data = ?{1} WHERE seq = ?'.format(table, assignments),
+            'delete': 'DELETE FROM {0} WHERE seq = ?'.format(table),
+            'count': 'SELECT COUNT(*) FROM {0}'.format(table),
+            'by_key': 'SELECT seq, data FROM {0} WHERE key = ?'.format(table),
+        }
+
+    def __add_column(self, entity, attr):
+        self._connection.execute('ALTER TABLE {0} ADD COLUMN {1}'.format(
+            _quote(entity), _quote(attr)))
+        self._connection.execute('CREATE INDEX IF NOT EXISTS {0} ON {1} ({2})'.format(
+            _quote('{0}_{1}'.format(entity, attr)), _quote(entity), _quote(attr)))
+        self._columns[entity].append(attr)
+        self.__prepare(entity)
+        self.__backfill(entity)
+
+    def __backfill(self, entity):
+        """Recompute the key and indexed columns of all the entity's rows."""
+        rows = [self.__row(entity, elem) + (seq,)
+                for seq, elem in self.__select_with_seq(entity, '', ())]
+        self._connection.executemany(
+            'UPDATE {0} SET key = ?, data = ?{1} WHERE seq = ?'.format(
+                _quote(entity), ''.join(', {0} = ?'.format(_quote(column))
+                                        for column in self._columns[entity])),
+            rows)
+
+    def __key(self, entity, instance):
+        id_attr = self._id_attrs[entity]
+        if id_attr is not None:
+            return instance[id_attr]
+
+    def __row(self, entity, instance):
+        """Build the (key, data, indexed columns...) row of a record."""
+        return (self.__key(entity, instance),
+                sqlite3.Binary(marshal.dumps(instance, MARSHAL_VERSION))) + tuple(
+            instance.get(column) for column in self._columns[entity])
+
+    def __find(self, entity, key, value):
+        """Find a record and its seq.
+
+        :returns: tuple of (seq, record) or (None, None) if not found
+        """
+        if key == self._id_attrs[entity]:
+            row = self._connection.execute(self._sql[entity]['by_key'], (value,)).fetchone()
+            if row is None:
+                return None, None
+            return row[0], marshal.loads(str(row[1]))
+
+        if key in self._columns[entity]:
+            matches = self.__select_with_seq(
+                entity, 'WHERE {0} = ?'.format(_quote(key)), (value,))
+        else:
+            matches = self.__select_with_seq(entity, '', ())
+        for seq, elem in matches:
+            if elem[key] == value:
+                return seq, elem
+        return None, None
+
+    def __select_with_seq(self, entity, where, params):
+        cursor = self._connection.execute(
+            'SELECT seq, data FROM {0} {1} ORDER BY seq'.format(_quote(entity), where), params)
+        for seq, data in cursor:
+            yield seq, marshal.loads(str(data))
+
+    def __select(self, entity, where, params):
+        return [elem for _, elem in self.__select_with_seq(entity, where, params)]
+
+
+def _quote(identifier):
+    return '"{0}"'.format(identifier.replace('"', '""'))
+
+
+def _keyset(columns, after):
+    """Build the WHERE clause selecting the rows ordered after a keyset cursor.
+
+    :returns: tuple of (sql, params)
+    """
+    if after is None:
+        return '', ()
+
+    terms = []
+    params = ()
+    for index, column in enumerate(columns):
+        equal = ''.join('{0} = ? AND '.format(previous) for previous in columns[:index])
+        terms.append('({0}{1} > ?)'.format(equal, column))
+        params += after[:index + 1]
+    return 'WHERE ' + ' OR '.join(terms), params
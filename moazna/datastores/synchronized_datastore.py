@@ -0,0 +1,88 @@
+"""Thread-safe datastore wrapper."""
+
+import threading
+from contextlib import contextmanager
+
+import datastore
+
+
+class SynchronizedDatastore(datastore.Datastore):
+    """Datastore serializing every call to a wrapped datastore.
+
+    Each call holds a reentrant lock for its duration only, records returned
+    by `retrieve` are copies, so the caller can read them while other
+    threads write. Datastores implementing `transaction` also hold the lock
+    for the whole transaction so other threads' writes don't end up in it;
+    for the others `transaction` stays a no-op.
+
+    Attributes the Datastore interface doesn't define, like `close`, are
+    passed through to the wrapped datastore without locking.
+    """
+
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+        self.lock = threading.RLock()
+        self._transactional = datastore.is_transactional(wrapped)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    @contextmanager
+    def transaction(self):
+        if not self._transactional:
+            yield
+            return
+        with self.lock:
+            with self.wrapped.transaction():
+                yield
+
+    def create(self, entity, instance):
+        with self.lock:
+            return self.wrapped.create(entity, instance)
+
+    def create_many(self, entity, instances):
+        with self.lock:
+            return self.wrapped.create_many(entity, instances)
+
+    def retrieve(self, entity, key, value):
+        with self.lock:
+            record = self.wrapped.retrieve(entity, key, value)
+            if record is not None:
+                return dict(record)
+
+    def update(self, entity, instance, id_attr):
+        with self.lock:
+            return self.wrapped.update(entity, instance, id_attr)
+
+    def update_many(self, entity, instances, id_attr):
+        with self.lock:
+            return self.wrapped.update_many(entity, instances, id_attr)
+
+    def delete(self, entity, id_attr, value):
+        with self.lock:
+            return self.wrapped.delete(entity, id_attr, value)
+
+    def add_entity(self, entity, id_attr=None, indexes=None):
+        with self.lock:
+            return self.wrapped.add_entity(entity, id_attr, indexes)
+
+    def count(self, entity):
+        with self.lock:
+            return self.wrapped.count(entity)
+
+    def filter(self, entity, key, values=[]):
+        with self.lock:
+            return self.wrapped.filter(entity, key, values)
+
+    def filter_range(self, entity, key, start, end):
+        with self.lock:
+            return self.wrapped.filter_range(entity, key, start, end)
+
+    def scan(self, entity, order_by=None, after=None, limit=None, offset=0):
+        """Read a page of records, see `Datastore.scan`.
+
+        The page is read at once while holding the lock, pass a `limit` to
+        keep it small.
+        """
+        with self.lock:
+            return iter(list(self.wrapped.scan(entity, order_by, after, limit, offset)))
@@ -0,0 +1,48 @@
+"""Date helpers.
+
+Dates are passed around as 'YYYY-MM-DD' strings, internally they're often
+kept as integer day ordinals which are compact and cheap to compare.
+"""
+from datetime import date
+
+
+def to_ordinal(value):
+    """Convert a 'YYYY-MM-DD' date string to a day ordinal.
+
+    :param value: date string
+    :returns: proleptic Gregorian ordinal of the date
+    :raises ValueError: if the string isn't a valid date
+    """
+    if (len(value) != 10 or value[4] != '-' or value[7] != '-'
+            or not (value[:4] + value[5:7] + value[8:]).isdigit()):
+        raise ValueError('invalid date {0!r}'.format(value))
+    return date(int(value[:4]), int(value[5:7]), int(value[8:])).toordinal()
+
+
+def from_ordinal(ordinal):
+    """Convert a day ordinal back to a 'YYYY-MM-DD' date string."""
+    return date.fromordinal(ordinal).isoformat()
+
+
+def to_month(ordinal):
+    """Number the month of a day ordinal, counting months since year 0."""
+    day = date.fromordinal(ordinal)
+    return day.year * 12 + day.month - 1
+
+
+def from_month(month):
+    """Convert a month number of `to_month` to a 'YYYY-MM' string."""
+    return '{0:04d}-{1:02d}'.format(month // 12, month % 12 + 1)
+
+
+# bits of the day ordinal in `account_day`, enough for dates up to year 9999
+DAY_BITS = 22
+
+
+def account_day(account_id, ordinal):
+    """Combine an account id and a day ordinal into a single integer.
+
+    The integers sort by account first and day second, so the days of an
+    account form a contiguous range.
+    """
+    return account_id << DAY_BITS | ordinal
@@ -0,0 +1,176 @@
+"""Content fingerprints of imported transactions, to skip duplicate rows."""
+import hashlib
+import math
+import struct
+import threading
+
+# fingerprints the Bloom filter is first sized for, it doubles when full
+DEFAULT_CAPACITY = 1 << 16
+DEFAULT_ERROR_RATE = 0.01
+DIGEST = struct.Struct('<QQ')
+
+
+class Fingerprinter(object):
+    """Derive the fingerprints of the rows of a single import.
+
+    A fingerprint hashes the date, payer, recipient and amount of a row
+    with the number of identical rows before it in the same import, so
+    genuinely repeated transactions of a file are told apart while the same
+    rows delivered again in another file get the same fingerprints.
+    """
+
+    def __init__(self):
+        self._occurrences = {}
+
+    def __call__(self, amount, payerName, recipientName, date):
+        """Return the fingerprint of the next row, a 16 byte string."""
+        content = '\0'.join((date, payerName, recipientName, repr(float(amount))))
+        occurrence = self._occurrences.get(content, 0)
+        self._occurrences[content] = occurrence + 1
+        return hashlib.sha1('{0}\0{1}'.format(content, occurrence)).digest()[:DIGEST.size]
+
+
+class BloomFilter(object):
+    """Bit array answering whether a fingerprint was possibly added.
+
+    Never answers no for an added fingerprint, answers yes for one that
+    wasn't with about `error_rate` probability while it holds at most
+    `capacity` fingerprints. The bit positions are derived from the
+    fingerprint itself, which is already a uniform hash.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def __contains__(self, fingerprint):
+        bits = self.bits
+        for position in self._positions(fingerprint):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, fingerprint):
+        bits = self.bits
+        for position in self._positions(fingerprint):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def to_record(self):
+        return {'capacity': self.capacity, 'error_rate': self.error_rate,
+                'count': self.count, 'bits': str(self.bits)}
+
+    @classmethod
+    def from_dict(cls, data):
+        instance = cls(data['capacity'], data['error_rate'])
+        instance.bits = bytearray(data['bits'])
+        instance.count = data['count']
+        return instance
+
+    def _positions(self, fingerprint):
+        first, second = DIGEST.unpack(fingerprint)
+        size = self.size
+        for i in xrange(self.hashes):
+            yield (first + i * second) % size
+
+
+class FingerprintRepository(object):
+    """A class to help persist the fingerprints of imported transactions.
+
+    Every fingerprint is a record keyed by its hex digest, holding the id
+    of the transaction it was recorded as. A Bloom filter of all of them is
+    kept in memory and saved to the datastore by `save_filter`, rows that
+    aren't in the filter are new without a datastore lookup, the others are
+    looked up by key. A saved filter not matching the number of saved
+    fingerprints, e.g. after a crash, is rebuilt from them.
+
+    `lock` serializes checking and recording fingerprints across threads.
+    """
+
+    def __init__(self, datastore):
+        self._datastore = datastore
+        self.__entity = 'fingerprints'
+        self.__id_attr = 'id'
+        self.__filter_entity = 'fingerprint_filters'
+        self._datastore.add_entity(self.__entity, self.__id_attr, {'txn_id': 'txn_id'})
+        self._datastore.add_entity(self.__filter_entity, 'id')
+        self._filter = None
+        self.lock = threading.RLock()
+
+    def contains(self, fingerprint):
+        """Check whether a fingerprint was recorded, in O(1).
+
+        :param fingerprint: 16 byte fingerprint from a Fingerprinter
+        """
+        if fingerprint not in self.bloom_filter:
+            return False
+        return self._datastore.retrieve(
+            self.__entity, self.__id_attr, fingerprint.encode('hex')) is not None
+
+    def create_many(self, fingerprints, txns):
+        """Record the fingerprints of new transactions.
+
+        :param fingerprints: list of fingerprints
+        :param txns: list of the Transaction instances recorded for them
+        :returns: number of recorded fingerprints
+        """
+        bloom_filter = self.bloom_filter
+        for fingerprint in fingerprints:
+            bloom_filter.add(fingerprint)
+        count = self._datastore.create_many(self.__entity, [
+            {self.__id_attr: fingerprint.encode('hex'), 'txn_id': txn.id}
+            for fingerprint, txn in zip(fingerprints, txns)])
+        if bloom_filter.count > bloom_filter.capacity:
+            self._filter = self._build(2 * bloom_filter.capacity)
+        return count
+
+    def delete_for(self, txnIds):
+        """Delete the fingerprints of deleted transactions.
+
+        Their rows are imported again by the next import containing them.
+        The bits they set in the Bloom filter stay, they only cost a lookup.
+
+        :param txnIds: list of transaction ids
+        :returns: number of deleted fingerprints
+        """
+        records = self._datastore.filter(self.__entity, 'txn_id', list(txnIds))
+        for record in records:
+            self._datastore.delete(self.__entity, self.__id_attr, record[self.__id_attr])
+        return len(records)
+
+    def count(self):
+        """Count the recorded fingerprints."""
+        return self._datastore.count(self.__entity) or 0
+
+    @property
+    def bloom_filter(self):
+        """BloomFilter of all recorded fingerprints, loaded on first use."""
+        if self._filter is None:
+            with self.lock:
+                if self._filter is None:
+                    record = self._datastore.retrieve(self.__filter_entity, 'id', 'bloom')
+                    if record is not None and record['count'] == self.count():
+                        self._filter = BloomFilter.from_dict(record)
+                    else:
+                        self._filter = self._build(DEFAULT_CAPACITY)
+        return self._filter
+
+    def save_filter(self):
+        """Save the Bloom filter next to the fingerprints."""
+        with self.lock:
+            record = self.bloom_filter.to_record()
+            record['id'] = 'bloom'
+            if self._datastore.update(self.__filter_entity, record, 'id') is None:
+                self._datastore.create(self.__filter_entity, record)
+
+    def _build(self, capacity):
+        """Build a Bloom filter of the recorded fingerprints, with room for more."""
+        count = self.count()
+        bloom_filter = BloomFilter(max(capacity, 2 * count))
+        for record in self._datastore.scan(self.__entity):
+            bloom_filter.add(record[self.__id_attr].decode('hex'))
+        return bloom_filter
@@ -0,0 +1,292 @@
+"""Account to account flows maintained as transactions are recorded."""
+import heapq
+
+from moazna.dates import from_month, to_month, to_ordinal
+
+FLOW_DIRECTIONS = ['out', 'in', 'both']
+# period of the flow records holding the totals over all dates
+TOTAL = 'all'
+
+
+class Flow(object):
+    """Total amount and number of transactions from a payer to a recipient.
+
+    `label` is the 'YYYY-MM' month of a monthly flow and None for totals.
+    """
+
+    __slots__ = ('payer_name', 'recipient_name', 'label', 'amount', 'count')
+
+    def __init__(self, payer_name, recipient_name, label=None, amount=0.0, count=0):
+        self.payer_name = payer_name
+        self.recipient_name = recipient_name
+        self.label = label
+        self.amount = amount
+        self.count = count
+
+    def __iter__(self):
+        KEYS = ['payer_name', 'recipient_name', 'label', 'amount', 'count']
+
+        for key in KEYS:
+            yield key, getattr(self, key)
+
+    def __repr__(self):
+        return '{0}(payer_name={1}, recipient_name={2}, label={3}, amount={4})'.format(
+            self.__class__.__name__, self.payer_name, self.recipient_name, self.label, self.amount)
+
+
+class FlowRepository(object):
+    """A class to help persist the flow graph of the accounts in a datastore/database.
+
+    Every (payer, recipient) pair with transactions is an edge record keyed
+    by the account ids, holding their total amount and count. With
+    `monthly` set every pair also has a record per month it has
+    transactions in. Total records are indexed by payer and by recipient,
+    so the edges of an account are read without looking at other accounts,
+    and the in and out degree of every account are kept in a record of
+    their own.
+    """
+
+    def __init__(self, datastore, registry, monthly=False):
+        self._datastore = datastore
+        self.registry = registry
+        self.monthly = monthly
+        self.__entity = 'flows'
+        self.__id_attr = 'id'
+        self.__degree_entity = 'flow_degrees'
+        # only total records carry a source and a target
+        self._datastore.add_entity(self.__entity, self.__id_attr, {
+            'source': 'source',
+            'target': 'target',
+        })
+        self._datastore.add_entity(self.__degree_entity, 'account_id')
+
+    def add(self, txns):
+        """Add transactions to the flows between their accounts.
+
+        The changes are summed in memory first, every touched edge is then
+        read and written once.
+
+        :param txns: list of Transaction instances
+        :returns: number of written flows
+        """
+        return self.__apply(txns, 1)
+
+    def remove(self, txns):
+        """Subtract deleted transactions from the flows between their accounts.
+
+        Edges left without transactions are deleted.
+
+        :param txns: list of Transaction instances
+        :returns: number of written or deleted flows
+        """
+        return self.__apply(txns, -1)
+
+    def edge(self, payerName, recipientName, start=None, end=None):
+        """Total the flow from a payer to a recipient.
+
+        :param payerName: payer account name
+        :param recipientName: recipient account name
+        :param start: optional 'YYYY-MM-DD' date in the first month to total
+        :param end: optional 'YYYY-MM-DD' date in the last month to total
+        :returns: Flow instance, of 0 if no transactions match
+        :raises ValueError: if a range is given without monthly flows
+        """
+        flow = Flow(payerName, recipientName)
+        payer_id = self.registry.get_id(payerName)
+        recipient_id = self.registry.get_id(recipientName)
+        if start is None and end is None:
+            periods = [TOTAL]
+        elif not self.monthly:
+            raise ValueError('flows over a range of months require monthly flows')
+        else:
+            periods = xrange(to_month(to_ordinal(start)), to_month(to_ordinal(end)) + 1)
+        if payer_id is None or recipient_id is None:
+            return flow
+
+        for period in periods:
+            record = self._datastore.retrieve(
+                self.__entity, self.__id_attr, _flow_id(period, payer_id, recipient_id))
+            if record is not None:
+                flow.amount += record['amount']
+                flow.count += record['count']
+        return flow
+
+    def list_monthly(self, payerName, recipientName, start, end):
+        """List the monthly flows from a payer to a recipient.
+
+        :param start: 'YYYY-MM-DD' date in the first month
+        :param end: 'YYYY-MM-DD' date in the last month
+        :returns: list of Flow instances of the months with transactions
+        :raises ValueError: without monthly flows
+        """
+        if not self.monthly:
+            raise ValueError('the flows are only kept in total')
+        payer_id = self.registry.get_id(payerName)
+        recipient_id = self.registry.get_id(recipientName)
+        if payer_id is None or recipient_id is None:
+            return []
+
+        flows = []
+        for month in xrange(to_month(to_ordinal(start)), to_month(to_ordinal(end)) + 1):
+            record = self._datastore.retrieve(
+                self.__entity, self.__id_attr, _flow_id(month, payer_id, recipient_id))
+            if record is not None:
+                flows.append(self._instance(record))
+        return flows
+
+    def counterparties(self, accountName, direction='both'):
+        """List the total flows between an account and its counterparties.
+
+        :param accountName: name of the account
+        :param direction: 'out' for its payments, 'in' for its receipts,
+                          'both' for either, summed per counterparty
+        :returns: list of Flow instances, for 'both' from the account to each
+                  counterparty with the amount exchanged either way
+        """
+        if direction not in FLOW_DIRECTIONS:
+            raise ValueError('unknown direction {0!r}, expected one of {1}'.format(
+                direction, ', '.join(FLOW_DIRECTIONS)))
+        account_id = self.registry.get_id(accountName)
+        if account_id is None:
+            return []
+
+        paid = received = []
+        if direction != 'in':
+            paid = self._datastore.filter(self.__entity, 'source', [account_id])
+        if direction != 'out':
+            received = self._datastore.filter(self.__entity, 'target', [account_id])
+        if direction != 'both':
+            return [self._instance(record) for record in paid or received]
+
+        flows = {}
+        for records, key in ((paid, 'recipient_id'), (received, 'payer_id')):
+            for record in records:
+                if records is received and record['payer_id'] == account_id:
+                    # self transfers were counted with the payments
+                    continue
+                flow = flows.get(record[key])
+                if flow is None:
+                    flow = flows[record[key]] = Flow(
+                        accountName, self.registry.name(record[key]))
+                flow.amount += record['amount']
+                flow.count += record['count']
+        return flows.values()
+
+    def top_counterparties(self, accountName, k=10, direction='both'):
+        """List the counterparties an account exchanged the most with.
+
+        Only the edges of the account are read, in time proportional to its
+        degree.
+
+        :param accountName: name of the account
+        :param k: number of counterparties
+        :param direction: 'out', 'in' or 'both', see `counterparties`
+        :returns: list of up to k Flow instances, by descending amount
+        """
+        return heapq.nlargest(k, self.counterparties(accountName, direction),
+                              key=lambda flow: flow.amount)
+
+    def degree(self, accountName):
+        """Count the distinct counterparties an account paid and received from.
+
+        :returns: dict with 'in' and 'out' degrees
+        """
+        degree = {'in': 0, 'out': 0}
+        account_id = self.registry.get_id(accountName)
+        if account_id is not None:
+            record = self._datastore.retrieve(self.__degree_entity, 'account_id', account_id)
+            if record is not None:
+                degree['in'], degree['out'] = record['in_degree'], record['out_degree']
+        return degree
+
+    def rebuild(self, txns):
+        """Replace all flows with the flows of the given transactions.
+
+        :param txns: list of all Transaction instances
+        :returns: number of written flows
+        """
+        with self._datastore.transaction():
+            for entity, id_attr in ((self.__entity, self.__id_attr),
+                                    (self.__degree_entity, 'account_id')):
+                for record in self._datastore.filter(entity, id_attr):
+                    self._datastore.delete(entity, id_attr, record[id_attr])
+            return self.add(txns)
+
+    def _instance(self, record):
+        """Build a Flow instance from its datastore record."""
+        label = None if record['period'] == TOTAL else from_month(record['period'])
+        return Flow(self.registry.name(record['payer_id']), self.registry.name(record['recipient_id']),
+                    label, record['amount'], record['count'])
+
+    def __apply(self, txns, sign):
+        changes = {}
+        for txn in txns:
+            payer_id = self.registry.id_for(txn.payer_name)
+            recipient_id = self.registry.id_for(txn.recipient_name)
+            periods = [TOTAL]
+            if self.monthly:
+                periods.append(to_month(to_ordinal(txn.date)))
+            for period in periods:
+                flow_id = _flow_id(period, payer_id, recipient_id)
+                change = changes.get(flow_id)
+                if change is None:
+                    change = changes[flow_id] = {
+                        'id': flow_id, 'period': period, 'payer_id': payer_id,
+                        'recipient_id': recipient_id, 'amount': 0.0, 'count': 0}
+                    if period == TOTAL:
+                        change['source'] = payer_id
+                        change['target'] = recipient_id
+                change['amount'] += sign * txn.amount
+                change['count'] += sign
+
+        created = []
+        updated = []
+        deleted = []
+        degrees = {}
+        for flow_id, change in changes.iteritems():
+            record = self._datastore.retrieve(self.__entity, self.__id_attr, flow_id)
+            if record is None:
+                if change['count'] > 0:
+                    created.append(change)
+                    self.__count_edge(degrees, change, 1)
+                continue
+            record['amount'] += change['amount']
+            record['count'] += change['count']
+            if record['count'] > 0:
+                updated.append(record)
+            else:
+                deleted.append(flow_id)
+                self.__count_edge(degrees, record, -1)
+        self._datastore.create_many(self.__entity, created)
+        self._datastore.update_many(self.__entity, updated, self.__id_attr)
+        for flow_id in deleted:
+            self._datastore.delete(self.__entity, self.__id_attr, flow_id)
+        self.__save_degrees(degrees)
+        return len(created) + len(updated) + len(deleted)
+
+    def __count_edge(self, degrees, record, sign):
+        """Count an edge created or deleted in the degrees of its accounts."""
+        if record['period'] != TOTAL:
+            return
+        for account_id, key in ((record['payer_id'], 'out'), (record['recipient_id'], 'in')):
+            degree = degrees.setdefault(account_id, {'in': 0, 'out': 0})
+            degree[key] += sign
+
+    def __save_degrees(self, degrees):
+        created = []
+        updated = []
+        for account_id, change in degrees.iteritems():
+            record = self._datastore.retrieve(self.__degree_entity, 'account_id', account_id)
+            if record is None:
+                created.append({'account_id': account_id, 'in_degree': change['in'],
+                                'out_degree': change['out']})
+            else:
+                record['in_degree'] += change['in']
+                record['out_degree'] += change['out']
+                updated.append(record)
+        self._datastore.create_many(self.__degree_entity, created)
+        self._datastore.update_many(self.__degree_entity, updated, 'account_id')
+
+
+def _flow_id(period, payer_id, recipient_id):
+    return '{0}:{1}:{2}'.format(period, payer_id, recipient_id)
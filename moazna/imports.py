@@ -0,0 +1,217 @@
+"""Helpers for importing csv ledger files."""
+
+import csv
+import itertools
+import multiprocessing
+import os
+from array import array
+
+from moazna.dates import from_ordinal, to_ordinal
+
+CSV_FIELDS = ['date', 'payer', 'recipient', 'amount']
+# size of the byte ranges a file is split into for parallel parsing
+CHUNK_BYTES = 4 * 1024 * 1024
+
+
+class ImportSummary(object):
+    """Counters collected while importing transactions."""
+
+    def __init__(self):
+        self.rows_read = 0
+        self.rows_rejected = 0
+        # rows already imported before, see Ledger's dedupe_imports
+        self.rows_skipped = 0
+        self.accounts_created = 0
+        self.txns_recorded = 0
+        self.elapsed = 0.0
+        # list of (line number, error message) tuples for the rejected rows
+        self.errors = []
+
+    def __iter__(self):
+        KEYS = ['rows_read', 'rows_rejected', 'rows_skipped', 'accounts_created',
+                'txns_recorded', 'elapsed', 'errors']
+
+        for key in KEYS:
+            yield key, self.__getattribute__(key)
+
+    def __repr__(self):
+        return '{0}(rows_read={1}, rows_rejected={2}, rows_skipped={3}, accounts_created={4}, txns_recorded={5}, elapsed={6:.3f})'.format(
+            self.__class__.__name__, self.rows_read, self.rows_rejected, self.rows_skipped,
+            self.accounts_created, self.txns_recorded, self.elapsed
+        )
+
+    def reject(self, line_num, message):
+        """Record a rejected row.
+
+        :param line_num: line number of the row in the source
+        :param message: reason for rejecting the row
+        """
+        self.rows_rejected += 1
+        self.errors.append((line_num, message))
+
+
+def parse_rows(lines, summary):
+    """Parse csv ledger lines into transaction tuples.
+
+    Rows that don't have exactly the ledger fields, whose date isn't a valid
+    'YYYY-MM-DD' date or whose amount isn't a number are rejected and recorded in the summary instead of being yielded.
+
+    :param lines: iterable of csv lines, e.g. a file object
+    :param summary: ImportSummary instance to record the counters on
+    :returns: generator of (amount, payer name, recipient name, date) tuples
+    """
+    for amount, payer, recipient, date, _ in _parse(lines, summary):
+        yield amount, payer, recipient, date
+
+
+def _parse(lines, summary):
+    """Parse and validate csv ledger lines, see `parse_rows`.
+
+    :returns: generator of (amount, payer name, recipient name, date, day ordinal) tuples
+    """
+    reader = csv.reader(lines)
+    for fields in reader:
+        if not fields:
+            continue
+        summary.rows_read += 1
+
+        if len(fields) != len(CSV_FIELDS):
+            summary.reject(reader.line_num, 'expected {0} fields, got {1}'.format(
+                len(CSV_FIELDS), len(fields)))
+            continue
+
+        date, payer, recipient, amount = fields
+        try:
+            ordinal = to_ordinal(date)
+        except ValueError:
+            summary.reject(reader.line_num, 'invalid date {0!r}'.format(date))
+            continue
+
+        try:
+            amount = float(amount)
+        except ValueError:
+            summary.reject(reader.line_num, 'invalid amount {0!r}'.format(amount))
+            continue
+
+        yield amount, payer, recipient, date, ordinal
+
+
+class ParsedBatch(object):
+    """Typed columns of the rows parsed from a range of a csv file.
+
+    Amounts and day ordinals are kept in arrays, payers and recipients as
+    indexes into the batch's list of distinct names. Batches are compact to
+    send back from the parsing processes.
+    """
+
+    def __init__(self):
+        self.amounts = array('d')
+        self.dates = array('l')
+        self.payers = array('l')
+        self.recipients = array('l')
+        self.names = []
+        self.rows_read = 0
+        # number of lines the range spans, to number the lines of the next one
+        self.lines = 0
+        # list of (line number within the range, error message) tuples
+        self.errors = []
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def rows(self):
+        """Turn the batch back into transaction tuples.
+
+        :returns: list of (amount, payer name, recipient name, date) tuples
+        """
+        dates = {}
+        rows = []
+        for amount, ordinal, payer, recipient in itertools.izip(
+                self.amounts, self.dates, self.payers, self.recipients):
+            date = dates.get(ordinal)
+            if date is None:
+                date = dates[ordinal] = from_ordinal(ordinal)
+            rows.append((amount, self.names[payer], self.names[recipient], date))
+        return rows
+
+
+def split_ranges(path, chunk_bytes=CHUNK_BYTES):
+    """Split a file into byte ranges ending on line boundaries.
+
+    :param path: path of the file
+    :param chunk_bytes: approximate size of every range
+    :returns: list of (start, end) offsets covering the whole file
+    """
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as source:
+        start = 0
+        while start < size:
+            end = start + chunk_bytes
+            if end < size:
+                source.seek(end - 1)
+                source.readline()
+                end = source.tell()
+            else:
+                end = size
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_range(task):
+    """Parse and validate a byte range of a csv ledger file.
+
+    :param task: tuple of (path, start offset, end offset)
+    :returns: ParsedBatch instance
+    """
+    path, start, end = task
+    with open(path, 'rb') as source:
+        source.seek(start)
+        data = source.read(end - start)
+
+    summary = ImportSummary()
+    batch = ParsedBatch()
+    ids = {}
+    for amount, payer, recipient, _, ordinal in _parse(data.splitlines(True), summary):
+        payer_id = ids.get(payer)
+        if payer_id is None:
+            payer_id = ids[payer] = len(batch.names)
+            batch.names.append(payer)
+        recipient_id = ids.get(recipient)
+        if recipient_id is None:
+            recipient_id = ids[recipient] = len(batch.names)
+            batch.names.append(recipient)
+
+        batch.amounts.append(amount)
+        batch.dates.append(ordinal)
+        batch.payers.append(payer_id)
+        batch.recipients.append(recipient_id)
+
+    batch.rows_read = summary.rows_read
+    batch.errors = summary.errors
+    batch.lines = data.count('\n')
+    if data and not data.endswith('\n'):
+        batch.lines += 1
+    return batch
+
+
+def parse_file(path, processes=None, chunk_bytes=CHUNK_BYTES):
+    """Parse a csv ledger file in parallel.
+
+    The file is split into byte ranges on line boundaries which are parsed
+    and validated by a pool of processes.
+
+    :param path: path of the csv ledger file
+    :param processes: number of parsing processes, defaults to the number of CPUs
+    :param chunk_bytes: approximate size of the ranges handed to the processes
+    :returns: generator of ParsedBatch instances in file order
+    """
+    tasks = [(path, start, end) for start, end in split_ranges(path, chunk_bytes)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        for batch in pool.imap(parse_range, tasks):
+            yield batch
+    finally:
+        pool.terminate()
+        pool.join()
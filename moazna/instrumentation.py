@@ -0,0 +1,253 @@
+"""Counters, latency histograms and profiling captures of ledger operations."""
+import cProfile
+import functools
+import gc
+import pstats
+import resource
+import StringIO
+import threading
+import time
+from array import array
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2 has no tracemalloc, memory captures fall back to rusage
+    tracemalloc = None
+
+# latency buckets are powers of two microseconds, the last one is open ended
+HISTOGRAM_BUCKETS = 32
+CAPTURE_MODES = ['cpu', 'memory']
+
+
+class LatencyHistogram(object):
+    """Distribution of operation latencies over power of two microsecond buckets.
+
+    Bucket `i` counts the latencies below 2**i microseconds and at or above
+    2**(i - 1), recording a latency is a few integer operations.
+    """
+
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets = array('l', [0]) * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed):
+        """Add a latency in seconds."""
+        bucket = min(int(elapsed * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def percentile(self, percent):
+        """Upper bound in seconds of the bucket holding a percentile of the latencies."""
+        if not self.count:
+            return None
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                break
+        return min(2 ** bucket / 1e6, self.max)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            # upper bound in microseconds -> number of latencies in the bucket
+            'buckets': dict((2 ** bucket, count) for bucket, count in enumerate(self.buckets)
+                            if count),
+        }
+
+
+class OperationStats(object):
+    """Counters of one kind of operation."""
+
+    __slots__ = ('calls', 'records_read', 'records_written', 'records_scanned', 'scans', 'latency')
+
+    def __init__(self):
+        self.calls = 0
+        self.records_read = 0
+        self.records_written = 0
+        self.records_scanned = 0
+        self.scans = 0
+        self.latency = LatencyHistogram()
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'records_read': self.records_read,
+            'records_written': self.records_written,
+            'records_scanned': self.records_scanned,
+            'scans': self.scans,
+            'latency': self.latency.to_dict(),
+        }
+
+
+class Stats(object):
+    """Thread-safe statistics of datastore calls and ledger operations.
+
+    Datastore calls are counted per (operation, entity), with the number of
+    records they returned (each hydrated into an instance by a repository),
+    wrote (each serialized from an instance) and examined to find them, and
+    whether they scanned a whole entity. Ledger operations are timed by `timed`, the datastore
+    calls made while one runs are added to its counters too, inclusive of
+    nested ledger operations.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._datastore = {}
+        self._ledger = {}
+
+    def record_call(self, operation, entity, elapsed, read=0, written=0, scan=False, scanned=None):
+        """Count a datastore call.
+
+        :param operation: datastore method name
+        :param entity: entity collection name
+        :param elapsed: latency in seconds
+        :param read: number of records returned
+        :param written: number of records written
+        :param scan: whether the call went over the whole entity
+        :param scanned: number of records examined, defaults to `read`
+        """
+        if scanned is None:
+            scanned = read
+        with self._lock:
+            stats = self._datastore.get((operation, entity))
+            if stats is None:
+                stats = self._datastore[operation, entity] = OperationStats()
+            stats.calls += 1
+            stats.latency.record(elapsed)
+
+            counters = [stats]
+            counters.extend(self._ledger[name] for name in getattr(self._local, 'running', ()))
+            for counter in counters:
+                counter.records_read += read
+                counter.records_written += written
+                counter.records_scanned += scanned
+                if scan:
+                    counter.scans += 1
+
+    def timed(self, name, func):
+        """Wrap a function to count and time its calls as the ledger operation `name`."""
+        with self._lock:
+            self._ledger.setdefault(name, OperationStats())
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            running = getattr(self._local, 'running', None)
+            if running is None:
+                running = self._local.running = []
+            running.append(name)
+            started = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.time() - started
+                running.pop()
+                with self._lock:
+                    stats = self._ledger[name]
+                    stats.calls += 1
+                    stats.latency.record(elapsed)
+        return wrapper
+
+    def to_dict(self):
+        """Snapshot the statistics.
+
+        :returns: dict with a 'datastore' dict mapping operation names to
+                  dicts of entity names to counters, and a 'ledger' dict
+                  mapping ledger operation names to counters
+        """
+        with self._lock:
+            datastore = {}
+            for (operation, entity), stats in self._datastore.iteritems():
+                datastore.setdefault(operation, {})[entity] = stats.to_dict()
+            ledger = dict((name, stats.to_dict()) for name, stats in self._ledger.iteritems()
+                          if stats.calls)
+        return {'datastore': datastore, 'ledger': ledger}
+
+    def reset(self):
+        """Clear all counters."""
+        with self._lock:
+            self._datastore.clear()
+            for name in self._ledger:
+                self._ledger[name] = OperationStats()
+
+
+class Capture(object):
+    """Profile the code run inside a `with` block.
+
+    In 'cpu' mode the block runs under cProfile, `stats` is then a
+    pstats.Stats instance. In 'memory' mode `memory` is a dict with the
+    peak resident memory of the process and its growth over the block in
+    KiB and the growth of the number of objects tracked by the garbage
+    collector, plus the top allocating lines when tracemalloc is available.
+    """
+
+    def __init__(self, mode='cpu', limit=20):
+        """Create a capture.
+
+        :param mode: 'cpu' or 'memory'
+        :param limit: number of functions or lines listed by `report`
+        """
+        if mode not in CAPTURE_MODES:
+            raise ValueError('unknown capture mode {0!r}, expected one of {1}'.format(
+                mode, ', '.join(CAPTURE_MODES)))
+        self.mode = mode
+        self.limit = limit
+        self.stats = None
+        self.memory = None
+        self._profiler = None
+
+    def __enter__(self):
+        if self.mode == 'cpu':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._objects = len(gc.get_objects())
+            self._rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if tracemalloc is not None:
+                tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.mode == 'cpu':
+            self._profiler.disable()
+            self.stats = pstats.Stats(self._profiler, stream=StringIO.StringIO())
+            return
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.memory = {
+            'peak_rss_kib': peak,
+            'rss_growth_kib': peak - self._rss,
+            'objects_growth': len(gc.get_objects()) - self._objects,
+        }
+        if tracemalloc is not None:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self.memory['top_lines'] = [str(stat) for stat in
+                                        snapshot.statistics('lineno')[:self.limit]]
+
+    def report(self):
+        """Render the capture as text, in 'cpu' mode the top functions by cumulative time."""
+        if self.stats is not None:
+            stream = StringIO.StringIO()
+            self.stats.stream = stream
+            self.stats.sort_stats('cumulative').print_stats(self.limit)
+            return stream.getvalue()
+        if self.memory is not None:
+            return '\n'.join('{0}: {1}'.format(key, value)
+                             for key, value in sorted(self.memory.iteritems()))
+        return ''
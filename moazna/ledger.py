@@ -1,11 +1,36 @@
-import csv
+import itertools
+import threading
+import time
+from contextlib import contextmanager
 
-from moazna.accounts import AccountRepository
-from moazna.transactions import TransactionRepository
+from moazna.accounts import Account, AccountRegistry, AccountRepository, DEFAULT_BALANCE
+from moazna.checkpoints import CheckpointRepository
+from moazna.fingerprints import Fingerprinter, FingerprintRepository
+from moazna.flows import FlowRepository
+from moazna.datastores.instrumented_datastore import InstrumentedDatastore
+from moazna.datastores.synchronized_datastore import SynchronizedDatastore
+from moazna.imports import ImportSummary, parse_file, parse_rows
+from moazna.instrumentation import Stats
+from moazna.locking import AccountLocks
+from moazna.reports import LedgerReport
+from moazna.rollups import RollupRepository
+from moazna.datastores.datastore import is_transactional
+from moazna.transactions import Transaction, TransactionRepository, validate_txn
+
+# rows written per bulk operation by `import_parallel`
+PARALLEL_BATCH_SIZE = 1000
+# methods counted and timed by instrumented ledgers
+INSTRUMENTED_OPERATIONS = ['record_txn', 'record_txns', 'import_txns', 'import_stream', 'import_parallel',
+                           '_record_batch', 'get_account_balance', 'get_rollups',
+                           'get_flow', 'top_counterparties', 'get_degree',
+                           'reverse_txn', 'reverse_txns', 'delete_txn', 'delete_txns',
+                           'checkpoint', 'balances_at', 'restore', 'report']
 
 
 class Ledger:
-    def __init__(self, datastore):
+    def __init__(self, datastore, account_cache_size=0, columnar_txns=False, concurrent=False,
+                 checkpoint_interval=None, rollups=False, instrument=False,
+                 dedupe_imports=False, flows=False):
         '''
         Repository classes used to interact with the datastore/database following
         the DAO model. Datastore connection is injected here as a dependency for 
@@ -14,10 +39,99 @@ class Ledger:
         
         NOTE: I built a JSON Datastore to facilitate testing. But using this design
               Any database/datastore could be used.
+
+        account_cache_size is the number of recently used accounts the account
+        repository keeps in memory, 0 disables the cache.
+
+        columnar_txns keeps the transactions in memory in typed arrays instead
+        of the datastore, see TransactionRepository.
+
+        Both repositories share an AccountRegistry assigning every account
+        name an integer id, records and indexes key on the ids and names are
+        only resolved when accounts and transactions are returned.
+
+        concurrent makes the ledger safe to record transactions from several
+        threads. Every datastore call is serialized by a SynchronizedDatastore
+        and recording a transaction holds the locks of its accounts, acquired
+        in a fixed order, so transactions on different accounts don't wait
+        for each other. The account cache and the columnar transactions
+        aren't thread-safe and can't be combined with it.
+
+        checkpoint_interval is the number of transactions after which the
+        balances of all accounts are snapshot with the current position of
+        the transaction log, see `checkpoint`. None only takes checkpoints
+        when `checkpoint` is called, e.g. when closing a period.
+
+        rollups keeps per account daily and monthly inflow, outflow and
+        transaction counts up to date as transactions are recorded, in the
+        same datastore transaction, see `get_rollups`.
+
+        instrument collects statistics in `stats`, a moazna.instrumentation
+        Stats instance: every datastore call is counted and timed per
+        operation and entity by an InstrumentedDatastore, and the ledger
+        operations are timed along with the datastore calls they make.
+        Uninstrumented ledgers don't pay anything for it.
+
+        dedupe_imports makes imports idempotent: the content fingerprint of
+        every imported row is recorded along with its transaction, and rows
+        whose fingerprint was recorded by an earlier import are skipped and
+        counted as `rows_skipped`, see moazna.fingerprints. Transactions
+        recorded through `record_txn` aren't fingerprinted.
+
+        flows keeps the payer to recipient flow graph up to date as
+        transactions are recorded: total amount and count per pair of
+        accounts with transactions between them, see `get_flow` and
+        `top_counterparties`. 'month' also keeps them per month.
         '''
+        if concurrent and (account_cache_size or columnar_txns):
+            raise ValueError('concurrent ledgers support neither the account cache '
+                             'nor columnar transactions')
+
+        self._account_locks = None
+        registry_lock = None
+        if concurrent:
+            datastore = SynchronizedDatastore(datastore)
+            self._account_locks = AccountLocks()
+            registry_lock = datastore.lock
+
+        self.stats = None
+        if instrument:
+            self.stats = Stats()
+            datastore = InstrumentedDatastore(datastore, self.stats)
+            for name in INSTRUMENTED_OPERATIONS:
+                setattr(self, name, self.stats.timed(name, getattr(self, name)))
+
         self._datastore = datastore
-        self.account_repository = AccountRepository(self._datastore)
-        self.txn_repository = TransactionRepository(self._datastore)
+        # a failed write leaves nothing behind: the datastore rolls it back and
+        # no account or transaction is kept in memory besides it
+        self.atomic_writes = (is_transactional(datastore) and not account_cache_size
+                              and not columnar_txns)
+        self.account_registry = AccountRegistry(self._datastore, registry_lock)
+        self.account_repository = AccountRepository(
+            self._datastore, account_cache_size, self.account_registry)
+        self.txn_repository = TransactionRepository(
+            self._datastore, columnar_txns, self.account_registry)
+
+        self.rollup_repository = None
+        if rollups:
+            self.rollup_repository = RollupRepository(self._datastore, self.account_registry)
+
+        self.flow_repository = None
+        if flows:
+            self.flow_repository = FlowRepository(
+                self._datastore, self.account_registry, monthly=flows == 'month')
+
+        self.fingerprint_repository = None
+        if dedupe_imports:
+            self.fingerprint_repository = FingerprintRepository(self._datastore)
+
+        self.checkpoint_repository = CheckpointRepository(self._datastore)
+        self._checkpoint_interval = checkpoint_interval
+        self._checkpoint_lock = threading.Lock()
+        positions = self.checkpoint_repository.positions()
+        if positions:
+            # log positions at or before a checkpoint are never handed out again
+            self.txn_repository.skip_to(positions[-1])
 
     def record_txn(self, amount, payerName, recipientName, date):
         """Record a new txn.
@@ -38,52 +152,559 @@ class Ledger:
         :returns: Transaction instance of the newly recored transaction
         """
 
-        payer = self.account_repository.get_by_name(payerName)
-        if payer is None:
-            payer = self.account_repository.create(payerName)
+        self._register([payerName, recipientName])
+        with self._hold_accounts([payerName, recipientName]), self._datastore.transaction():
+            payer = self.account_repository.get_by_name(payerName)
+            if payer is None:
+                payer = self.account_repository.create(payerName)
+
+            if recipientName == payerName:
+                recipient = payer
+            else:
+                recipient = self.account_repository.get_by_name(recipientName)
+                if recipient is None:
+                    recipient = self.account_repository.create(recipientName)
 
-        recipient = self.account_repository.get_by_name(recipientName)
-        if recipient is None:
-            recipient = self.account_repository.create(recipientName)
+            txn = self.txn_repository.create(
+                amount, payer.name, recipient.name, date)
+            if self.rollup_repository is not None:
+                self.rollup_repository.add([txn])
+            if self.flow_repository is not None:
+                self.flow_repository.add([txn])
 
-        txn = self.txn_repository.create(
-            amount, payer.name, recipient.name, date)
+            payer.credit(amount)
+            payer.post(-amount, date)
 
-        payer.credit(amount)
-        self.account_repository.update(payer)
-        self.account_repository.update_balance_history(
-            payer.name, payer.balance, date)
+            recipient.debit(amount)
+            recipient.post(amount, date)
 
-        recipient.debit(amount)
-        self.account_repository.update(recipient)
-        self.account_repository.update_balance_history(
-            recipient.name, recipient.balance, date)
+            self.account_repository.update_many(
+                [payer] if recipient is payer else [payer, recipient])
 
+        self._maybe_checkpoint()
         return txn
 
-    def import_txns(self, filePath):
+    def import_txns(self, filePath, batch_size=None, processes=None, capture=None):
         """Import transactions from a text file.
 
+        Rows that can't be parsed are skipped, use `import_stream` or
+        `import_parallel` to get a summary of the import including the
+        rejected rows.
+
         :param filePath: absolute path to a csv ledger file
+        :param batch_size: number of rows to write to the datastore at once,
+                           see `import_stream`
+        :param processes: if given, parse the file with that many processes,
+                          see `import_parallel`
+        :param capture: optional moazna.instrumentation Capture instance
+                        profiling the time or memory of the import
         :returns: list of all transactions recored currently on the ledger
         """
 
-        with open(filePath) as csv_file:
-            csv_reader = csv.DictReader(
-                csv_file, fieldnames=['date', 'payer', 'recipient', 'amount'])
-            for row in csv_reader:
-                self.record_txn(float(row['amount']), row['payer'],
-                                row['recipient'], row['date'])
+        with capture if capture is not None else _nullcontext():
+            if processes is not None:
+                self.import_parallel(filePath, processes, batch_size or PARALLEL_BATCH_SIZE)
+            else:
+                with open(filePath) as csv_file:
+                    self.import_stream(csv_file, batch_size)
 
         return self.transactions
 
-    def get_account_balance(self, accountName, date):
+    def import_stream(self, lines, batch_size=None, callback=None):
+        """Import transactions from a stream of csv lines.
+
+        Behavior:
+            - By default every row is recorded through `record_txn`
+
+            - If `batch_size` is given, the stream is read in chunks of that many
+            rows. Each chunk is applied to in-memory accounts, loaded once per
+            chunk, and then written to the datastore with bulk operations. The
+            resulting balances and history are the same as row by row import.
+
+            - Only the imported transactions are handed to `callback`, the
+            transactions already on the ledger are never reloaded.
+
+        :param lines: iterable of csv lines, e.g. an open file
+        :param batch_size: number of rows to write to the datastore at once
+        :param callback: optional callable receiving every recorded Transaction
+        :returns: ImportSummary instance
+        """
+        summary = ImportSummary()
+        started = time.time()
+        accounts_before = self.account_repository.count()
+
+        rows = parse_rows(lines, summary)
+        if batch_size is None:
+            chunks = ([row] for row in rows)
+        else:
+            chunks = iter(lambda: list(itertools.islice(rows, batch_size)), [])
+        self._record_chunks(chunks, summary, callback, self._fingerprinter())
+        self._save_fingerprints()
+
+        summary.accounts_created = self.account_repository.count() - accounts_before
+        summary.elapsed = time.time() - started
+        return summary
+
+    def import_parallel(self, filePath, processes=None, batch_size=PARALLEL_BATCH_SIZE, callback=None):
+        """Import transactions from a csv file parsed by a pool of processes.
+
+        Behavior:
+            - The file is split into byte ranges on line boundaries, the
+            ranges are parsed and validated in parallel and come back as
+            typed batches of amounts, date ordinals and interned names
+
+            - The batches are recorded in file order with bulk operations of
+            `batch_size` rows, so the resulting balances and history are the
+            same as a serial import
+
+            - Rejected rows are reported with their line number in the file
+
+        NOTE: rows are split on physical lines, quoted fields can't contain
+              line breaks
+
+        :param filePath: path to a csv ledger file
+        :param processes: number of parsing processes, defaults to the number of CPUs
+        :param batch_size: number of rows to write to the datastore at once
+        :param callback: optional callable receiving every recorded Transaction
+        :returns: ImportSummary instance
+        """
+        summary = ImportSummary()
+        started = time.time()
+        accounts_before = self.account_repository.count()
+
+        line_offset = 0
+        fingerprinter = self._fingerprinter()
+        for batch in parse_file(filePath, processes):
+            summary.rows_read += batch.rows_read
+            for line_num, message in batch.errors:
+                summary.reject(line_offset + line_num, message)
+            line_offset += batch.lines
+
+            rows = batch.rows()
+            self._record_chunks(
+                (rows[start:start + batch_size] for start in xrange(0, len(rows), batch_size)),
+                summary, callback, fingerprinter)
+        self._save_fingerprints()
+
+        summary.accounts_created = self.account_repository.count() - accounts_before
+        summary.elapsed = time.time() - started
+        return summary
+
+    def _record_chunks(self, chunks, summary, callback, fingerprinter=None):
+        """Record chunks of transaction tuples, counting them on the summary.
+
+        :param fingerprinter: Fingerprinter of the import to skip duplicate rows
+        """
+        for chunk in chunks:
+            if fingerprinter is not None:
+                txns = self._record_new_rows(chunk, summary, fingerprinter)
+            elif len(chunk) == 1:
+                txns = [self.record_txn(*chunk[0])]
+            else:
+                txns = self._record_batch(chunk)
+            summary.txns_recorded += len(txns)
+            if callback is not None:
+                for txn in txns:
+                    callback(txn)
+
+    def _record_new_rows(self, rows, summary, fingerprinter):
+        """Record the rows of a chunk that weren't imported before.
+
+        :returns: list of the recorded Transaction instances
+        """
+        fingerprints = [fingerprinter(*row) for row in rows]
+        # no other import may record the same rows between the check and the write
+        with self.fingerprint_repository.lock:
+            new = [(row, fingerprint) for row, fingerprint in zip(rows, fingerprints)
+                   if not self.fingerprint_repository.contains(fingerprint)]
+            summary.rows_skipped += len(rows) - len(new)
+            if not new:
+                return []
+            return self._record_batch([row for row, _ in new],
+                                      [fingerprint for _, fingerprint in new])
+
+    def _fingerprinter(self):
+        """Create the Fingerprinter of an import, if imports are deduplicated."""
+        if self.fingerprint_repository is not None:
+            return Fingerprinter()
+
+    def _save_fingerprints(self):
+        if self.fingerprint_repository is not None:
+            self.fingerprint_repository.save_filter()
+
+    def record_txns(self, rows):
+        """Record many transactions with bulk datastore operations.
+
+        Every row is validated before anything is written, a single invalid
+        row fails the whole call. If the ledger's writes are atomic, see
+        `atomic_writes`, a call failing later doesn't record any of the
+        rows either.
+
+        :param rows: list of (amount, payer name, recipient name, date) tuples
+        :raises ValueError: if a row isn't a valid transaction, see
+                            `moazna.transactions.validate_txn`
+        :returns: list of the recorded Transaction instances
+        """
+        for row in rows:
+            validate_txn(*row)
+        return self._record_batch(rows)
+
+    def _record_batch(self, rows, fingerprints=None):
+        """Record a chunk of rows with bulk datastore operations.
+
+        :param rows: list of (amount, payer name, recipient name, date) tuples
+        :param fingerprints: optional list of the rows' fingerprints to record
+        :returns: list of the recorded Transaction instances
+        """
+        names = [name for row in rows for name in row[1:3]]
+        with self._hold_accounts(names):
+            txns = self._record_locked_batch(rows, fingerprints)
+
+        self._maybe_checkpoint()
+        return txns
+
+    def _record_locked_batch(self, rows, fingerprints=None):
+        accounts = {}
+        new_accounts = []
+        txns = []
+
+        for amount, payerName, recipientName, date in rows:
+            payer = self._batch_account(accounts, new_accounts, payerName)
+            recipient = self._batch_account(
+                accounts, new_accounts, recipientName)
+
+            txns.append(Transaction(amount, payer.name, recipient.name, date))
+
+            payer.credit(amount)
+            payer.post(-amount, date)
+            recipient.debit(amount)
+            recipient.post(amount, date)
+
+        new_names = set(account.name for account in new_accounts)
+        self._register(accounts)
+        with self._datastore.transaction():
+            self.txn_repository.create_many(txns)
+            if fingerprints is not None:
+                self.fingerprint_repository.create_many(fingerprints, txns)
+            if self.rollup_repository is not None:
+                self.rollup_repository.add(txns)
+            if self.flow_repository is not None:
+                self.flow_repository.add(txns)
+            self.account_repository.create_many(new_accounts)
+            self.account_repository.update_many(
+                [account for name, account in accounts.iteritems() if name not in new_names])
+        return txns
+
+    def _register(self, names):
+        """Assign account ids outside of the datastore transactions.
+
+        The registry keeps the ids it handed out in memory, so their records
+        mustn't go away with a rolled back transaction.
+        """
+        for name in names:
+            self.account_registry.id_for(name)
+
+    def _batch_account(self, accounts, new_accounts, name):
+        """Lookup an account once per batch, creating it in memory if missing."""
+        account = accounts.get(name)
+        if account is None:
+            account = self.account_repository.get_by_name(name)
+            if account is None:
+                account = Account(name, DEFAULT_BALANCE)
+                new_accounts.append(account)
+            accounts[name] = account
+        return account
+
+    def reverse_txn(self, txnId, date=None):
+        """Record the reversal of a transaction.
+
+        The reversal moves the same amount from the recipient back to the
+        payer, both transactions stay on the ledger.
+
+        :param txnId: id of the transaction to reverse
+        :param date: date of the reversal, defaults to the date of the transaction
+        :returns: Transaction instance of the reversal or None if the transaction isn't found
+        """
+        txn = self.txn_repository.get_by_id(txnId)
+        if txn is not None:
+            return self.record_txn(txn.amount, txn.recipient_name, txn.payer_name, date or txn.date)
+
+    def reverse_txns(self, txnIds, date=None):
+        """Record the reversals of many transactions with bulk datastore operations.
+
+        :param txnIds: list of ids of the transactions to reverse, unknown ids are skipped
+        :param date: date of the reversals, defaults to the date of each transaction
+        :returns: list of Transaction instances of the reversals
+        """
+        rows = []
+        for txnId in txnIds:
+            txn = self.txn_repository.get_by_id(txnId)
+            if txn is not None:
+                rows.append((txn.amount, txn.recipient_name, txn.payer_name, date or txn.date))
+        if not rows:
+            return []
+        return self._record_batch(rows)
+
+    def delete_txn(self, txnId):
+        """Delete a transaction as if it had never been recorded.
+
+        Behavior:
+            - The payer and recipient balances are rolled back and the
+            change is posted to their balance history on the transaction's
+            date, which moves every later history point along with it
+
+            - Checkpoints taken after the transaction, the rollups of its
+            accounts and its import fingerprint are adjusted in the same
+            datastore transaction, nothing is replayed
+
+        :param txnId: id of the transaction to delete
+        :returns: deleted Transaction instance or None if it isn't found
+        """
+        txn = self.txn_repository.get_by_id(txnId)
+        if txn is None:
+            return None
+        with self._hold_fingerprints(), self._hold_accounts([txn.payer_name, txn.recipient_name]):
+            deleted = self._delete_locked_txns([txnId])
+        return deleted[0] if deleted else None
+
+    def delete_txns(self, txnIds):
+        """Delete many transactions in one pass, e.g. to void a bad import.
+
+        Every touched account is read and written once, see `delete_txn`.
+        In concurrent mode no transaction is recorded meanwhile.
+
+        :param txnIds: list of transaction ids, unknown ids are skipped
+        :returns: list of the deleted Transaction instances
+        """
+        with self._hold_fingerprints(), self._hold_all_accounts():
+            return self._delete_locked_txns(txnIds)
+
+    def _delete_locked_txns(self, txnIds):
+        accounts = {}
+        changes = []
+        with self._datastore.transaction():
+            deleted = self.txn_repository.delete_many(txnIds)
+            txns = [txn for txn, _ in deleted]
+            for txn, position in deleted:
+                payer = self._batch_account(accounts, [], txn.payer_name)
+                recipient = self._batch_account(accounts, [], txn.recipient_name)
+
+                payer.debit(txn.amount)
+                payer.post(txn.amount, txn.date)
+                recipient.credit(txn.amount)
+                recipient.post(-txn.amount, txn.date)
+
+                changes.append((position, self.account_registry.id_for(payer.name), txn.amount))
+                changes.append((position, self.account_registry.id_for(recipient.name), -txn.amount))
+
+            self.account_repository.update_many(accounts.values())
+            self.checkpoint_repository.adjust(changes)
+            if self.rollup_repository is not None:
+                self.rollup_repository.remove(txns)
+            if self.flow_repository is not None:
+                self.flow_repository.remove(txns)
+            if self.fingerprint_repository is not None:
+                self.fingerprint_repository.delete_for([txn.id for txn in txns])
+        return txns
+
+    def _hold_accounts(self, names):
+        """Hold the locks of accounts in concurrent mode, see AccountLocks."""
+        if self._account_locks is None:
+            return _nullcontext()
+        return self._account_locks.hold(*names)
+
+    def _hold_fingerprints(self):
+        """Hold the fingerprint lock, taken before any account lock by imports too."""
+        if self.fingerprint_repository is None:
+            return _nullcontext()
+        return self.fingerprint_repository.lock
+
+    def _hold_all_accounts(self):
+        """Hold the locks of all accounts in concurrent mode."""
+        if self._account_locks is None:
+            return _nullcontext()
+        return self._account_locks.hold_all()
+
+    def checkpoint(self):
+        """Snapshot the balances of all accounts at the current log position.
+
+        In concurrent mode no transaction is recorded while the balances are
+        read, so the snapshot includes exactly the transactions logged before
+        its position.
+
+        :returns: Checkpoint instance
+        """
+        with self._hold_all_accounts():
+            position = self.txn_repository.position
+            balances = self.account_repository.balances_by_id()
+        return self.checkpoint_repository.create(position, balances)
+
+    def _maybe_checkpoint(self):
+        """Take a checkpoint once `checkpoint_interval` transactions were logged since the last one."""
+        if self._checkpoint_interval is None:
+            return
+
+        positions = self.checkpoint_repository.positions()
+        last = positions[-1] if positions else 0
+        if self.txn_repository.position - last < self._checkpoint_interval:
+            return
+        # a single thread takes the checkpoint, the others go on recording
+        if self._checkpoint_lock.acquire(False):
+            try:
+                self.checkpoint()
+            finally:
+                self._checkpoint_lock.release()
+
+    def balances_at(self, position=None):
+        """Compute the balances of all accounts at a position of the transaction log.
+
+        The nearest checkpoint at or before the position is loaded and only
+        the transactions logged after it are replayed, so the work is bounded
+        by the checkpoint interval rather than the size of the ledger.
+
+        :param position: log position, defaults to the current one
+        :returns: dict mapping account names to their balance
+        """
+        if position is None:
+            position = self.txn_repository.position
+
+        balances = {}
+        start = 0
+        checkpoint = self.checkpoint_repository.nearest(position)
+        if checkpoint is not None:
+            start = checkpoint.position
+            for account_id, balance in checkpoint.balances.iteritems():
+                balances[self.account_registry.name(account_id)] = balance
+
+        for txn in self.txn_repository.list_range(start, position):
+            balances[txn.payer_name] = balances.get(txn.payer_name, DEFAULT_BALANCE) - txn.amount
+            balances[txn.recipient_name] = balances.get(txn.recipient_name, DEFAULT_BALANCE) + txn.amount
+        return balances
+
+    def restore(self):
+        """Rebuild the saved account balances from the latest checkpoint.
+
+        Balances are recomputed by `balances_at` from the latest checkpoint
+        and the transactions logged after it. Accounts whose saved balance
+        differs are rewritten and missing accounts are created, their balance
+        history isn't rebuilt.
+
+        :returns: number of written accounts
+        """
+        with self._hold_all_accounts():
+            balances = self.balances_at()
+            saved = self.account_repository.balances()
+
+            missing = []
+            stale = []
+            for name, balance in balances.iteritems():
+                if name not in saved:
+                    missing.append(Account(name, balance))
+                elif saved[name] != balance:
+                    account = self.account_repository.get_by_name(name)
+                    account.balance = balance
+                    stale.append(account)
+
+            with self._datastore.transaction():
+                self.account_repository.create_many(missing)
+                self.account_repository.update_many(stale)
+        return len(missing) + len(stale)
+
+    def get_account_balance(self, accountName, date, as_of=False):
         """Browse account's balance history by date.
         :param accountName: name of the account
         :param date: date of the desired balance entry
+        :param as_of: if True, return the last known balance on or before the date
         :returns: balance at the chosen date or None if no entries found
         """
-        return self.account_repository.get_balance(accountName, date)
+        return self.account_repository.get_balance(accountName, date, as_of)
+
+    def get_rollups(self, accountName, start, end, period='day'):
+        """Browse an account's inflow, outflow and net totals per period.
+
+        :param accountName: name of the account
+        :param start: 'YYYY-MM-DD' date in the first period
+        :param end: 'YYYY-MM-DD' date in the last period
+        :param period: 'day' or 'month'
+        :returns: list of Rollup instances of the periods with transactions
+        :raises ValueError: if the ledger doesn't keep rollups
+        """
+        return self._rollups().list_range(accountName, start, end, period)
+
+    def rebuild_rollups(self):
+        """Recompute all rollups from the transactions.
+
+        Use it on a ledger recorded before rollups were enabled.
+
+        :returns: number of written rollups
+        """
+        rollups = self._rollups()
+        with self._hold_all_accounts():
+            return rollups.rebuild(self.txn_repository.list())
+
+    def _rollups(self):
+        if self.rollup_repository is None:
+            raise ValueError('the ledger was created without rollups')
+        return self.rollup_repository
+
+    def get_flow(self, payerName, recipientName, start=None, end=None):
+        """Total the amount paid by an account to another.
+
+        :param payerName: name of the paying account
+        :param recipientName: name of the receiving account
+        :param start: optional 'YYYY-MM-DD' date in the first month, requires monthly flows
+        :param end: optional 'YYYY-MM-DD' date in the last month, requires monthly flows
+        :returns: Flow instance with the amount and count of the transactions
+        :raises ValueError: if the ledger doesn't keep flows
+        """
+        return self._flows().edge(payerName, recipientName, start, end)
+
+    def top_counterparties(self, accountName, k=10, direction='both'):
+        """List the k counterparties an account exchanged the most with.
+
+        :param accountName: name of the account
+        :param k: number of counterparties
+        :param direction: 'out' for payees, 'in' for payers or 'both'
+        :returns: list of Flow instances by descending amount
+        :raises ValueError: if the ledger doesn't keep flows
+        """
+        return self._flows().top_counterparties(accountName, k, direction)
+
+    def get_degree(self, accountName):
+        """Count the distinct accounts an account received from and paid to.
+
+        :returns: dict with 'in' and 'out' degrees
+        :raises ValueError: if the ledger doesn't keep flows
+        """
+        return self._flows().degree(accountName)
+
+    def rebuild_flows(self):
+        """Recompute the flow graph from the transactions.
+
+        Use it on a ledger recorded before flows were enabled.
+
+        :returns: number of written flows
+        """
+        flows = self._flows()
+        with self._hold_all_accounts():
+            return flows.rebuild(self.txn_repository.list())
+
+    def _flows(self):
+        if self.flow_repository is None:
+            raise ValueError('the ledger was created without flows')
+        return self.flow_repository
+
+    def report(self):
+        """Build a report of all accounts' balances and flows.
+
+        The transactions are loaded once into an array-backed frame, the
+        returned report then answers trial balances, opening/closing balances
+        and per period net flows for any dates without touching the datastore.
+
+        :returns: LedgerReport instance
+        """
+        return LedgerReport(self.txn_repository.to_frame(),
+                            self.account_repository.balances())
 
     @property
     def accounts(self):
@@ -92,3 +713,22 @@ class Ledger:
     @property
     def transactions(self):
         return self.txn_repository.list()
+
+    def iter_accounts(self, order_by=None, after=None, limit=None, offset=0):
+        """Iterate over the accounts lazily, see `AccountRepository.iterate`.
+
+        Unlike `accounts`, only the accounts actually read are loaded.
+        """
+        return self.account_repository.iterate(order_by, after, limit, offset)
+
+    def iter_transactions(self, order_by=None, after=None, limit=None, offset=0):
+        """Iterate over the transactions lazily, see `TransactionRepository.iterate`.
+
+        Unlike `transactions`, only the transactions actually read are loaded.
+        """
+        return self.txn_repository.iterate(order_by, after, limit, offset)
+
+
+@contextmanager
+def _nullcontext():
+    yield
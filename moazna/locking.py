@@ -0,0 +1,47 @@
+"""Locks for recording transactions from several threads."""
+
+import threading
+from contextlib import contextmanager
+
+DEFAULT_STRIPES = 1024
+
+
+class AccountLocks(object):
+    """Fixed set of locks that account names are hashed onto.
+
+    A name always maps to the same lock, so operations on the same account
+    are serialized while operations on accounts mapped to different locks
+    proceed in parallel. `hold` acquires the locks of several accounts in
+    ascending lock order, threads holding several accounts can't deadlock
+    on each other.
+    """
+
+    def __init__(self, stripes=DEFAULT_STRIPES):
+        self._locks = [threading.Lock() for _ in xrange(stripes)]
+
+    def stripes(self, names):
+        """Return the sorted, distinct lock indexes of account names."""
+        return sorted(set(hash(name) % len(self._locks) for name in names))
+
+    def hold(self, *names):
+        """Hold the locks of the given account names inside a `with` block.
+
+        :param names: account names, duplicates are fine
+        """
+        return self._hold(self.stripes(names))
+
+    def hold_all(self):
+        """Hold every lock inside a `with` block, blocking all accounts."""
+        return self._hold(xrange(len(self._locks)))
+
+    @contextmanager
+    def _hold(self, stripes):
+        acquired = []
+        try:
+            for stripe in stripes:
+                self._locks[stripe].acquire()
+                acquired.append(stripe)
+            yield
+        finally:
+            for stripe in reversed(acquired):
+                self._locks[stripe].release()
@@ -0,0 +1,209 @@
+"""Non-blocking ledger front end writing from a background thread."""
+
+import threading
+from collections import deque
+
+from moazna.transactions import validate_txn
+
+# most transactions recorded with a single bulk write
+DEFAULT_MAX_BATCH = 1000
+
+
+class PendingResult(object):
+    """Handle on the result of an operation queued on an AsyncLedger.
+
+    Mirrors the interface of a future: `done`, `result`, `exception` and
+    `add_done_callback`. Callbacks run on the writer thread, or right away
+    if the operation is already done.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the operation and return its result.
+
+        :param timeout: seconds to wait, waits forever by default
+        :raises: the exception the operation raised, or RuntimeError on timeout
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError('operation still pending after {0}s'.format(timeout))
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for the operation and return the exception it raised, if any."""
+        if not self._done.wait(timeout):
+            raise RuntimeError('operation still pending after {0}s'.format(timeout))
+        return self._exception
+
+    def add_done_callback(self, callback):
+        """Call `callback` with this handle once the operation is done."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _resolve(self, result=None, exception=None):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                # a failing callback mustn't stop the writer thread
+                pass
+
+
+class AsyncLedger(object):
+    """Ledger front end whose calls return immediately.
+
+    Every call is queued and returns a PendingResult, a single writer thread
+    applies the queue to the wrapped Ledger in order. Transactions queued
+    back to back are recorded together through the ledger's bulk path, up
+    to `max_batch` at a time, so many callers writing at once share a few
+    datastore round trips. If a batch fails and the ledger's writes are
+    atomic, see `Ledger.atomic_writes`, nothing of it was written and its
+    transactions are recorded one by one, so only the failing ones get the
+    error. Otherwise part of the batch may be written already, retrying it
+    could record transactions twice, so every transaction of the batch gets
+    the error. Queries are queued too and see every write queued before
+    them.
+
+    The wrapped ledger must only be used through the AsyncLedger while it
+    runs. Use `close` to wait for the queue to drain and stop the thread.
+    """
+
+    def __init__(self, ledger, max_batch=DEFAULT_MAX_BATCH):
+        self.ledger = ledger
+        self._max_batch = max_batch
+        self._queue = deque()
+        self._ready = threading.Condition(threading.Lock())
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='moazna-ledger-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record_txn(self, amount, payerName, recipientName, date):
+        """Queue a transaction, see `Ledger.record_txn`.
+
+        :raises ValueError: right away if the transaction is invalid, see
+                            `moazna.transactions.validate_txn`
+        :returns: PendingResult of the recorded Transaction
+        """
+        validate_txn(amount, payerName, recipientName, date)
+        return self._submit('txn', (amount, payerName, recipientName, date))
+
+    def import_txns(self, lines, batch_size=None):
+        """Queue the import of a stream of csv lines, see `Ledger.import_stream`.
+
+        The lines are consumed on the writer thread.
+
+        :returns: PendingResult of the ImportSummary
+        """
+        return self._submit('call', (self.ledger.import_stream, (lines, batch_size)))
+
+    def get_account_balance(self, accountName, date, as_of=False):
+        """Queue a balance query, see `Ledger.get_account_balance`.
+
+        :returns: PendingResult of the balance
+        """
+        return self._submit('call', (self.ledger.get_account_balance, (accountName, date, as_of)))
+
+    def call(self, func, *args):
+        """Queue any call, e.g. a report, after the writes queued so far.
+
+        :returns: PendingResult of the call's return value
+        """
+        return self._submit('call', (func, args))
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is applied."""
+        self.call(lambda: None).result(timeout)
+
+    def close(self):
+        """Apply the queued operations and stop the writer thread."""
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+        self._thread.join()
+
+    def _submit(self, kind, payload):
+        pending = PendingResult()
+        with self._ready:
+            if self._closed:
+                raise RuntimeError('the ledger is closed')
+            self._queue.append((kind, payload, pending))
+            self._ready.notify()
+        return pending
+
+    def _next(self):
+        """Wait for queued operations and take a run of transactions or one call.
+
+        :returns: list of queued (kind, payload, pending) tuples, empty once closed
+        """
+        with self._ready:
+            while not self._queue and not self._closed:
+                self._ready.wait()
+            if not self._queue:
+                return []
+            taken = [self._queue.popleft()]
+            if taken[0][0] == 'txn':
+                while (self._queue and self._queue[0][0] == 'txn'
+                       and len(taken) < self._max_batch):
+                    taken.append(self._queue.popleft())
+            return taken
+
+    def _run(self):
+        while True:
+            taken = self._next()
+            if not taken:
+                return
+
+            kind, payload, pending = taken[0]
+            if kind == 'call':
+                func, args = payload
+                self._apply(pending, func, *args)
+            elif len(taken) == 1:
+                self._apply(pending, self.ledger.record_txn, *payload)
+            else:
+                try:
+                    results = self.ledger.record_txns([item[1] for item in taken])
+                except Exception as error:
+                    if self.ledger.atomic_writes:
+                        # nothing was written, isolate the failing transactions
+                        for _, payload, pending in taken:
+                            self._apply(pending, self.ledger.record_txn, *payload)
+                    else:
+                        for _, _, pending in taken:
+                            pending._resolve(exception=error)
+                else:
+                    for (_, _, pending), result in zip(taken, results):
+                        pending._resolve(result)
+
+    def _apply(self, pending, func, *args):
+        """Call a queued operation and resolve its PendingResult."""
+        try:
+            result = func(*args)
+        except Exception as error:
+            pending._resolve(exception=error)
+        else:
+            pending._resolve(result)
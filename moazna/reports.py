@@ -0,0 +1,214 @@
+"""Ledger reports computed over an array-backed view of the transactions."""
+import bisect
+import itertools
+from array import array
+from datetime import date
+
+from moazna.dates import from_ordinal, to_ordinal
+
+PERIODS = ['day', 'month', 'year']
+
+
+class TransactionFrame(object):
+    """Column-oriented view of transactions.
+
+    Every transaction is a row across typed arrays of amounts, day ordinals
+    and payer/recipient account indexes, account names are stored once.
+    """
+
+    def __init__(self, names=()):
+        """Create an empty frame.
+
+        :param names: optional list of account names indexed by account id,
+                      to fill the payer/recipient arrays with existing ids
+        """
+        self.names = list(names)
+        self.amounts = array('d')
+        self.dates = array('l')
+        self.payers = array('l')
+        self.recipients = array('l')
+        self._ids = dict((name, account_id) for account_id, name in enumerate(self.names)
+                         if name is not None)
+
+    def __len__(self):
+        return len(self.amounts)
+
+    @classmethod
+    def from_records(cls, records):
+        """Create a TransactionFrame from transaction dicts.
+
+        :param records: iterable of dicts with amount, payer_name, recipient_name and date keys
+        :returns: TransactionFrame instance
+        """
+        frame = cls()
+        for record in records:
+            frame.append(record['amount'], record['payer_name'],
+                         record['recipient_name'], to_ordinal(record['date']))
+        return frame
+
+    def account_id(self, name):
+        """Return the index of an account name, adding it if needed."""
+        account_id = self._ids.get(name)
+        if account_id is None:
+            account_id = self._ids[name] = len(self.names)
+            self.names.append(name)
+        return account_id
+
+    def append(self, amount, payerName, recipientName, ordinal):
+        """Add a transaction row.
+
+        :param amount: transaction amount
+        :param payerName: payer account name
+        :param recipientName: recipient account name
+        :param ordinal: day ordinal of the transaction date
+        """
+        self.amounts.append(amount)
+        self.dates.append(ordinal)
+        self.payers.append(self.account_id(payerName))
+        self.recipients.append(self.account_id(recipientName))
+
+
+class LedgerReport(object):
+    """Balances and flows of all accounts across dates.
+
+    The transactions are grouped by account and day once, and turned into
+    per account cumulative sums sorted by date. Any balance on any date is
+    then a binary search, regardless of the order the transactions were
+    recorded in.
+    """
+
+    def __init__(self, frame, balances):
+        """Create a report.
+
+        :param frame: TransactionFrame of all the ledger's transactions
+        :param balances: dict mapping every account name to its current balance
+        """
+        net = {}
+        for amount, ordinal, payer, recipient in itertools.izip(
+                frame.amounts, frame.dates, frame.payers, frame.recipients):
+            net[payer, ordinal] = net.get((payer, ordinal), 0.0) - amount
+            net[recipient, ordinal] = net.get((recipient, ordinal), 0.0) + amount
+
+        grouped = {}
+        for (account_id, ordinal), amount in net.iteritems():
+            grouped.setdefault(account_id, []).append((ordinal, amount))
+
+        self._dates = {}
+        self._cumulative = {}
+        for account_id, entries in grouped.iteritems():
+            entries.sort()
+            dates = array('l')
+            cumulative = array('d')
+            total = 0.0
+            for ordinal, amount in entries:
+                total += amount
+                dates.append(ordinal)
+                cumulative.append(total)
+            name = frame.names[account_id]
+            self._dates[name] = dates
+            self._cumulative[name] = cumulative
+
+        # opening balances are whatever the accounts held before their first transaction
+        self._opening = {}
+        for name, balance in balances.iteritems():
+            cumulative = self._cumulative.get(name)
+            self._opening[name] = balance - (cumulative[-1] if cumulative else 0.0)
+
+    @property
+    def accounts(self):
+        return sorted(self._opening)
+
+    def _balance(self, name, ordinal):
+        balance = self._opening[name]
+        dates = self._dates.get(name)
+        if dates:
+            index = bisect.bisect_right(dates, ordinal) - 1
+            if index >= 0:
+                balance += self._cumulative[name][index]
+        return balance
+
+    def balance(self, name, date=None):
+        """Balance of an account at the end of a date.
+
+        :param name: account name
+        :param date: 'YYYY-MM-DD' date, defaults to the latest balance
+        :returns: balance amount or None if the account doesn't exist
+        """
+        if name in self._opening:
+            return self._balance(name, _ordinal_or_max(date))
+
+    def trial_balance(self, date=None):
+        """Balances of all accounts at the end of a date.
+
+        :param date: 'YYYY-MM-DD' date, defaults to the latest balances
+        :returns: dict mapping account names to balances
+        """
+        ordinal = _ordinal_or_max(date)
+        return dict((name, self._balance(name, ordinal)) for name in self._opening)
+
+    def opening_closing(self, start, end):
+        """Opening and closing balances of all accounts over a period.
+
+        :param start: first 'YYYY-MM-DD' date of the period
+        :param end: last 'YYYY-MM-DD' date of the period
+        :returns: dict mapping account names to (opening, closing) tuples
+        """
+        start, end = to_ordinal(start), to_ordinal(end)
+        return dict((name, (self._balance(name, start - 1), self._balance(name, end)))
+                    for name in self._opening)
+
+    def net_flows(self, start, end, period='month'):
+        """Net flow of all accounts per period.
+
+        :param start: first 'YYYY-MM-DD' date of the range
+        :param end: last 'YYYY-MM-DD' date of the range
+        :param period: one of 'day', 'month' or 'year'
+        :returns: tuple of (list of period labels, dict mapping account names
+                  to lists of net flows, one per period)
+        """
+        labels, bounds = _period_bounds(to_ordinal(start), to_ordinal(end), period)
+        matrix = {}
+        for name in self._opening:
+            balances = [self._balance(name, bound) for bound in bounds]
+            matrix[name] = [closing - opening
+                            for opening, closing in zip(balances, balances[1:])]
+        return labels, matrix
+
+
+def _ordinal_or_max(value):
+    if value is None:
+        return date.max.toordinal()
+    return to_ordinal(value)
+
+
+def _period_bounds(start, end, period):
+    """Split a range of day ordinals into periods.
+
+    :returns: tuple of (list of period labels, list of ordinals where the
+              first is the day before the range and the rest are the last
+              day of every period, clipped to the range)
+    """
+    if period not in PERIODS:
+        raise ValueError('unknown period {0!r}, expected one of {1}'.format(
+            period, ', '.join(PERIODS)))
+
+    labels = []
+    bounds = [start - 1]
+    current = start
+    while current <= end:
+        day = date.fromordinal(current)
+        if period == 'day':
+            label, following = from_ordinal(current), current + 1
+        elif period == 'month':
+            label = '{0:04d}-{1:02d}'.format(day.year, day.month)
+            if day.month == 12:
+                following = date(day.year + 1, 1, 1).toordinal()
+            else:
+                following = date(day.year, day.month + 1, 1).toordinal()
+        else:
+            label = '{0:04d}'.format(day.year)
+            following = date(day.year + 1, 1, 1).toordinal()
+        labels.append(label)
+        bounds.append(min(following - 1, end))
+        current = following
+    return labels, bounds
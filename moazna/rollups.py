@@ -0,0 +1,173 @@
+"""Per account daily and monthly totals maintained as transactions are recorded."""
+from moazna.dates import from_month, from_ordinal, to_month, to_ordinal
+
+ROLLUP_PERIODS = ['day', 'month']
+
+
+class Rollup(object):
+    """Inflow, outflow and number of transactions of an account over a period."""
+
+    __slots__ = ('account_name', 'period', 'label', 'inflow', 'outflow', 'count')
+
+    def __init__(self, account_name, period, label, inflow=0.0, outflow=0.0, count=0):
+        self.account_name = account_name
+        self.period = period
+        self.label = label
+        self.inflow = inflow
+        self.outflow = outflow
+        self.count = count
+
+    def __iter__(self):
+        KEYS = ['account_name', 'period', 'label', 'inflow', 'outflow', 'net', 'count']
+
+        for key in KEYS:
+            yield key, getattr(self, key)
+
+    def __repr__(self):
+        return '{0}(account_name={1}, period={2}, label={3}, net={4})'.format(
+            self.__class__.__name__, self.account_name, self.period, self.label, self.net)
+
+    @property
+    def net(self):
+        return self.inflow - self.outflow
+
+
+class RollupRepository(object):
+    """A class to help persist rollups in a datastore/database.
+
+    Every (account, period) pair is a record keyed by the account id, the
+    period and its bucket: the day ordinal for days and the number of months
+    since year 0 for months. Recording transactions adds their amounts to
+    the few records they touch, and a range of periods is read by key
+    without looking at the transactions.
+    """
+
+    def __init__(self, datastore, registry):
+        self._datastore = datastore
+        self.registry = registry
+        self.__entity = 'rollups'
+        self.__id_attr = 'id'
+        self._datastore.add_entity(self.__entity, self.__id_attr)
+
+    def add(self, txns):
+        """Add transactions to the rollups of their accounts.
+
+        The changes are summed in memory first, every touched rollup is then
+        read and written once.
+
+        :param txns: list of Transaction instances
+        :returns: number of written rollups
+        """
+        return self.__apply(txns, 1)
+
+    def remove(self, txns):
+        """Subtract deleted transactions from the rollups of their accounts.
+
+        Rollups left without transactions are deleted.
+
+        :param txns: list of Transaction instances
+        :returns: number of written or deleted rollups
+        """
+        return self.__apply(txns, -1)
+
+    def __apply(self, txns, sign):
+        changes = {}
+        for txn in txns:
+            amount = sign * txn.amount
+            payer_id = self.registry.id_for(txn.payer_name)
+            recipient_id = self.registry.id_for(txn.recipient_name)
+            ordinal = to_ordinal(txn.date)
+            for period, bucket in (('day', ordinal), ('month', to_month(ordinal))):
+                payer = self.__change(changes, payer_id, period, bucket)
+                payer['outflow'] += amount
+                payer['count'] += sign
+
+                recipient = self.__change(changes, recipient_id, period, bucket)
+                recipient['inflow'] += amount
+                if recipient is not payer:
+                    recipient['count'] += sign
+
+        created = []
+        updated = []
+        deleted = []
+        for rollup_id, change in changes.iteritems():
+            record = self._datastore.retrieve(self.__entity, self.__id_attr, rollup_id)
+            if record is None:
+                if change['count'] > 0:
+                    created.append(change)
+                continue
+            for key in ('inflow', 'outflow', 'count'):
+                record[key] += change[key]
+            if record['count'] > 0:
+                updated.append(record)
+            else:
+                deleted.append(rollup_id)
+        self._datastore.create_many(self.__entity, created)
+        self._datastore.update_many(self.__entity, updated, self.__id_attr)
+        for rollup_id in deleted:
+            self._datastore.delete(self.__entity, self.__id_attr, rollup_id)
+        return len(created) + len(updated) + len(deleted)
+
+    def list_range(self, accountName, start, end, period='day'):
+        """List the rollups of an account between two dates.
+
+        Only the periods the account has transactions in are returned.
+
+        :param accountName: name of the account
+        :param start: 'YYYY-MM-DD' date in the first period of the range
+        :param end: 'YYYY-MM-DD' date in the last period of the range
+        :param period: 'day' or 'month'
+        :returns: list of Rollup instances in date order
+        """
+        if period not in ROLLUP_PERIODS:
+            raise ValueError('unknown period {0!r}, expected one of {1}'.format(
+                period, ', '.join(ROLLUP_PERIODS)))
+        account_id = self.registry.get_id(accountName)
+        if account_id is None:
+            return []
+
+        start, end = to_ordinal(start), to_ordinal(end)
+        if period == 'month':
+            start, end = to_month(start), to_month(end)
+
+        rollups = []
+        for bucket in xrange(start, end + 1):
+            record = self._datastore.retrieve(
+                self.__entity, self.__id_attr, _rollup_id(account_id, period, bucket))
+            if record is not None:
+                rollups.append(self._instance(record))
+        return rollups
+
+    def rebuild(self, txns):
+        """Replace all rollups with the rollups of the given transactions.
+
+        :param txns: list of all Transaction instances
+        :returns: number of written rollups
+        """
+        with self._datastore.transaction():
+            for record in self._datastore.filter(self.__entity, self.__id_attr):
+                self._datastore.delete(self.__entity, self.__id_attr, record[self.__id_attr])
+            return self.add(txns)
+
+    def _instance(self, record):
+        """Build a Rollup instance from its datastore record."""
+        bucket = record['bucket']
+        if record['period'] == 'day':
+            label = from_ordinal(bucket)
+        else:
+            label = from_month(bucket)
+        return Rollup(self.registry.name(record['account_id']), record['period'], label,
+                      record['inflow'], record['outflow'], record['count'])
+
+    def __change(self, changes, account_id, period, bucket):
+        rollup_id = _rollup_id(account_id, period, bucket)
+        change = changes.get(rollup_id)
+        if change is None:
+            change = changes[rollup_id] = {
+                'id': rollup_id, 'account_id': account_id, 'period': period,
+                'bucket': bucket, 'inflow': 0.0, 'outflow': 0.0, 'count': 0}
+        return change
+
+
+def _rollup_id(account_id, period, bucket):
+    return '{0}:{1}:{2}'.format(period, account_id, bucket)
@@ -1,9 +1,28 @@
 """Transaction Class."""
 
+import heapq
+import math
+import sys
+import threading
 import uuid
 
+from moazna.accounts import AccountRegistry
+from moazna.dates import DAY_BITS, account_day, to_ordinal
+from moazna.datastores.columnar_datastore import ColumnarTransactionStore
+from moazna.reports import TransactionFrame
+
+
+# log positions looked up by a single filter in `list_range`
+RANGE_CHUNK = 500
+# indexes of (account, day) keys by the role of the account in the transactions
+ACCOUNT_DAY_INDEXES = {'payer': 'payer_day', 'recipient': 'recipient_day'}
+# orders of `TransactionRepository.iterate` -> attributes the records are scanned by
+TXN_ORDERS = {None: None, 'id': ('id',), 'date': ('date', 'id')}
+
 
 class Transaction(object):
+    __slots__ = ('id', 'amount', 'payer_name', 'recipient_name', 'date')
+
     def __init__(self, amount, payerName, recipientName, date):
         self.id = self._generate_id()
         self.amount = amount
@@ -14,9 +33,8 @@ class Transaction(object):
     def __iter__(self):
         KEYS = ['id', 'amount', 'payer_name', 'recipient_name', 'date']
 
-        for key in self.__dict__:
-            if key in KEYS:
-                yield key, self.__getattribute__(key)
+        for key in KEYS:
+            yield key, self.__getattribute__(key)
 
     def __str__(self):
         return '{0}, {1}, {2}, {3}, {4}'.format(self.id, self.amount, self.payer_name, self.recipient_name, self.date)
@@ -31,21 +49,92 @@ class Transaction(object):
 
     @classmethod
     def from_dict(cls, data):
-        instance = cls(data['amount'], data['payer_name'],
+        """Create a Transaction instance from dict.
+
+        Dicts carrying an id, like the records loaded from a datastore,
+        skip __init__ and don't generate a new id.
+
+        :param data: Dict containing amount, payer_name, recipient_name, date and possibly id attrs
+        :returns: Transaction instance
+        """
+        if 'id' not in data:
+            return cls(data['amount'], data['payer_name'],
                        data['recipient_name'], data['date'])
-        if 'id' in data:
-            instance.id = data['id']
+
+        return cls._restore(data['id'], data['amount'], data['payer_name'],
+                            data['recipient_name'], data['date'])
+
+    @classmethod
+    def _restore(cls, txnId, amount, payerName, recipientName, date):
+        """Create a Transaction instance with an existing id, skipping __init__."""
+        instance = cls.__new__(cls)
+        instance.id = txnId
+        instance.amount = amount
+        instance.payer_name = payerName
+        instance.recipient_name = recipientName
+        instance.date = date
         return instance
 
 
 class TransactionRepository(object):
-    """A class to help persist transactions in a datastore/database."""
-
-    def __init__(self, datastore):
+    """A class to help persist transactions in a datastore/database.
+
+    Transaction records refer to their payer and recipient by the integer
+    ids of an AccountRegistry, the indexes are on those ids and the names
+    are only resolved when Transaction instances are built.
+
+    Every created transaction is stored with its `position` in the
+    transaction log, the next number of a sequence, which `list_range`
+    looks up. The next position is kept in a 'sequences' record of the
+    datastore, so it isn't looked up again when the datastore is reopened.
+    Dates are also stored as day ordinals, alone and combined with the
+    payer and recipient ids in ordered 'payer_day' and 'recipient_day'
+    indexes, which serve `list_by_date_range` and the listings of an
+    account. Those are ordered by date, by log position on the same date.
+
+    With `columnar` set, transactions are kept in a ColumnarTransactionStore
+    in memory instead of the given datastore: amounts as integer cents,
+    dates as day ordinals and accounts as integer ids in typed arrays.
+    Transaction instances are only built when they're read.
+    """
+
+    def __init__(self, datastore, columnar=False, registry=None):
+        self.registry = registry if registry is not None else AccountRegistry(datastore)
+        # the columnar store is in memory, so is the position sequence
+        self._sequences = None
+        if columnar:
+            datastore = ColumnarTransactionStore()
+        else:
+            self._sequences = datastore
+            self._sequences.add_entity('sequences', 'name')
         self._datastore = datastore
         self.__entity = 'transactions'
         self.__id_attr = 'id'
-        self._datastore.add_entity(self.__entity)
+        self._datastore.add_entity(self.__entity, self.__id_attr, {
+            'position': 'position',
+            'day': 'day',
+            'payer_day': 'payer_day',
+            'recipient_day': 'recipient_day',
+        })
+        self._next_position = None
+        self._position_lock = threading.Lock()
+
+    @property
+    def position(self):
+        """Log position of the next transaction, the number of transactions created so far."""
+        if self._next_position is None:
+            with self._position_lock:
+                if self._next_position is None:
+                    self._next_position = self._load_position()
+        return self._next_position
+
+    def skip_to(self, position):
+        """Make sure the next transactions get log positions from `position` on."""
+        current = self.position
+        if position > current:
+            with self._position_lock:
+                self._next_position = max(self._next_position, position)
+                self._save_position()
 
     def create(self, amount, payerName, recipientName, date):
         """Create a new transaction and save to the datastore.
@@ -57,17 +146,120 @@ class TransactionRepository(object):
         :returns: Transaction instance of the newly created transaction
         """
         instance = Transaction(amount, payerName, recipientName, date)
-        return Transaction.from_dict(self._datastore.create(self.__entity, dict(instance)))
+        self._datastore.create(self.__entity, self._record(instance, self._take_positions(1)))
+        return instance
+
+    def create_many(self, instances):
+        """Save new Transaction instances in bulk.
+
+        :param instances: list of Transaction instances
+        :returns: number of created transactions
+        """
+        first = self._take_positions(len(instances))
+        return self._datastore.create_many(
+            self.__entity, [self._record(instance, first + offset)
+                            for offset, instance in enumerate(instances)])
 
     def list(self):
         """List all saved transactions."""
 
-        records = self._datastore.filter(self.__entity, self.__id_attr)
-        txns = []
-        for record in records:
-            txn = Transaction.from_dict(record)
-            txns.append(txn)
+        return self._list(self.__id_attr, [])
+
+    def iterate(self, order_by=None, after=None, limit=None, offset=0):
+        """Iterate over the saved transactions lazily.
 
+        Only the records read from the iterator are turned into Transaction
+        instances, stop iterating early or pass a `limit` to read a page.
+        For keyset pagination pass the cursor of the last transaction of a
+        page as `after`: its id when ordering by 'id', its (date, id) when
+        ordering by 'date'.
+
+        :param order_by: None for insertion order, 'id' or 'date'
+        :param after: keyset cursor, requires `order_by`
+        :param limit: maximum number of transactions
+        :param offset: number of transactions to skip
+        :returns: generator of Transaction instances
+        """
+        if order_by not in TXN_ORDERS:
+            raise ValueError('unknown order {0!r}, expected one of {1}'.format(
+                order_by, ', '.join(str(order) for order in TXN_ORDERS)))
+        records = self._datastore.scan(self.__entity, TXN_ORDERS[order_by], after, limit, offset)
+        return (self._instance(record) for record in records)
+
+    def to_frame(self):
+        """Build an array-backed TransactionFrame of all saved transactions."""
+
+        names = self.registry.names
+        if isinstance(self._datastore, ColumnarTransactionStore):
+            return self._datastore.to_frame(names)
+
+        frame = TransactionFrame(names)
+        for record in self._datastore.filter(self.__entity, self.__id_attr):
+            frame.amounts.append(record['amount'])
+            frame.dates.append(to_ordinal(record['date']))
+            frame.payers.append(record['payer_id'])
+            frame.recipients.append(record['recipient_id'])
+        return frame
+
+    def net_by_account(self):
+        """Net flow of every account, received minus paid, over all transactions.
+
+        :returns: dict mapping account names to net amounts
+        """
+        if isinstance(self._datastore, ColumnarTransactionStore):
+            net = self._datastore.net_by_account()
+        else:
+            net = {}
+            for record in self._datastore.filter(self.__entity, self.__id_attr):
+                net[record['payer_id']] = net.get(record['payer_id'], 0.0) - record['amount']
+                net[record['recipient_id']] = net.get(record['recipient_id'], 0.0) + record['amount']
+        return dict((self.registry.name(account_id), amount)
+                    for account_id, amount in net.iteritems())
+
+    def sum_by_date_range(self, start, end):
+        """Total amount of the transactions between two dates, inclusive.
+
+        :param start: first 'YYYY-MM-DD' date of the range
+        :param end: last 'YYYY-MM-DD' date of the range
+        """
+        if isinstance(self._datastore, ColumnarTransactionStore):
+            return self._datastore.sum_by_date_range(start, end)
+
+        return sum(record['amount'] for record in self._datastore.filter_range(
+            self.__entity, 'day', to_ordinal(start), to_ordinal(end)))
+
+    def list_by_date_range(self, start, end, account=None):
+        """List the transactions between two dates, inclusive.
+
+        The 'day' index is ordered, with an account its 'payer_day' and
+        'recipient_day' indexes of (account, day) keys are, so only the
+        matching transactions are read.
+
+        :param start: first 'YYYY-MM-DD' date of the range
+        :param end: last 'YYYY-MM-DD' date of the range
+        :param account: optional name of an account, as either payer or recipient
+        :returns: List of Transaction instances ordered by date
+        """
+        start, end = to_ordinal(start), to_ordinal(end)
+        if account is None:
+            return [self._instance(record) for record in
+                    self._datastore.filter_range(self.__entity, 'day', start, end)]
+
+        return self._list_by_account(account, ACCOUNT_DAY_INDEXES.values(), start, end)
+
+    def list_range(self, start, end):
+        """List the transactions between two log positions.
+
+        :param start: first log position
+        :param end: log position after the last one
+        :returns: List of Transaction instances ordered by log position
+        """
+        txns = []
+        for chunk_start in xrange(start, end, RANGE_CHUNK):
+            positions = range(chunk_start, min(chunk_start + RANGE_CHUNK, end))
+            records = self._datastore.filter(self.__entity, 'position', positions)
+            records.sort(key=lambda record: record['position'])
+            txns.extend(self._instance(record) for record in records)
         return txns
 
     def get_by_id(self, txnId):
@@ -79,50 +271,33 @@ class TransactionRepository(object):
 
         record = self._datastore.retrieve(self.__entity, self.__id_attr, txnId)
         if record is not None:
-            return Transaction.from_dict(record)
+            return self._instance(record)
 
     def list_by_name(self, name):
         """List all transactions containing a name as either payer or recipient.
 
         :param name: account name
-        :returns: List of Transaction instances if found or empty list otherwise
+        :returns: List of Transaction instances ordered by date if found or empty list otherwise
         """
-        txns = []
-        txns.extend(self.list_by_payer(name))
-        txns.extend(self.list_by_recipient(name))
-        return txns
+        return self._list_by_account(name, ACCOUNT_DAY_INDEXES.values())
 
     def list_by_payer(self, payerName):
         """List all transactions by a payer.
 
         :param payerName: payer account name
-        :returns: List of Transaction instances if found or empty list otherwise
+        :returns: List of Transaction instances ordered by date if found or empty list otherwise
         """
 
-        records = self._datastore.filter(
-            self.__entity, 'payer_name', payerName)
-        txns = []
-        for record in records:
-            txn = Transaction.from_dict(record)
-            txns.append(txn)
-
-        return txns
+        return self._list_by_account(payerName, [ACCOUNT_DAY_INDEXES['payer']])
 
     def list_by_recipient(self, recipientName):
         """List all transactions by a recipient.
 
         :param recipientName: payer account name
-        :returns: List of Transaction instances if found or empty list otherwise
+        :returns: List of Transaction instances ordered by date if found or empty list otherwise
         """
 
-        records = self._datastore.filter(
-            self.__entity, 'recipient_name', recipientName)
-        txns = []
-        for record in records:
-            txn = Transaction.from_dict(record)
-            txns.append(txn)
-
-        return txns
+        return self._list_by_account(recipientName, [ACCOUNT_DAY_INDEXES['recipient']])
 
     def update(self, instance):
         """Update a transaction.
@@ -131,8 +306,8 @@ class TransactionRepository(object):
         :returns: Transaction instance after it's saved in the datastore 
         """
         record = self._datastore.update(
-            self.__entity, dict(instance), self.__id_attr)
-        return Transaction.from_dict(record)
+            self.__entity, self._record(instance), self.__id_attr)
+        return self._instance(record)
 
     def delete(self, instance):
         """Delete a transaction.
@@ -142,3 +317,141 @@ class TransactionRepository(object):
 
         self._datastore.delete(
             self.__entity, self.__id_attr, dict(instance)[self.__id_attr])
+
+    def delete_many(self, txnIds):
+        """Delete transactions by id.
+
+        Ids of transactions that aren't saved are skipped.
+
+        :param txnIds: list of transaction ids
+        :returns: list of (Transaction instance, log position) pairs of the deleted transactions
+        """
+        deleted = []
+        for txnId in txnIds:
+            record = self._datastore.retrieve(self.__entity, self.__id_attr, txnId)
+            if record is not None:
+                self._datastore.delete(self.__entity, self.__id_attr, txnId)
+                deleted.append((self._instance(record), record['position']))
+        return deleted
+
+    def _list(self, key, values):
+        return [self._instance(record)
+                for record in self._datastore.filter(self.__entity, key, values)]
+
+    def _list_by_account(self, name, indexes, start=0, end=(1 << DAY_BITS) - 1):
+        """List the transactions of an account through ranges of its (account, day) keys.
+
+        The ranges of several indexes are merged by date and log position,
+        a transaction in more than one of them is listed once.
+
+        :param indexes: names of the (account, day) indexes to read
+        :param start: first day ordinal
+        :param end: last day ordinal
+        :returns: List of Transaction instances ordered by date
+        """
+        account_id = self.registry.get_id(name)
+        if account_id is None:
+            return []
+
+        ranges = [self._datastore.filter_range(
+            self.__entity, index, account_day(account_id, start), account_day(account_id, end))
+            for index in indexes]
+        if len(ranges) == 1:
+            return [self._instance(record) for record in ranges[0]]
+
+        txns = []
+        previous = None
+        merged = heapq.merge(*[[((record['date'], record['position'], order), record)
+                                for record in records]
+                               for order, records in enumerate(ranges)])
+        for _, record in merged:
+            if record[self.__id_attr] != previous:
+                txns.append(self._instance(record))
+                previous = record[self.__id_attr]
+        return txns
+
+    def _take_positions(self, count):
+        """Reserve `count` consecutive log positions, returns the first."""
+        self.position
+        with self._position_lock:
+            first = self._next_position
+            self._next_position += count
+            self._save_position()
+        return first
+
+    def _load_position(self):
+        """Read the persisted next log position.
+
+        Datastores written before it was persisted get it from the
+        'position' index once: positions of deleted transactions below the
+        count leave as many positions at or above it in use.
+        """
+        if self._sequences is not None:
+            record = self._sequences.retrieve('sequences', 'name', self.__entity)
+            if record is not None:
+                return record['next']
+
+        position = self._datastore.count(self.__entity) or 0
+        for record in self._datastore.filter_range(self.__entity, 'position', position, sys.maxint):
+            position = max(position, record['position'] + 1)
+        if self._sequences is not None:
+            self._sequences.create('sequences', {'name': self.__entity, 'next': position})
+        return position
+
+    def _save_position(self):
+        """Persist the next log position, called with the position lock held."""
+        if self._sequences is not None:
+            self._sequences.update('sequences', {'name': self.__entity, 'next': self._next_position}, 'name')
+
+    def _record(self, instance, position=None):
+        """Build the datastore record of a Transaction instance.
+
+        :param position: log position of a new transaction, left out of updates
+        """
+        payer_id = self.registry.id_for(instance.payer_name)
+        recipient_id = self.registry.id_for(instance.recipient_name)
+        day = to_ordinal(instance.date)
+        record = {
+            'id': instance.id,
+            'amount': instance.amount,
+            'payer_id': payer_id,
+            'recipient_id': recipient_id,
+            'date': instance.date,
+            'day': day,
+            'payer_day': account_day(payer_id, day),
+            'recipient_day': account_day(recipient_id, day),
+        }
+        if position is not None:
+            record['position'] = position
+        return record
+
+    def _instance(self, record):
+        """Build a Transaction instance from its datastore record."""
+        payer, recipient = record['payer_id'], record['recipient_id']
+        names = self.registry.names
+        if payer < len(names) and recipient < len(names):
+            payerName, recipientName = names[payer], names[recipient]
+        else:
+            payerName = recipientName = None
+        if payerName is None or recipientName is None:
+            # assigned by another registry sharing the datastore
+            payerName = self.registry.name(payer)
+            recipientName = self.registry.name(recipient)
+        return Transaction._restore(
+            record['id'], record['amount'], payerName, recipientName, record['date'])
+
+
+def validate_txn(amount, payerName, recipientName, date):
+    """Check the arguments of a transaction before anything is recorded.
+
+    :raises ValueError: if the amount isn't a finite number, an account name
+                        isn't a non empty string or the date isn't a valid
+                        'YYYY-MM-DD' date
+    """
+    if (isinstance(amount, bool) or not isinstance(amount, (int, long, float))
+            or math.isinf(amount) or math.isnan(amount)):
+        raise ValueError('invalid amount {0!r}'.format(amount))
+    for name in (payerName, recipientName):
+        if not isinstance(name, basestring) or not name:
+            raise ValueError('invalid account name {0!r}'.format(name))
+    to_ordinal(date)
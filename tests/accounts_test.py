@@ -1,6 +1,9 @@
+import marshal
 import unittest
+import random
+from array import array
 from datetime import datetime
-from moazna.accounts import Account, AccountRepository
+from moazna.accounts import Account, AccountRegistry, AccountRepository, BalanceIndex
 from moazna.datastores import json_datastore
 
 
@@ -37,6 +40,71 @@ class TestAccount(unittest.TestCase):
         self.assertEqual(self.sample_account.get_balance('2017-01-15'), 100.0)
         self.assertEqual(len(self.sample_account.balance_history), 2)
 
+    def test_update_history_keeps_dates_sorted(self):
+        self.sample_account.update_history(100.0, '2017-01-15')
+        self.sample_account.update_history(50.0, '2017-01-10')
+        self.sample_account.update_history(75.0, '2017-01-15')
+        dates = [entry['date'] for entry in self.sample_account.balance_history]
+        self.assertEqual(dates, sorted(dates))
+        self.assertEqual(len(dates), 3)
+        self.assertEqual(self.sample_account.get_balance('2017-01-15'), 75.0)
+
+    def test_get_balance_as_of(self):
+        self.sample_account.update_history(100.0, '2017-01-15')
+        self.sample_account.update_history(50.0, '2017-01-10')
+        self.assertIsNone(self.sample_account.get_balance('2017-01-12'))
+        self.assertEqual(self.sample_account.get_balance(
+            '2017-01-12', as_of=True), 50.0)
+        self.assertEqual(self.sample_account.get_balance(
+            '2017-01-31', as_of=True), 100.0)
+        self.assertIsNone(self.sample_account.get_balance(
+            '2017-01-01', as_of=True))
+
+    def test_from_dict_with_unsorted_history(self):
+        sample_account = Account.from_dict({
+            'name': 'mr sample',
+            'balance': 10,
+            'balance_history': [
+                {'date': '2017-02-01', 'balance': 10},
+                {'date': '2017-01-01', 'balance': 5},
+            ]
+        })
+        self.assertEqual(sample_account.balance_history, [
+            {'date': '2017-01-01', 'balance': 5},
+            {'date': '2017-02-01', 'balance': 10},
+        ])
+
+    def test_from_dict_with_history_skips_opening_entry(self):
+        sample_account = Account.from_dict({
+            'name': 'mr sample',
+            'balance': 10,
+            'balance_history': [{'date': '2017-01-01', 'balance': 10}]
+        })
+        self.assertEqual(sample_account.balance_history, [
+            {'date': '2017-01-01', 'balance': 10}])
+        self.assertFalse(hasattr(sample_account, '__dict__'))
+
+    def test_post_back_dated_changes(self):
+        self.sample_account.post(100.0, '2017-01-15')
+        self.sample_account.post(-30.0, '2017-01-10')
+        self.sample_account.post(5.0, '2017-01-20')
+        self.assertEqual(self.sample_account.get_balance('2017-01-10'), -30.0)
+        self.assertEqual(self.sample_account.get_balance('2017-01-15'), 70.0)
+        self.assertEqual(self.sample_account.get_balance('2017-01-17', as_of=True), 70.0)
+        self.assertEqual(self.sample_account.get_balance('2017-01-20'), 75.0)
+
+    def test_update_history_keeps_later_balances(self):
+        self.sample_account.update_history(100.0, '2017-01-15')
+        self.sample_account.update_history(40.0, '2017-01-10')
+        self.assertEqual(self.sample_account.get_balance('2017-01-10'), 40.0)
+        self.assertEqual(self.sample_account.get_balance('2017-01-15'), 100.0)
+
+    def test_to_record_round_trips(self):
+        self.sample_account.post(100.0, '2017-01-15')
+        record = self.sample_account.to_record()
+        self.assertEqual(Account.from_dict(record).balance_history,
+                         self.sample_account.balance_history)
+
     def test_get_balance_without_date(self):
         self.assertEqual(self.sample_account.get_balance(),
                          self.sample_account.balance)
@@ -46,6 +114,53 @@ class TestAccount(unittest.TestCase):
             datetime.now().strftime('%Y-%m-%d')), self.sample_account.balance)
 
 
+class TestBalanceIndex(unittest.TestCase):
+
+    def test_prefix_matches_running_sums(self):
+        generator = random.Random(0)
+        index = BalanceIndex()
+        changes = {}
+        for _ in xrange(3000):
+            ordinal = 736330 + generator.randint(-1500, 1500)
+            amount = generator.randint(-50, 50)
+            index.add(ordinal, amount)
+            changes[ordinal] = changes.get(ordinal, 0) + amount
+
+        self.assertEqual(list(index.dates), sorted(changes))
+        self.assertEqual(len(index), len(changes))
+        for ordinal in xrange(736330 - 1502, 736330 + 1502, 7):
+            self.assertEqual(index.prefix(ordinal), sum(
+                amount for day, amount in changes.iteritems() if day <= ordinal))
+
+    def test_dumps_and_loads(self):
+        index = BalanceIndex()
+        index.add(736330, 10)
+        index.add(736300, -4)
+        loaded = BalanceIndex.loads(index.dumps())
+        self.assertEqual(loaded.prefix(736329), -4)
+        self.assertEqual(loaded.prefix(736330), 6)
+        self.assertEqual(list(loaded.dates), [736300, 736330])
+
+    def test_loads_dense_tree(self):
+        # base day 736300, a change of -4 on it and 10 thirty days later
+        tree = array('d', [0.0] * 64)
+        for day, amount in ((0, -4), (30, 10)):
+            i = day + 1
+            while i <= len(tree):
+                tree[i - 1] += amount
+                i += i & -i
+        loaded = BalanceIndex.loads((736300, tree.tostring(), array('l', [736300, 736330]).tostring()))
+        self.assertEqual(list(loaded), [(736300, -4), (736330, 10)])
+
+    def test_record_size_is_bounded_by_changes(self):
+        account = Account('sample', 0.0)
+        account.post(10, '0001-01-01')
+        account.post(-5, '9999-12-31')
+        self.assertLess(len(marshal.dumps(account.to_record())), 200)
+        self.assertEqual(account.get_balance('5000-01-01', as_of=True), 10)
+        self.assertEqual(Account.from_dict(account.to_record()).get_balance('9999-12-31'), 5)
+
+
 class TestAccountRepository(unittest.TestCase):
 
     def setUp(self):
@@ -59,6 +174,44 @@ class TestAccountRepository(unittest.TestCase):
         self.assertEqual(sample_account.balance, 0.0)
         self.assertEqual(len(sample_account.balance_history), 1)
 
+    def test_opening_balance_precedes_back_dated_changes(self):
+        sample_account = self.account_repository.create('mr sample', 100.0)
+        sample_account.post(-10, '2017-01-01')
+        self.account_repository.update(sample_account)
+        loaded = self.account_repository.get_by_name('mr sample')
+        self.assertEqual(loaded.get_balance('2017-01-01'), 90.0)
+        self.assertEqual(loaded.balance_history[0], {'date': '2017-01-01', 'balance': 90.0})
+
+    def test_update_only_writes_changed_days(self):
+        sample_account = self.account_repository.create('mr sample')
+        for day in xrange(1, 29):
+            sample_account.post(day, '2017-02-{0:02d}'.format(day))
+            self.account_repository.update(sample_account)
+            sample_account = self.account_repository.get_by_name('mr sample')
+        record = self.sample_datastore.retrieve('accounts', 'name', 'mr sample')
+        self.assertLess(len(marshal.dumps(record)), 150)
+        self.assertEqual(self.sample_datastore.count('balance_changes'), 29)
+        self.assertEqual(sample_account.get_balance('2017-02-28'), sum(xrange(1, 29)))
+
+    def test_account_saved_with_its_history_is_migrated(self):
+        record = Account('mr sample', 0.0).to_record()
+        record['id'] = self.account_repository.registry.id_for('mr sample')
+        self.sample_datastore.create('accounts', record)
+        sample_account = self.account_repository.get_by_name('mr sample')
+        sample_account.post(5, '2017-01-01')
+        self.account_repository.update(sample_account)
+        self.assertIsNone(self.sample_datastore.retrieve('accounts', 'name', 'mr sample')['history'])
+        self.assertEqual(self.account_repository.get_by_name('mr sample').balance_history,
+                         sample_account.balance_history)
+
+    def test_create_existing_account(self):
+        sample_account = self.account_repository.create('mr sample')
+        sample_account.debit(10)
+        self.account_repository.update(sample_account)
+        with self.assertRaises(ValueError):
+            self.account_repository.create('mr sample')
+        self.assertEqual(self.account_repository.get_by_name('mr sample').balance, 10)
+
     def test_list(self):
         result = self.account_repository.list()
         self.assertEqual(len(result), 0)
@@ -67,6 +220,16 @@ class TestAccountRepository(unittest.TestCase):
         result = self.account_repository.list()
         self.assertEqual(len(result), 2)
 
+    def test_iterate(self):
+        for name in ['carol', 'alice', 'bob']:
+            self.account_repository.create(name)
+        self.assertEqual([account.name for account in self.account_repository.iterate(limit=2)],
+                         ['carol', 'alice'])
+        self.assertEqual([account.name for account in self.account_repository.iterate(
+            order_by='name', after='alice')], ['bob', 'carol'])
+        with self.assertRaises(ValueError):
+            self.account_repository.iterate(order_by='balance')
+
     def test_get_by_name(self):
         result = self.account_repository.get_by_name('mr sample')
         self.assertIsNone(result)
@@ -102,3 +265,71 @@ class TestAccountRepository(unittest.TestCase):
         result = self.account_repository.get_by_name('mr sample')
         self.assertEqual(len(result.balance_history), 2)
         self.assertEqual(result.get_balance('2017-04-12'), 1234)
+
+
+class TestAccountRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.sample_datastore = json_datastore.JsonDatastore()
+        self.registry = AccountRegistry(self.sample_datastore)
+
+    def test_id_for(self):
+        self.assertIsNone(self.registry.get_id('john'))
+        self.assertEqual(self.registry.id_for('john'), 0)
+        self.assertEqual(self.registry.id_for('mary'), 1)
+        self.assertEqual(self.registry.id_for('john'), 0)
+        self.assertEqual(self.registry.name(1), 'mary')
+        self.assertIsNone(self.registry.name(2))
+        self.assertEqual(len(self.registry), 2)
+
+    def test_names_are_interned(self):
+        name = ''.join(['jo', 'hn'])
+        self.registry.id_for(name)
+        self.assertIs(self.registry.name(0), intern('john'))
+
+    def test_registries_sharing_a_datastore_agree(self):
+        other = AccountRegistry(self.sample_datastore)
+        self.assertEqual(self.registry.id_for('john'), 0)
+        self.assertEqual(other.get_id('john'), 0)
+        self.assertEqual(other.id_for('mary'), 1)
+        self.assertEqual(self.registry.name(1), 'mary')
+        self.assertEqual(AccountRegistry(self.sample_datastore).names, ['john', 'mary'])
+
+    def test_repository_records_key_on_ids(self):
+        repository = AccountRepository(self.sample_datastore, registry=self.registry)
+        repository.create('john')
+        self.assertEqual(self.sample_datastore.retrieve('accounts', 'id', 0)['name'], 'john')
+        self.assertEqual(repository.get_by_id(0).name, 'john')
+
+
+class TestCachedAccountRepository(unittest.TestCase):
+
+    def setUp(self):
+        self.sample_datastore = json_datastore.JsonDatastore()
+        self.account_repository = AccountRepository(
+            self.sample_datastore, cache_size=2)
+
+    def test_get_by_name_hits_cache(self):
+        sample_account = self.account_repository.create('mr sample')
+        self.assertIs(self.account_repository.get_by_name('mr sample'), sample_account)
+        self.assertIsNone(self.account_repository.get_by_name('nobody'))
+        stats = self.account_repository.cache_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['size'], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        self.account_repository.create('a')
+        self.account_repository.create('b')
+        self.account_repository.get_by_name('a')
+        self.account_repository.create('c')
+        self.assertEqual(self.account_repository.cache_stats()['size'], 2)
+        self.account_repository.get_by_name('b')
+        self.assertEqual(self.account_repository.cache_hits, 1)
+        self.assertEqual(self.account_repository.cache_misses, 1)
+
+    def test_delete(self):
+        sample_account = self.account_repository.create('mr sample')
+        self.account_repository.delete(sample_account)
+        self.assertIsNone(self.account_repository.get_by_name('mr sample'))
+        self.assertEqual(self.account_repository.count(), 0)
@@ -0,0 +1,44 @@
+import unittest
+
+from benchmarks import generators, run
+from moazna.imports import ImportSummary, parse_rows
+
+
+class TestGenerators(unittest.TestCase):
+
+    def test_generate_ledger(self):
+        lines = list(generators.generate_ledger(100, accounts=10, days=30))
+        self.assertEqual(len(lines), 100)
+        self.assertEqual(lines, list(generators.generate_ledger(100, accounts=10, days=30)))
+
+        summary = ImportSummary()
+        rows = list(parse_rows(lines, summary))
+        self.assertEqual(summary.rows_rejected, 0)
+        self.assertEqual(rows[0][3], '2017-01-01')
+        self.assertTrue(all(payer != recipient for _, payer, recipient, _ in rows))
+        self.assertLessEqual(len(set(row[1] for row in rows)), 10)
+
+
+class TestRun(unittest.TestCase):
+
+    def test_run_case(self):
+        result = run.run_case('list_by_name', 'json', 100, accounts=10, queries=5)
+        self.assertEqual(result['scenario'], 'list_by_name')
+        self.assertEqual(result['ops'], 5)
+        self.assertGreaterEqual(result['process_peak_memory_kib'],
+                                result['measured_peak_growth_kib'])
+        self.assertGreaterEqual(result['measured_peak_growth_kib'], 0)
+
+    def test_summary_line_without_rate(self):
+        result = run.run_case('accounts', 'json', 10, accounts=10, queries=5)
+        result['ops_per_sec'] = None
+        self.assertIn('n/a ops/s', run.summary_line(result))
+        result['ops_per_sec'] = 2.5
+        self.assertIn('2.5 ops/s', run.summary_line(result))
+
+    def test_run_case_on_persistent_datastores(self):
+        for datastore in ['log', 'sqlite']:
+            for name in ['record_txn', 'transactions_page']:
+                result = run.run_case(name, datastore, 100, accounts=10, queries=5)
+                self.assertEqual(result['datastore'], datastore)
+                self.assertEqual(result['ops'], 5)
@@ -0,0 +1,54 @@
+import unittest
+
+from moazna.checkpoints import Checkpoint, CheckpointRepository
+from moazna.datastores import json_datastore, sqlite_datastore
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def test_record_round_trip(self):
+        checkpoint = Checkpoint(12, {0: -10.5, 3: 10.5, 1: 0.0})
+        restored = Checkpoint.from_dict(checkpoint.to_record())
+        self.assertEqual(restored.position, 12)
+        self.assertEqual(restored.created, checkpoint.created)
+        self.assertDictEqual(restored.balances, checkpoint.balances)
+
+
+class TestCheckpointRepository(unittest.TestCase):
+
+    def setUp(self):
+        self.sample_datastore = json_datastore.JsonDatastore()
+        self.checkpoint_repository = CheckpointRepository(self.sample_datastore)
+
+    def test_nearest(self):
+        self.assertIsNone(self.checkpoint_repository.latest())
+        self.checkpoint_repository.create(10, {0: 1.0})
+        self.checkpoint_repository.create(5, {0: 2.0})
+
+        self.assertIsNone(self.checkpoint_repository.nearest(4))
+        self.assertEqual(self.checkpoint_repository.nearest(5).balances, {0: 2.0})
+        self.assertEqual(self.checkpoint_repository.nearest(9).position, 5)
+        self.assertEqual(self.checkpoint_repository.nearest(100).position, 10)
+        self.assertEqual(self.checkpoint_repository.latest().position, 10)
+
+    def test_create_replaces_same_position(self):
+        self.checkpoint_repository.create(5, {0: 2.0})
+        self.checkpoint_repository.create(5, {0: 3.0})
+        self.assertEqual(self.checkpoint_repository.count(), 1)
+        self.assertEqual(self.checkpoint_repository.latest().balances, {0: 3.0})
+
+    def test_adjust(self):
+        self.checkpoint_repository.create(5, {0: 2.0, 1: -2.0})
+        self.checkpoint_repository.create(10, {0: 3.0, 1: -3.0})
+        rewritten = self.checkpoint_repository.adjust([(7, 0, -1.0), (7, 1, 1.0), (2, 2, 4.0)])
+        self.assertEqual(rewritten, 2)
+        self.assertEqual(self.checkpoint_repository.nearest(5).balances, {0: 2.0, 1: -2.0, 2: 4.0})
+        self.assertEqual(self.checkpoint_repository.latest().balances, {0: 2.0, 1: -2.0, 2: 4.0})
+
+    def test_positions_are_loaded_from_the_datastore(self):
+        with sqlite_datastore.SqliteDatastore() as datastore:
+            CheckpointRepository(datastore).create(7, {1: 4.5})
+            CheckpointRepository(datastore).create(3, {1: 1.5})
+            repository = CheckpointRepository(datastore)
+            self.assertEqual(repository.positions(), [3, 7])
+            self.assertEqual(repository.nearest(6).balances, {1: 1.5})
@@ -0,0 +1,90 @@
+import unittest
+import uuid
+from moazna.dates import account_day, to_ordinal
+from moazna.datastores import columnar_datastore
+
+
+class ColumnarTransactionStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sampleDatastore = columnar_datastore.ColumnarTransactionStore()
+        self.records = []
+        for args in [(12.5, 0, 1, '2017-01-01'), (3, 1, 0, '2017-01-02'),
+                     (7.25, 1, 2, '2017-01-03')]:
+            self.records.append(self.record(*args))
+        self.sampleDatastore.create_many('transactions', self.records)
+
+    def record(self, amount, payer, recipient, date):
+        return {'id': str(uuid.uuid4()), 'amount': amount, 'payer_id': payer,
+                'recipient_id': recipient, 'date': date,
+                'position': len(self.records) + 10}
+
+    def test_retrieve(self):
+        record = self.records[1]
+        self.assertDictEqual(
+            self.sampleDatastore.retrieve('transactions', 'id', record['id']), record)
+        self.assertIsNone(self.sampleDatastore.retrieve('transactions', 'id', str(uuid.uuid4())))
+        self.assertIsNone(self.sampleDatastore.retrieve('transactions', 'id', 'not-a-uuid'))
+
+    def test_filter_party_id_keeps_insertion_order(self):
+        records = self.sampleDatastore.filter('transactions', 'party_id', [0, 2])
+        self.assertEqual(records, self.records)
+        self.assertEqual(self.sampleDatastore.filter('transactions', 'payer_id', 3), [])
+
+    def test_filter_date(self):
+        self.assertEqual(
+            self.sampleDatastore.filter('transactions', 'date', ['2017-01-02']), [self.records[1]])
+
+    def test_update_moves_account_rows(self):
+        record = dict(self.records[0], payer_id=2, amount=1)
+        self.sampleDatastore.update('transactions', record, 'id')
+        self.assertEqual(self.sampleDatastore.filter('transactions', 'payer_id', 0), [])
+        self.assertEqual(self.sampleDatastore.filter('transactions', 'payer_id', 2),
+                         [record])
+
+    def test_delete(self):
+        self.sampleDatastore.delete('transactions', 'id', self.records[0]['id'])
+        self.assertEqual(self.sampleDatastore.count('transactions'), 2)
+        self.assertEqual(self.sampleDatastore.filter('transactions', None), self.records[1:])
+        self.assertEqual(self.sampleDatastore.filter('transactions', 'party_id', 0),
+                         [self.records[1]])
+
+    def test_filter_position(self):
+        self.sampleDatastore.delete('transactions', 'id', self.records[1]['id'])
+        self.assertEqual(self.sampleDatastore.filter('transactions', 'position', [12, 1, 10]),
+                         [self.records[0], self.records[2]])
+
+    def test_scan(self):
+        self.sampleDatastore.delete('transactions', 'id', self.records[1]['id'])
+        self.assertEqual(list(self.sampleDatastore.scan('transactions', limit=1, offset=1)),
+                         [self.records[2]])
+        self.assertEqual(list(self.sampleDatastore.scan('transactions', order_by='position',
+                                                        after=10)), [self.records[2]])
+        self.assertEqual(list(self.sampleDatastore.scan('transactions', order_by=('date', 'id'),
+                                                        after=('2017-01-01', ''))),
+                         [self.records[0], self.records[2]])
+
+    def test_filter_range(self):
+        self.assertEqual(self.sampleDatastore.filter_range(
+            'transactions', 'day', to_ordinal('2017-01-02'), to_ordinal('2017-01-03')),
+            self.records[1:])
+        self.assertEqual(self.sampleDatastore.filter_range(
+            'transactions', 'payer_day', account_day(1, 0), account_day(1, to_ordinal('2017-01-02'))),
+            self.records[1:2])
+        self.assertEqual(self.sampleDatastore.filter_range(
+            'transactions', 'recipient_day', account_day(2, 0), account_day(2, 1)), [])
+
+    def test_filter_range_after_update_and_delete(self):
+        record = dict(self.records[2], date='2017-01-01')
+        self.sampleDatastore.update('transactions', record, 'id')
+        self.sampleDatastore.delete('transactions', 'id', self.records[0]['id'])
+        self.assertIsNone(self.sampleDatastore.retrieve('transactions', 'id', self.records[0]['id']))
+        self.assertEqual(self.sampleDatastore.filter_range(
+            'transactions', 'day', to_ordinal('2017-01-01'), to_ordinal('2017-01-31')),
+            [record, self.records[1]])
+        self.assertEqual(self.sampleDatastore.filter('transactions', 'date', '2017-01-03'), [])
+        self.assertEqual(self.sampleDatastore.sum_by_date_range('2017-01-01', '2017-01-02'), 10.25)
+
+    def test_aggregates(self):
+        self.assertDictEqual(self.sampleDatastore.net_by_account(), {0: -9.5, 1: 2.25, 2: 7.25})
+        self.assertEqual(self.sampleDatastore.sum_by_date_range('2017-01-02', '2017-01-31'), 10.25)
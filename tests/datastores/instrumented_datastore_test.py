@@ -0,0 +1,61 @@
+import unittest
+from moazna.datastores import instrumented_datastore, json_datastore
+
+
+class InstrumentedDatastoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sampleDatastore = instrumented_datastore.InstrumentedDatastore(
+            json_datastore.JsonDatastore())
+        self.sampleDatastore.add_entity('test_entity', 'id_attr', {'attr': 'attr'})
+        self.instance = {'id_attr': 'super_unique', 'attr': 'value'}
+        self.sampleDatastore.create('test_entity', self.instance)
+
+    def test_delegates(self):
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 1)
+        self.assertEqual(self.sampleDatastore.filter('test_entity', 'attr', 'value'), [self.instance])
+        self.assertEqual(self.sampleDatastore.create_many(
+            'test_entity', iter([{'id_attr': 'other', 'attr': 'value'}])), 1)
+        self.sampleDatastore.delete('test_entity', 'id_attr', 'other')
+        self.assertEqual(self.sampleDatastore.retrieve(
+            'test_entity', 'id_attr', 'super_unique'), self.instance)
+
+    def test_stats(self):
+        self.sampleDatastore.retrieve('test_entity', 'id_attr', 'super_unique')
+        self.sampleDatastore.retrieve('test_entity', 'id_attr', 'missing')
+        self.sampleDatastore.filter('test_entity', 'attr', 'value')
+        self.sampleDatastore.filter('test_entity', None)
+        self.sampleDatastore.update_many('test_entity', [self.instance], 'id_attr')
+
+        stats = self.sampleDatastore.stats.to_dict()['datastore']
+        self.assertEqual(stats['create']['test_entity']['records_written'], 1)
+        self.assertEqual(stats['retrieve']['test_entity']['calls'], 2)
+        self.assertEqual(stats['retrieve']['test_entity']['records_read'], 1)
+        self.assertEqual(stats['filter']['test_entity']['records_read'], 2)
+        self.assertEqual(stats['filter']['test_entity']['scans'], 1)
+        self.assertEqual(stats['update_many']['test_entity']['records_written'], 1)
+        self.assertEqual(stats['filter']['test_entity']['latency']['count'], 2)
+
+    def test_filter_without_index_is_a_scan(self):
+        self.sampleDatastore.create('test_entity', {'id_attr': 'other', 'attr': 'other value'})
+        self.sampleDatastore.filter('test_entity', 'attr', 'value')
+        self.sampleDatastore.filter('test_entity', 'id_attr', ['other'])
+        self.sampleDatastore.retrieve('test_entity', 'attr', 'other value')
+        self.sampleDatastore.add_entity('plain_entity', 'id_attr')
+        self.sampleDatastore.create_many('plain_entity', [{'id_attr': 1, 'plain': 1},
+                                                          {'id_attr': 2, 'plain': 2}])
+        self.sampleDatastore.filter('plain_entity', 'plain', 1)
+
+        stats = self.sampleDatastore.stats.to_dict()['datastore']
+        self.assertEqual(stats['filter']['test_entity']['scans'], 0)
+        self.assertEqual(stats['filter']['test_entity']['records_scanned'], 2)
+        self.assertEqual(stats['retrieve']['test_entity']['records_scanned'], 1)
+        self.assertEqual(stats['filter']['plain_entity']['scans'], 1)
+        self.assertEqual(stats['filter']['plain_entity']['records_read'], 1)
+        self.assertEqual(stats['filter']['plain_entity']['records_scanned'], 2)
+
+    def test_failed_transaction_is_counted(self):
+        with self.assertRaises(ValueError):
+            with self.sampleDatastore.transaction():
+                self.sampleDatastore.create('test_entity', self.instance)
+        self.assertEqual(self.sampleDatastore.stats.to_dict()['datastore']['transaction'][None]['calls'], 1)
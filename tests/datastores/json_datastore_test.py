@@ -22,6 +22,15 @@ class JsonDatastoreTests(unittest.TestCase):
 
         self.assertEqual(self.sampleDatastore.count('test_entity'), 1)
 
+    def test_create_duplicate_id(self):
+        self.sampleDatastore.add_entity('test_entity', 'id_attr')
+        self.sampleDatastore.create('test_entity', self.instance)
+        with self.assertRaises(ValueError):
+            self.sampleDatastore.create('test_entity', dict(self.instance, a_number=4))
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 1)
+        self.assertEqual(self.sampleDatastore.retrieve(
+            'test_entity', 'id_attr', 'super_unique')['a_number'], 3)
+
     def test_retrieve(self):
         self.sampleDatastore.create('test_entity', self.instance)
 
@@ -47,3 +56,126 @@ class JsonDatastoreTests(unittest.TestCase):
         self.sampleDatastore.delete(
             'test_entity', 'id_attr', self.instance['id_attr'])
         self.assertEqual(self.sampleDatastore.count('test_entity'), 0)
+
+    def test_retrieve_by_id_attr(self):
+        self.sampleDatastore.add_entity('keyed_entity', 'id_attr')
+        for i in range(3):
+            instance = copy.deepcopy(self.instance)
+            instance['id_attr'] = 'unique_{0}'.format(i)
+            self.sampleDatastore.create('keyed_entity', instance)
+
+        db_instance = self.sampleDatastore.retrieve(
+            'keyed_entity', 'id_attr', 'unique_1')
+        self.assertEqual(db_instance['id_attr'], 'unique_1')
+        self.assertIsNone(self.sampleDatastore.retrieve(
+            'keyed_entity', 'id_attr', 'missing'))
+        self.assertEqual(self.sampleDatastore.retrieve(
+            'keyed_entity', 'a_number', 3)['id_attr'], 'unique_0')
+
+    def test_update_keeps_insertion_order(self):
+        self.sampleDatastore.add_entity('keyed_entity', 'id_attr')
+        for i in range(3):
+            instance = copy.deepcopy(self.instance)
+            instance['id_attr'] = 'unique_{0}'.format(i)
+            self.sampleDatastore.create('keyed_entity', instance)
+
+        self.sampleDatastore.update(
+            'keyed_entity', {'id_attr': 'unique_0', 'a_number': 7}, 'id_attr')
+        ids = [elem['id_attr'] for elem in self.sampleDatastore.filter(
+            'keyed_entity', None)]
+        self.assertEqual(ids, ['unique_0', 'unique_1', 'unique_2'])
+        self.assertEqual(self.sampleDatastore.retrieve(
+            'keyed_entity', 'id_attr', 'unique_0')['a_number'], 7)
+
+    def test_update_missing(self):
+        self.assertIsNone(self.sampleDatastore.update(
+            'test_entity', self.instance, 'id_attr'))
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 0)
+
+    def test_add_entity_rekeys_existing_records(self):
+        self.sampleDatastore.create('test_entity', self.instance)
+        self.sampleDatastore.add_entity('test_entity', 'id_attr')
+        self.sampleDatastore.delete('test_entity', 'id_attr', 'super_unique')
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 0)
+
+    def test_filter_with_secondary_index(self):
+        self.sampleDatastore.add_entity('txns', 'id', {
+            'payer': 'payer',
+            'party': ('payer', 'recipient'),
+        })
+        self.sampleDatastore.create(
+            'txns', {'id': 1, 'payer': 'john', 'recipient': 'mary'})
+        self.sampleDatastore.create(
+            'txns', {'id': 2, 'payer': 'johnny', 'recipient': 'john'})
+        self.sampleDatastore.create(
+            'txns', {'id': 3, 'payer': 'mary', 'recipient': 'kyle'})
+
+        ids = [elem['id'] for elem in self.sampleDatastore.filter(
+            'txns', 'payer', 'john')]
+        self.assertEqual(ids, [1])
+        ids = [elem['id'] for elem in self.sampleDatastore.filter(
+            'txns', 'party', ['john'])]
+        self.assertEqual(ids, [1, 2])
+        ids = [elem['id'] for elem in self.sampleDatastore.filter(
+            'txns', 'party', ['kyle', 'john'])]
+        self.assertEqual(ids, [1, 2, 3])
+
+    def test_secondary_index_follows_updates_and_deletes(self):
+        self.sampleDatastore.add_entity('txns', 'id', {'payer': 'payer'})
+        self.sampleDatastore.create('txns', {'id': 1, 'payer': 'john'})
+        self.sampleDatastore.create('txns', {'id': 2, 'payer': 'john'})
+
+        self.sampleDatastore.update('txns', {'id': 1, 'payer': 'mary'}, 'id')
+        self.assertEqual(
+            len(self.sampleDatastore.filter('txns', 'payer', ['john'])), 1)
+        self.assertEqual(
+            len(self.sampleDatastore.filter('txns', 'payer', ['mary'])), 1)
+
+        self.sampleDatastore.delete('txns', 'id', 2)
+        self.assertEqual(
+            self.sampleDatastore.filter('txns', 'payer', ['john']), [])
+
+    def test_filter_single_value_is_not_a_substring_match(self):
+        self.sampleDatastore.create('test_entity', self.instance)
+        self.assertEqual(self.sampleDatastore.filter(
+            'test_entity', 'attr', 'val'), [])
+        self.assertEqual(len(self.sampleDatastore.filter(
+            'test_entity', 'attr', 'value')), 1)
+
+    def test_scan(self):
+        self.sampleDatastore.add_entity('scanned', 'id_attr', {'group': 'group'})
+        records = [{'id_attr': 'k{0}'.format(i), 'group': i % 2, 'a_number': 5 - i}
+                   for i in xrange(5)]
+        self.sampleDatastore.create_many('scanned', records)
+
+        self.assertEqual(list(self.sampleDatastore.scan('scanned')), records)
+        self.assertEqual(list(self.sampleDatastore.scan('scanned', limit=2, offset=1)), records[1:3])
+        self.assertEqual(list(self.sampleDatastore.scan('scanned', order_by='a_number')),
+                         records[::-1])
+        self.assertEqual(list(self.sampleDatastore.scan(
+            'scanned', order_by=('group', 'id_attr'), after=(0, 'k2'), limit=2)),
+            [records[4], records[1]])
+        self.assertEqual(list(self.sampleDatastore.scan(
+            'scanned', order_by='id_attr', after='k3')), [records[4]])
+        self.assertEqual(list(self.sampleDatastore.scan('missing')), [])
+        with self.assertRaises(ValueError):
+            self.sampleDatastore.scan('scanned', after='k3')
+
+    def test_filter_range(self):
+        self.sampleDatastore.add_entity('ranged', 'id_attr', {'day': 'day', 'either': ('low', 'high')})
+        records = [{'id_attr': 'k{0}'.format(i), 'day': 5 - i % 3, 'low': i, 'high': i + 10}
+                   for i in xrange(6)]
+        self.sampleDatastore.create_many('ranged', records)
+
+        self.assertEqual(self.sampleDatastore.filter_range('ranged', 'day', 4, 5),
+                         [records[1], records[4], records[0], records[3]])
+        self.assertEqual(self.sampleDatastore.filter_range('ranged', 'either', 4, 11),
+                         [records[4], records[5], records[0], records[1]])
+        self.assertEqual(self.sampleDatastore.filter_range('ranged', 'low', 2, 3),
+                         [records[2], records[3]])
+        self.assertEqual(self.sampleDatastore.filter_range('ranged', 'day', 6, 9), [])
+
+        self.sampleDatastore.delete('ranged', 'id_attr', 'k4')
+        self.sampleDatastore.update('ranged', dict(records[0], day=1), 'id_attr')
+        self.assertEqual(self.sampleDatastore.filter_range('ranged', 'day', 4, 5),
+                         [records[1], records[3]])
@@ -0,0 +1,260 @@
+import unittest
+import copy
+import os
+import shutil
+import tempfile
+from moazna.datastores import log_datastore
+
+
+class LogDatastoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ledger.log')
+        self.sampleDatastore = log_datastore.LogDatastore(self.path)
+        self.sampleDatastore.add_entity('test_entity', 'id_attr')
+        self.instance = {
+            'id_attr': 'super_unique',
+            'attr': 'value',
+            'another_attr': 'yet another value',
+            'a_number': 3
+        }
+
+    def tearDown(self):
+        self.sampleDatastore.close()
+        shutil.rmtree(self.directory)
+
+    def reopen(self):
+        self.sampleDatastore.close()
+        self.sampleDatastore = log_datastore.LogDatastore(self.path)
+
+    def test_create(self):
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 0)
+        self.sampleDatastore.create('test_entity', self.instance)
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 1)
+
+    def test_create_duplicate_id(self):
+        self.sampleDatastore.create('test_entity', self.instance)
+        with self.assertRaises(ValueError):
+            self.sampleDatastore.create('test_entity', dict(self.instance, a_number=4))
+        with self.assertRaises(ValueError):
+            self.sampleDatastore.create_many('test_entity', [
+                dict(self.instance, id_attr='another'), dict(self.instance, id_attr='another')])
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 1)
+        self.reopen()
+        self.assertEqual(self.sampleDatastore.retrieve(
+            'test_entity', 'id_attr', 'super_unique')['a_number'], 3)
+
+    def test_retrieve(self):
+        self.sampleDatastore.create('test_entity', self.instance)
+
+        db_instance = self.sampleDatastore.retrieve(
+            'test_entity', 'id_attr', 'super_unique')
+        self.assertDictEqual(db_instance, self.instance)
+        db_instance = self.sampleDatastore.retrieve(
+            'test_entity', 'a_number', 3)
+        self.assertDictEqual(db_instance, self.instance)
+        self.assertIsNone(self.sampleDatastore.retrieve(
+            'test_entity', 'id_attr', 'missing'))
+
+    def test_update(self):
+        self.sampleDatastore.create('test_entity', self.instance)
+
+        updated_instance = copy.deepcopy(self.instance)
+        updated_instance['attr'] = 'modified'
+        updated_instance['new_attr'] = [1, 3, 5]
+        db_instance = self.sampleDatastore.update(
+            'test_entity', updated_instance, 'id_attr')
+        self.assertDictEqual(db_instance, updated_instance)
+        self.assertDictEqual(self.sampleDatastore.retrieve(
+            'test_entity', 'id_attr', 'super_unique'), updated_instance)
+
+    def test_delete(self):
+        self.sampleDatastore.create('test_entity', self.instance)
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 1)
+
+        self.sampleDatastore.delete(
+            'test_entity', 'id_attr', self.instance['id_attr'])
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 0)
+
+    def test_records_survive_reopening(self):
+        self.sampleDatastore.create('test_entity', self.instance)
+        self.sampleDatastore.create_many('test_entity', [
+            {'id_attr': 'second', 'a_number': 1},
+            {'id_attr': 'third', 'a_number': 2},
+        ])
+        self.sampleDatastore.update(
+            'test_entity', {'id_attr': 'second', 'a_number': 5}, 'id_attr')
+        self.sampleDatastore.delete('test_entity', 'id_attr', 'third')
+        self.sampleDatastore.create('no_id_entity', {'attr': 'value'})
+        self.reopen()
+
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 2)
+        self.assertEqual(self.sampleDatastore.retrieve(
+            'test_entity', 'id_attr', 'second')['a_number'], 5)
+        self.assertEqual(
+            [elem['id_attr'] for elem in self.sampleDatastore.filter('test_entity', None)],
+            ['super_unique', 'second'])
+        self.sampleDatastore.create('no_id_entity', {'attr': 'another value'})
+        self.assertEqual(self.sampleDatastore.count('no_id_entity'), 2)
+
+    def test_index_is_rebuilt_without_hint(self):
+        self.sampleDatastore.create('test_entity', self.instance)
+        self.sampleDatastore.close()
+        os.remove(self.path + '.hint')
+        self.sampleDatastore = log_datastore.LogDatastore(self.path)
+        self.assertDictEqual(self.sampleDatastore.retrieve(
+            'test_entity', 'id_attr', 'super_unique'), self.instance)
+
+    def test_entries_appended_after_hint_are_loaded(self):
+        self.sampleDatastore.create('test_entity', self.instance)
+        self.reopen()
+        self.sampleDatastore.create('test_entity', {'id_attr': 'second'})
+        # simulate a crash, the hint only covers the first record
+        self.sampleDatastore.sync()
+        self.sampleDatastore = log_datastore.LogDatastore(self.path)
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 2)
+
+    def test_partially_written_entry_is_dropped(self):
+        self.sampleDatastore.create('test_entity', self.instance)
+        self.sampleDatastore.sync()
+        with open(self.path, 'ab') as log_file:
+            log_file.write('\x01\x10\x00')
+        self.sampleDatastore = log_datastore.LogDatastore(self.path)
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 1)
+        self.sampleDatastore.create('test_entity', {'id_attr': 'second'})
+        self.reopen()
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 2)
+
+    def test_filter_with_secondary_index(self):
+        self.sampleDatastore.add_entity('txns', 'id', {
+            'payer': 'payer',
+            'party': ('payer', 'recipient'),
+        })
+        self.sampleDatastore.create(
+            'txns', {'id': 1, 'payer': 'john', 'recipient': 'mary'})
+        self.sampleDatastore.create(
+            'txns', {'id': 2, 'payer': 'johnny', 'recipient': 'john'})
+        self.assertEqual([elem['id'] for elem in self.sampleDatastore.filter(
+            'txns', 'party', ['john'])], [1, 2])
+
+        self.sampleDatastore.update('txns', {'id': 1, 'payer': 'kyle'}, 'id')
+        self.sampleDatastore.create(
+            'txns', {'id': 3, 'payer': 'john', 'recipient': 'mary'})
+        self.assertEqual([elem['id'] for elem in self.sampleDatastore.filter(
+            'txns', 'payer', 'john')], [3])
+        self.assertEqual([elem['id'] for elem in self.sampleDatastore.filter(
+            'txns', 'party', ['kyle', 'john'])], [1, 2, 3])
+
+    def test_compact(self):
+        self.sampleDatastore.create('test_entity', self.instance)
+        self.sampleDatastore.create('test_entity', {'id_attr': 'second'})
+        for i in range(50):
+            self.sampleDatastore.update(
+                'test_entity', {'id_attr': 'super_unique', 'a_number': i}, 'id_attr')
+        self.sampleDatastore.delete('test_entity', 'id_attr', 'second')
+        self.sampleDatastore.sync()
+        size = os.path.getsize(self.path)
+        self.assertGreater(self.sampleDatastore.dead_bytes, 0)
+
+        self.sampleDatastore.compact()
+        self.assertLess(os.path.getsize(self.path), size)
+        self.assertEqual(self.sampleDatastore.dead_bytes, 0)
+        self.assertEqual(self.sampleDatastore.retrieve(
+            'test_entity', 'id_attr', 'super_unique')['a_number'], 49)
+
+        self.sampleDatastore.create('test_entity', {'id_attr': 'third'})
+        self.reopen()
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 2)
+        self.assertEqual(self.sampleDatastore.retrieve(
+            'test_entity', 'id_attr', 'super_unique')['a_number'], 49)
+
+    def test_compact_closed_log(self):
+        self.sampleDatastore.close()
+        with self.assertRaises(ValueError):
+            self.sampleDatastore.compact()
+        with self.assertRaises(ValueError):
+            self.sampleDatastore.sync()
+
+    def test_failed_transaction_is_rolled_back(self):
+        self.sampleDatastore.add_entity('txns', 'id', {'payer': 'payer'})
+        self.sampleDatastore.create('txns', {'id': 1, 'payer': 'john'})
+        self.assertEqual(len(self.sampleDatastore.filter('txns', 'payer', 'john')), 1)
+        size = os.path.getsize(self.path)
+        with self.assertRaises(KeyError):
+            with self.sampleDatastore.transaction():
+                self.sampleDatastore.create('txns', {'id': 2, 'payer': 'john'})
+                with self.sampleDatastore.transaction():
+                    self.sampleDatastore.update('txns', {'id': 1, 'payer': 'mary'}, 'id')
+                raise KeyError('id')
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.assertEqual(self.sampleDatastore.filter('txns', 'payer', 'john'),
+                         [{'id': 1, 'payer': 'john'}])
+
+        with self.sampleDatastore.transaction():
+            self.sampleDatastore.create('txns', {'id': 2, 'payer': 'mary'})
+        self.reopen()
+        self.assertEqual(self.sampleDatastore.count('txns'), 2)
+
+    def test_uncommitted_transaction_is_dropped(self):
+        self.sampleDatastore.create('test_entity', self.instance)
+        crashed_path = os.path.join(self.directory, 'crashed.log')
+        with self.sampleDatastore.transaction():
+            self.sampleDatastore.create('test_entity', {'id_attr': 'second'})
+            # simulate a crash before the commit marker is written
+            self.sampleDatastore.sync()
+            shutil.copyfile(self.path, crashed_path)
+
+        with log_datastore.LogDatastore(crashed_path) as crashed:
+            self.assertEqual(crashed.count('test_entity'), 1)
+            crashed.create('test_entity', {'id_attr': 'third'})
+        with log_datastore.LogDatastore(crashed_path) as crashed:
+            self.assertEqual([elem['id_attr'] for elem in crashed.scan('test_entity')],
+                             ['super_unique', 'third'])
+
+    def test_scan(self):
+        self.sampleDatastore.add_entity('scanned', 'id_attr', {'group': 'group'})
+        records = [{'id_attr': 'k{0}'.format(i), 'group': i % 2, 'a_number': 5 - i}
+                   for i in xrange(5)]
+        self.sampleDatastore.create_many('scanned', records)
+
+        self.assertEqual(list(self.sampleDatastore.scan('scanned')), records)
+        self.assertEqual(list(self.sampleDatastore.scan('scanned', limit=2, offset=1)), records[1:3])
+        self.assertEqual(list(self.sampleDatastore.scan('scanned', order_by='a_number')),
+                         records[::-1])
+        self.assertEqual(list(self.sampleDatastore.scan(
+            'scanned', order_by=('group', 'id_attr'), after=(0, 'k2'), limit=2)),
+            [records[4], records[1]])
+        self.assertEqual(list(self.sampleDatastore.scan(
+            'scanned', order_by='id_attr', after='k3')), [records[4]])
+        self.assertEqual(list(self.sampleDatastore.scan('missing')), [])
+        with self.assertRaises(ValueError):
+            self.sampleDatastore.scan('scanned', after='k3')
+
+        # updates keep the place of the record, creating it again moves it last
+        self.sampleDatastore.update('scanned', dict(records[0], a_number=5), 'id_attr')
+        self.sampleDatastore.delete('scanned', 'id_attr', 'k1')
+        self.sampleDatastore.create('scanned', records[1])
+        records.append(records.pop(1))
+        self.assertEqual(list(self.sampleDatastore.scan('scanned')), records)
+        self.reopen()
+        self.assertEqual(list(self.sampleDatastore.scan('scanned')), records)
+
+    def test_filter_range(self):
+        self.sampleDatastore.add_entity('ranged', 'id_attr', {'day': 'day', 'either': ('low', 'high')})
+        records = [{'id_attr': 'k{0}'.format(i), 'day': 5 - i % 3, 'low': i, 'high': i + 10}
+                   for i in xrange(6)]
+        self.sampleDatastore.create_many('ranged', records)
+
+        self.assertEqual(self.sampleDatastore.filter_range('ranged', 'day', 4, 5),
+                         [records[1], records[4], records[0], records[3]])
+        self.assertEqual(self.sampleDatastore.filter_range('ranged', 'either', 4, 11),
+                         [records[4], records[5], records[0], records[1]])
+        self.assertEqual(self.sampleDatastore.filter_range('ranged', 'low', 2, 3),
+                         [records[2], records[3]])
+        self.assertEqual(self.sampleDatastore.filter_range('ranged', 'day', 6, 9), [])
+
+        self.sampleDatastore.delete('ranged', 'id_attr', 'k4')
+        self.sampleDatastore.update('ranged', dict(records[0], day=1), 'id_attr')
+        self.assertEqual(self.sampleDatastore.filter_range('ranged', 'day', 4, 5),
+                         [records[1], records[3]])
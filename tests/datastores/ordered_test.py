@@ -0,0 +1,40 @@
+import random
+import unittest
+from moazna.datastores import ordered
+
+
+class SortedValuesTests(unittest.TestCase):
+
+    def test_add_remove_irange(self):
+        generator = random.Random(0)
+        values = ordered.SortedValues([5, 3, 3])
+        expected = set([3, 5])
+        for _ in xrange(5000):
+            value = generator.randrange(3000)
+            if value in expected:
+                values.remove(value)
+                expected.discard(value)
+            else:
+                values.add(value)
+                expected.add(value)
+
+        self.assertEqual(list(values), sorted(expected))
+        self.assertEqual(len(values), len(expected))
+        self.assertEqual(list(values.irange(1000, 1100)),
+                         sorted(value for value in expected if 1000 <= value <= 1100))
+        self.assertEqual(list(values.irange(4000, 5000)), [])
+        self.assertEqual(list(ordered.SortedValues().irange(0, 10)), [])
+
+
+class OrderedBucketsTests(unittest.TestCase):
+
+    def test_range(self):
+        buckets = ordered.OrderedBuckets(set)
+        buckets.bucket(3).add('a')
+        buckets.bucket(1).add('b')
+        self.assertEqual(list(buckets.range(0, 2)), [(1, set(['b']))])
+
+        # the sorted values are maintained once built
+        buckets.bucket(2).add('c')
+        buckets.drop(1)
+        self.assertEqual([value for value, _ in buckets.range(0, 5)], [2, 3])
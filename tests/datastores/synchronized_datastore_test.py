@@ -0,0 +1,37 @@
+import unittest
+from moazna.datastores import json_datastore, sqlite_datastore, synchronized_datastore
+
+
+class SynchronizedDatastoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sampleDatastore = synchronized_datastore.SynchronizedDatastore(
+            json_datastore.JsonDatastore())
+        self.sampleDatastore.add_entity('test_entity', 'id_attr', {'attr': 'attr'})
+        self.instance = {'id_attr': 'super_unique', 'attr': 'value'}
+        self.sampleDatastore.create('test_entity', self.instance)
+
+    def test_retrieve_returns_a_copy(self):
+        record = self.sampleDatastore.retrieve('test_entity', 'id_attr', 'super_unique')
+        record['attr'] = 'changed'
+        self.assertEqual(self.sampleDatastore.retrieve(
+            'test_entity', 'id_attr', 'super_unique')['attr'], 'value')
+        self.assertIsNone(self.sampleDatastore.retrieve('test_entity', 'id_attr', 'missing'))
+
+    def test_delegates(self):
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 1)
+        self.assertEqual(self.sampleDatastore.filter('test_entity', 'attr', 'value'), [self.instance])
+        self.sampleDatastore.update('test_entity', {'id_attr': 'super_unique', 'attr': 'new'}, 'id_attr')
+        self.assertEqual(self.sampleDatastore.filter('test_entity', 'attr', 'value'), [])
+        self.sampleDatastore.delete('test_entity', 'id_attr', 'super_unique')
+        self.assertEqual(self.sampleDatastore.count('test_entity'), 0)
+
+    def test_transaction_holds_the_lock_of_transactional_datastores(self):
+        with self.sampleDatastore.transaction():
+            self.assertFalse(self.sampleDatastore.lock._is_owned())
+
+        transactional = synchronized_datastore.SynchronizedDatastore(
+            sqlite_datastore.SqliteDatastore())
+        with transactional.transaction():
+            self.assertTrue(transactional.lock._is_owned())
+        transactional.close()
@@ -0,0 +1,76 @@
+import unittest
+
+from moazna.datastores import json_datastore, sqlite_datastore
+from moazna.fingerprints import BloomFilter, Fingerprinter, FingerprintRepository
+from moazna.transactions import Transaction
+
+
+def txns_for(fingerprints):
+    return [Transaction(10, 'john', 'mary', '2017-01-16') for _ in fingerprints]
+
+
+class TestFingerprinter(unittest.TestCase):
+
+    def test_repeated_rows_get_distinct_fingerprints(self):
+        row = (125.0, 'john', 'mary', '2017-01-16')
+        fingerprinter = Fingerprinter()
+        first, second = fingerprinter(*row), fingerprinter(*row)
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(first), 16)
+
+        other = Fingerprinter()
+        self.assertEqual(other(*row), first)
+        self.assertEqual(other(125, 'john', 'mary', '2017-01-16'), second)
+        self.assertNotEqual(other(12.5, 'john', 'mary', '2017-01-16'), first)
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_membership(self):
+        fingerprinter = Fingerprinter()
+        added = [fingerprinter(amount, 'john', 'mary', '2017-01-16') for amount in xrange(1000)]
+        others = [fingerprinter(amount, 'mary', 'john', '2017-01-16') for amount in xrange(1000)]
+        bloom_filter = BloomFilter(1000)
+        for fingerprint in added:
+            bloom_filter.add(fingerprint)
+
+        self.assertTrue(all(fingerprint in bloom_filter for fingerprint in added))
+        self.assertLess(sum(fingerprint in bloom_filter for fingerprint in others), 50)
+
+        restored = BloomFilter.from_dict(bloom_filter.to_record())
+        self.assertEqual(restored.count, 1000)
+        self.assertTrue(all(fingerprint in restored for fingerprint in added))
+
+
+class TestFingerprintRepository(unittest.TestCase):
+
+    def setUp(self):
+        self.sample_datastore = json_datastore.JsonDatastore()
+        self.fingerprint_repository = FingerprintRepository(self.sample_datastore)
+
+    def test_contains(self):
+        fingerprinter = Fingerprinter()
+        fingerprints = [fingerprinter(10, 'john', 'mary', '2017-01-16') for _ in xrange(3)]
+        self.assertFalse(self.fingerprint_repository.contains(fingerprints[0]))
+
+        self.fingerprint_repository.create_many(fingerprints[:2], txns_for(fingerprints[:2]))
+        self.assertTrue(self.fingerprint_repository.contains(fingerprints[1]))
+        self.assertFalse(self.fingerprint_repository.contains(fingerprints[2]))
+
+    def test_stale_filter_is_rebuilt(self):
+        with sqlite_datastore.SqliteDatastore() as datastore:
+            fingerprinter = Fingerprinter()
+            fingerprints = [fingerprinter(amount, 'john', 'mary', '2017-01-16')
+                            for amount in xrange(4)]
+            repository = FingerprintRepository(datastore)
+            repository.create_many(fingerprints[:2], txns_for(fingerprints[:2]))
+            repository.save_filter()
+            # recorded without saving the filter, like an interrupted import
+            repository.create_many(fingerprints[2:], txns_for(fingerprints[2:]))
+
+            reopened = FingerprintRepository(datastore)
+            self.assertEqual(reopened.bloom_filter.count, 4)
+            self.assertTrue(all(reopened.contains(fingerprint) for fingerprint in fingerprints))
+
+            reopened.save_filter()
+            self.assertEqual(FingerprintRepository(datastore).bloom_filter.count, 4)
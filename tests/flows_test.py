@@ -0,0 +1,75 @@
+import unittest
+
+from moazna.accounts import AccountRegistry
+from moazna.datastores import json_datastore, sqlite_datastore
+from moazna.flows import FlowRepository
+from moazna.transactions import Transaction
+
+
+class TestFlowRepository(unittest.TestCase):
+
+    def setUp(self):
+        self.sample_datastore = json_datastore.JsonDatastore()
+        self.flow_repository = FlowRepository(
+            self.sample_datastore, AccountRegistry(self.sample_datastore), monthly=True)
+        self.flow_repository.add([Transaction(10, 'john', 'mary', '2017-01-31'),
+                                  Transaction(4, 'mary', 'john', '2017-01-31'),
+                                  Transaction(1.5, 'john', 'mary', '2017-02-01'),
+                                  Transaction(7, 'john', 'insurance', '2017-02-03')])
+
+    def test_edge(self):
+        flow = self.flow_repository.edge('john', 'mary')
+        self.assertEqual((flow.amount, flow.count), (11.5, 2))
+        flow = self.flow_repository.edge('john', 'mary', '2017-02-01', '2017-12-31')
+        self.assertEqual((flow.amount, flow.count), (1.5, 1))
+        self.assertEqual(self.flow_repository.edge('mary', 'insurance').count, 0)
+        self.assertEqual(self.flow_repository.edge('nobody', 'mary').count, 0)
+
+        self.assertEqual(
+            [(flow.label, flow.amount) for flow in
+             self.flow_repository.list_monthly('john', 'mary', '2016-12-01', '2017-03-01')],
+            [('2017-01', 10), ('2017-02', 1.5)])
+
+    def test_counterparties(self):
+        self.assertEqual(
+            sorted((flow.recipient_name, flow.amount)
+                   for flow in self.flow_repository.counterparties('john', 'out')),
+            [('insurance', 7), ('mary', 11.5)])
+        self.assertEqual(
+            [(flow.payer_name, flow.amount) for flow in self.flow_repository.counterparties('john', 'in')],
+            [('mary', 4)])
+        with self.assertRaises(ValueError):
+            self.flow_repository.counterparties('john', 'sideways')
+
+        top = self.flow_repository.top_counterparties('john', 1)
+        self.assertEqual([(flow.recipient_name, flow.amount, flow.count) for flow in top],
+                         [('mary', 15.5, 3)])
+        self.assertEqual(self.flow_repository.top_counterparties('nobody'), [])
+
+    def test_degree(self):
+        self.assertEqual(self.flow_repository.degree('john'), {'in': 1, 'out': 2})
+        self.assertEqual(self.flow_repository.degree('insurance'), {'in': 1, 'out': 0})
+        self.assertEqual(self.flow_repository.degree('nobody'), {'in': 0, 'out': 0})
+
+    def test_remove(self):
+        self.flow_repository.remove([Transaction(7, 'john', 'insurance', '2017-02-03'),
+                                     Transaction(10, 'john', 'mary', '2017-01-31')])
+        self.assertEqual(self.flow_repository.degree('john'), {'in': 1, 'out': 1})
+        self.assertEqual(self.flow_repository.degree('insurance'), {'in': 0, 'out': 0})
+        self.assertEqual(self.flow_repository.edge('john', 'mary').amount, 1.5)
+        self.assertEqual(
+            [flow.label for flow in
+             self.flow_repository.list_monthly('john', 'mary', '2017-01-01', '2017-12-31')],
+            ['2017-02'])
+
+    def test_rebuild_on_sqlite(self):
+        with sqlite_datastore.SqliteDatastore() as datastore:
+            flow_repository = FlowRepository(datastore, AccountRegistry(datastore))
+            flow_repository.add([Transaction(10, 'john', 'mary', '2017-01-31')])
+            flow_repository.rebuild([Transaction(3, 'john', 'john', '2017-03-01')])
+            self.assertEqual(flow_repository.edge('john', 'mary').count, 0)
+            self.assertEqual(flow_repository.degree('john'), {'in': 1, 'out': 1})
+            self.assertEqual([(flow.amount, flow.count) for flow in flow_repository.counterparties('john')],
+                             [(3, 1)])
+            with self.assertRaises(ValueError):
+                flow_repository.edge('john', 'mary', '2017-01-01', '2017-12-31')
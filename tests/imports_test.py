@@ -0,0 +1,79 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from moazna.imports import ImportSummary, parse_file, parse_range, parse_rows, split_ranges
+
+
+class TestParseRows(unittest.TestCase):
+
+    def setUp(self):
+        self.summary = ImportSummary()
+
+    def test_parse_rows(self):
+        rows = list(parse_rows(
+            ['2017-01-16,john,mary,125.00', '', '2017-01-17,john,supermarket,20'],
+            self.summary))
+        self.assertEqual(rows, [
+            (125.0, 'john', 'mary', '2017-01-16'),
+            (20.0, 'john', 'supermarket', '2017-01-17'),
+        ])
+        self.assertEqual(self.summary.rows_read, 2)
+        self.assertEqual(self.summary.rows_rejected, 0)
+
+    def test_parse_rows_rejects_malformed_rows(self):
+        rows = list(parse_rows(
+            ['2017-01-16,john,mary', '2017-01-17,john,supermarket,abc',
+             '2017-02-30,john,supermarket,20'],
+            self.summary))
+        self.assertEqual(rows, [])
+        self.assertEqual(self.summary.rows_rejected, 3)
+        self.assertEqual([line for line, _ in self.summary.errors], [1, 2, 3])
+
+
+class TestParallelParsing(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ledger.csv')
+        with open(self.path, 'w') as ledger_file:
+            ledger_file.write('2017-01-16,john,mary,125.00\n'
+                              '2017-01-17,john,supermarket,abc\n'
+                              '\n'
+                              '2017-01-17,mary,insurance,100.00\n'
+                              '2017-1-18,mary,john,5\n'
+                              '2017-05-19,insurance,kyle,25.00')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_split_ranges_ends_on_lines(self):
+        ranges = split_ranges(self.path, chunk_bytes=10)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(self.path))
+        with open(self.path, 'rb') as ledger_file:
+            data = ledger_file.read()
+        for start, end in ranges:
+            self.assertTrue(end == len(data) or data[end - 1] == '\n')
+        self.assertEqual([end for _, end in ranges[:-1]], [start for start, _ in ranges[1:]])
+
+    def test_parse_range(self):
+        batch = parse_range((self.path, 0, os.path.getsize(self.path)))
+        self.assertEqual(batch.rows(), [
+            (125.0, 'john', 'mary', '2017-01-16'),
+            (100.0, 'mary', 'insurance', '2017-01-17'),
+            (25.0, 'insurance', 'kyle', '2017-05-19'),
+        ])
+        self.assertEqual(batch.names, ['john', 'mary', 'insurance', 'kyle'])
+        self.assertEqual(batch.rows_read, 5)
+        self.assertEqual([line for line, _ in batch.errors], [2, 5])
+        self.assertEqual(batch.lines, 6)
+
+    def test_parse_file_keeps_file_order(self):
+        batches = list(parse_file(self.path, processes=2, chunk_bytes=10))
+        self.assertGreater(len(batches), 1)
+        rows = [row for batch in batches for row in batch.rows()]
+        with open(self.path) as ledger_file:
+            self.assertEqual(rows, list(parse_rows(ledger_file, ImportSummary())))
+        self.assertEqual(sum(batch.lines for batch in batches), 6)
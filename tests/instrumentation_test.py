@@ -0,0 +1,66 @@
+import unittest
+
+from moazna.instrumentation import Capture, LatencyHistogram, Stats
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_record(self):
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.percentile(50))
+        for elapsed in [0.000001, 0.000003, 0.000003, 0.5]:
+            histogram.record(elapsed)
+
+        summary = histogram.to_dict()
+        self.assertEqual(summary['count'], 4)
+        self.assertEqual(summary['max'], 0.5)
+        self.assertEqual(summary['buckets'], {2: 1, 4: 2, 2 ** 19: 1})
+        self.assertEqual(histogram.percentile(50), 0.000004)
+        self.assertEqual(histogram.percentile(100), 0.5)
+
+
+class TestStats(unittest.TestCase):
+
+    def test_ledger_operations_include_their_datastore_calls(self):
+        stats = Stats()
+
+        def operation():
+            stats.record_call('filter', 'accounts', 0.001, read=3, scan=True)
+            stats.record_call('create', 'accounts', 0.001, written=1)
+            return 'done'
+
+        outer = stats.timed('outer', lambda: inner())
+        inner = stats.timed('inner', operation)
+        self.assertEqual(outer(), 'done')
+        stats.record_call('count', 'accounts', 0.001)
+
+        summary = stats.to_dict()
+        self.assertEqual(summary['datastore']['filter']['accounts']['scans'], 1)
+        self.assertEqual(summary['datastore']['create']['accounts']['records_written'], 1)
+        self.assertEqual(summary['datastore']['count']['accounts']['calls'], 1)
+        for name in ['outer', 'inner']:
+            self.assertEqual(summary['ledger'][name]['calls'], 1)
+            self.assertEqual(summary['ledger'][name]['records_read'], 3)
+            self.assertEqual(summary['ledger'][name]['records_written'], 1)
+
+        stats.reset()
+        self.assertEqual(stats.to_dict(), {'datastore': {}, 'ledger': {}})
+
+
+class TestCapture(unittest.TestCase):
+
+    def test_cpu(self):
+        with Capture('cpu') as capture:
+            sorted(range(1000), key=lambda value: -value)
+        self.assertIn('function calls', capture.report())
+
+    def test_memory(self):
+        with Capture('memory') as capture:
+            kept = [[] for _ in xrange(5000)]
+        self.assertGreater(capture.memory['objects_growth'], 1000)
+        self.assertIn('peak_rss_kib', capture.report())
+        self.assertEqual(len(kept), 5000)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            Capture('disk')
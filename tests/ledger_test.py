@@ -1,7 +1,13 @@
 import unittest
 import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
 from moazna import ledger
-from moazna.datastores import json_datastore
+from moazna.datastores import json_datastore, log_datastore, sqlite_datastore
+from moazna.instrumentation import Capture
 
 
 class TestLedger(unittest.TestCase):
@@ -53,3 +59,545 @@ class TestLedger(unittest.TestCase):
         accounts = self.sample_ledger.accounts
         self.assertEqual(len(txns), 5)
         self.assertEqual(len(accounts), 5)
+
+    def test_import_txns_in_batches(self):
+        ledger_file_path = os.path.abspath('./sample_ledger.csv')
+        row_ledger = ledger.Ledger(json_datastore.JsonDatastore())
+        row_ledger.import_txns(ledger_file_path)
+
+        txns = self.sample_ledger.import_txns(ledger_file_path, batch_size=2)
+        self.assertEqual(len(txns), 5)
+        self.assertEqual(
+            [(txn.amount, txn.payer_name, txn.recipient_name, txn.date)
+             for txn in txns],
+            [(txn.amount, txn.payer_name, txn.recipient_name, txn.date)
+             for txn in row_ledger.transactions])
+        self.assertEqual(
+            [dict(account) for account in self.sample_ledger.accounts],
+            [dict(account) for account in row_ledger.accounts])
+
+    def test_import_parallel(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'ledger.csv')
+            with open(path, 'w') as ledger_file:
+                ledger_file.write('2017-01-16,john,mary,125.00\n'
+                                  '2017-01-17,john,supermarket,twenty\n')
+                with open(os.path.abspath('./sample_ledger.csv')) as sample_file:
+                    ledger_file.write(sample_file.read())
+                ledger_file.write('2017-09-18,mary\n')
+
+            serial_ledger = ledger.Ledger(json_datastore.JsonDatastore())
+            with open(path) as ledger_file:
+                serial_summary = serial_ledger.import_stream(ledger_file)
+
+            summary = self.sample_ledger.import_parallel(path, processes=2, batch_size=2)
+            self.assertEqual(summary.rows_read, serial_summary.rows_read)
+            self.assertEqual(summary.errors, serial_summary.errors)
+            self.assertEqual([line for line, _ in summary.errors], [2, 9])
+            self.assertEqual(summary.txns_recorded, 6)
+            self.assertEqual(summary.accounts_created, 5)
+            self.assertEqual(
+                [dict(account) for account in self.sample_ledger.accounts],
+                [dict(account) for account in serial_ledger.accounts])
+            self.assertEqual(len(ledger.Ledger(json_datastore.JsonDatastore()).import_txns(
+                path, processes=2)), 6)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_import_stream(self):
+        lines = [
+            '2017-01-16,john,mary,125.00',
+            '2017-01-17,john,supermarket,twenty',
+            '2017-01-17,mary,insurance',
+            '2017-01-18,mary,insurance,100.00',
+        ]
+        recorded = []
+        summary = self.sample_ledger.import_stream(
+            lines, callback=recorded.append)
+        self.assertEqual(summary.rows_read, 4)
+        self.assertEqual(summary.rows_rejected, 2)
+        self.assertEqual([line for line, _ in summary.errors], [2, 3])
+        self.assertEqual(summary.accounts_created, 3)
+        self.assertEqual(summary.txns_recorded, 2)
+        self.assertEqual([txn.amount for txn in recorded], [125.0, 100.0])
+
+        summary = self.sample_ledger.import_stream(lines[:1], batch_size=10)
+        self.assertEqual(summary.accounts_created, 0)
+        self.assertEqual(summary.txns_recorded, 1)
+        self.assertEqual(self.sample_ledger.get_account_balance(
+            'john', '2017-01-16'), -250.0)
+
+    def test_reimport_skips_imported_rows(self):
+        lines = [
+            '2017-01-16,john,mary,125.00',
+            '2017-01-16,john,mary,125.00',
+            '2017-01-17,mary,insurance,100.00',
+        ]
+        dedupe_ledger = ledger.Ledger(json_datastore.JsonDatastore(), dedupe_imports=True)
+        summary = dedupe_ledger.import_stream(lines)
+        self.assertEqual(summary.txns_recorded, 3)
+        self.assertEqual(summary.rows_skipped, 0)
+
+        summary = dedupe_ledger.import_stream(lines + ['2017-01-18,mary,john,50.00'], batch_size=2)
+        self.assertEqual(summary.rows_read, 4)
+        self.assertEqual(summary.rows_skipped, 3)
+        self.assertEqual(summary.txns_recorded, 1)
+        self.assertEqual(len(dedupe_ledger.transactions), 4)
+        self.assertEqual(dedupe_ledger.get_account_balance('john', '2017-01-18'), -200.0)
+
+    def test_reimport_into_persisted_ledger(self):
+        ledger_file_path = os.path.abspath('./sample_ledger.csv')
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'ledger.log')
+            with log_datastore.LogDatastore(path) as datastore:
+                ledger.Ledger(datastore, dedupe_imports=True).import_txns(ledger_file_path)
+            with log_datastore.LogDatastore(path) as datastore:
+                persisted_ledger = ledger.Ledger(datastore, dedupe_imports=True)
+                summary = persisted_ledger.import_parallel(ledger_file_path, processes=2)
+                self.assertEqual(summary.rows_skipped, 5)
+                self.assertEqual(summary.txns_recorded, 0)
+                self.assertEqual(len(persisted_ledger.transactions), 5)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_out_of_order_import(self):
+        generator = random.Random(0)
+        lines = ['2017-{0:02d}-{1:02d},account{2},account{3},{4}'.format(
+            generator.randint(1, 12), generator.randint(1, 28), generator.randrange(4),
+            generator.randrange(4), generator.randint(1, 100)) for _ in xrange(200)]
+        sorted_ledger = ledger.Ledger(json_datastore.JsonDatastore())
+        sorted_ledger.import_stream(sorted(lines))
+        self.sample_ledger.import_stream(lines)
+        batch_ledger = ledger.Ledger(json_datastore.JsonDatastore())
+        batch_ledger.import_stream(lines, batch_size=16)
+
+        for month in xrange(1, 13):
+            date = '2017-{0:02d}-15'.format(month)
+            for name in ['account0', 'account1', 'account2', 'account3']:
+                expected = sorted_ledger.get_account_balance(name, date, as_of=True)
+                self.assertEqual(
+                    self.sample_ledger.get_account_balance(name, date, as_of=True), expected)
+                self.assertEqual(
+                    batch_ledger.get_account_balance(name, date, as_of=True), expected)
+
+    def test_back_dated_txn_keeps_opening_balance(self):
+        self.sample_ledger.account_repository.create('alice', 100.0)
+        self.sample_ledger.record_txn(10, 'alice', 'bob', '2017-01-01')
+        self.assertEqual(self.sample_ledger.get_account_balance('alice', '2017-01-01'), 90.0)
+        self.assertEqual(self.sample_ledger.get_account_balance(
+            'alice', '2016-12-31', as_of=True), None)
+        self.assertEqual(self.sample_ledger.account_repository.get_by_name('alice').balance, 90.0)
+
+    def test_get_account_balance_as_of(self):
+        self.sample_ledger.record_txn(
+            123, 'mr payer', 'mr recipient', '2017-09-01'
+        )
+        self.assertIsNone(self.sample_ledger.get_account_balance(
+            'mr payer', '2017-09-15'))
+        self.assertEqual(self.sample_ledger.get_account_balance(
+            'mr payer', '2017-09-15', as_of=True), -123)
+
+    def test_report(self):
+        ledger_file_path = os.path.abspath('./sample_ledger.csv')
+        self.sample_ledger.import_txns(ledger_file_path)
+        report = self.sample_ledger.report()
+        self.assertEqual(report.trial_balance(), dict(
+            (account.name, account.balance) for account in self.sample_ledger.accounts))
+        self.assertEqual(report.balance('john', '2017-01-16'), -125)
+
+    def test_account_cache_matches_uncached_state(self):
+        ledger_file_path = os.path.abspath('./sample_ledger.csv')
+        self.sample_ledger.import_txns(ledger_file_path)
+        self.sample_ledger.record_txn(5, 'john', 'john', '2017-09-18')
+
+        cached_ledger = ledger.Ledger(
+            json_datastore.JsonDatastore(), account_cache_size=2)
+        cached_ledger.import_txns(ledger_file_path)
+        cached_ledger.record_txn(5, 'john', 'john', '2017-09-18')
+
+        self.assertEqual(
+            [dict(account) for account in cached_ledger.accounts],
+            [dict(account) for account in self.sample_ledger.accounts])
+        self.assertGreater(cached_ledger.account_repository.cache_hits, 0)
+
+    def test_ledger_on_log_datastore(self):
+        ledger_file_path = os.path.abspath('./sample_ledger.csv')
+        self.sample_ledger.import_txns(ledger_file_path)
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'ledger.log')
+            with log_datastore.LogDatastore(path) as datastore:
+                ledger.Ledger(datastore).import_txns(ledger_file_path)
+            with log_datastore.LogDatastore(path) as datastore:
+                persisted_ledger = ledger.Ledger(datastore)
+                self.assertEqual(
+                    [dict(account) for account in persisted_ledger.accounts],
+                    [dict(account) for account in self.sample_ledger.accounts])
+                self.assertEqual(len(persisted_ledger.transactions), 5)
+                self.assertEqual(
+                    len(persisted_ledger.txn_repository.list_by_name('john')), 2)
+                self.assertEqual(
+                    len(persisted_ledger.txn_repository.list_by_date_range('2017-01-17', '2017-05-19')), 3)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_ledger_on_sqlite_datastore(self):
+        ledger_file_path = os.path.abspath('./sample_ledger.csv')
+        self.sample_ledger.import_txns(ledger_file_path)
+
+        with sqlite_datastore.SqliteDatastore() as datastore:
+            sqlite_ledger = ledger.Ledger(datastore)
+            sqlite_ledger.import_txns(ledger_file_path, batch_size=2)
+            self.assertEqual(
+                [dict(account) for account in sqlite_ledger.accounts],
+                [dict(account) for account in self.sample_ledger.accounts])
+            self.assertEqual(
+                len(sqlite_ledger.txn_repository.list_by_name('john')), 2)
+            self.assertEqual(
+                [txn.date for txn in sqlite_ledger.txn_repository.list_by_date_range(
+                    '2017-01-01', '2017-01-31', account='john')], ['2017-01-16', '2017-01-17'])
+
+    def test_columnar_transactions(self):
+        ledger_file_path = os.path.abspath('./sample_ledger.csv')
+        self.sample_ledger.import_txns(ledger_file_path)
+
+        columnar_ledger = ledger.Ledger(json_datastore.JsonDatastore(), columnar_txns=True)
+        columnar_ledger.import_txns(ledger_file_path, batch_size=2)
+        self.assertEqual(
+            [dict(account) for account in columnar_ledger.accounts],
+            [dict(account) for account in self.sample_ledger.accounts])
+        self.assertEqual(
+            [(txn.amount, txn.payer_name, txn.recipient_name, txn.date)
+             for txn in columnar_ledger.transactions],
+            [(txn.amount, txn.payer_name, txn.recipient_name, txn.date)
+             for txn in self.sample_ledger.transactions])
+        self.assertEqual(columnar_ledger.report().trial_balance(),
+                         self.sample_ledger.report().trial_balance())
+
+    def test_checkpoint_interval(self):
+        checkpoint_ledger = ledger.Ledger(json_datastore.JsonDatastore(), checkpoint_interval=3)
+        for day in xrange(1, 8):
+            checkpoint_ledger.record_txn(day, 'john', 'mary', '2017-09-{0:02d}'.format(day))
+        self.assertEqual(checkpoint_ledger.checkpoint_repository.positions(), [3, 6])
+
+        lines = ['2017-10-01,mary,john,1'] * 5
+        checkpoint_ledger.import_stream(lines, batch_size=5)
+        self.assertEqual(checkpoint_ledger.checkpoint_repository.positions(), [3, 6, 12])
+
+    def test_balances_at(self):
+        checkpoint_ledger = ledger.Ledger(json_datastore.JsonDatastore(), checkpoint_interval=2)
+        checkpoint_ledger.record_txn(10, 'john', 'mary', '2017-09-01')
+        checkpoint_ledger.record_txn(5, 'mary', 'alice', '2017-09-02')
+        checkpoint_ledger.record_txn(1, 'alice', 'john', '2017-09-03')
+
+        self.assertEqual(checkpoint_ledger.balances_at(0), {})
+        self.assertEqual(checkpoint_ledger.balances_at(1), {'john': -10, 'mary': 10})
+        self.assertEqual(checkpoint_ledger.balances_at(2), {'john': -10, 'mary': 5, 'alice': 5})
+        self.assertEqual(checkpoint_ledger.balances_at(),
+                         checkpoint_ledger.account_repository.balances())
+
+    def test_delete_txn(self):
+        delete_ledger = ledger.Ledger(sqlite_datastore.SqliteDatastore(),
+                                      checkpoint_interval=2, rollups=True)
+        first = delete_ledger.record_txn(100, 'john', 'mary', '2017-01-16')
+        delete_ledger.record_txn(30, 'mary', 'insurance', '2017-01-17')
+        delete_ledger.record_txn(20, 'john', 'mary', '2017-01-18')
+
+        self.assertEqual(delete_ledger.delete_txn(first.id).id, first.id)
+        self.assertIsNone(delete_ledger.delete_txn(first.id))
+        self.assertEqual(len(delete_ledger.transactions), 2)
+        self.assertEqual(delete_ledger.account_repository.balances(),
+                         {'john': -20, 'mary': -10, 'insurance': 30})
+        self.assertEqual(delete_ledger.get_account_balance('mary', '2017-01-17'), -30)
+        self.assertEqual(delete_ledger.get_account_balance('john', '2017-01-18'), -20)
+        self.assertEqual(delete_ledger.balances_at(2), {'john': 0, 'mary': -30, 'insurance': 30})
+        self.assertEqual(delete_ledger.balances_at(), delete_ledger.account_repository.balances())
+        self.assertEqual(
+            [rollup.label for rollup in delete_ledger.get_rollups('john', '2017-01-01', '2017-01-31')],
+            ['2017-01-18'])
+
+    def test_delete_txns_voids_an_import(self):
+        lines = ['2017-01-16,john,mary,125.00', '2017-01-17,mary,insurance,100.00']
+        bad_lines = ['2017-01-16,john,mary,1000.00', '2017-01-17,mary,john,12.00']
+        delete_ledger = ledger.Ledger(json_datastore.JsonDatastore(), dedupe_imports=True)
+        delete_ledger.import_stream(lines)
+        imported = []
+        delete_ledger.import_stream(bad_lines, batch_size=10, callback=imported.append)
+
+        deleted = delete_ledger.delete_txns([txn.id for txn in imported])
+        self.assertEqual(len(deleted), 2)
+        self.sample_ledger.import_stream(lines)
+        self.assertEqual(delete_ledger.account_repository.balances(),
+                         self.sample_ledger.account_repository.balances())
+        self.assertEqual(delete_ledger.get_account_balance('mary', '2017-01-17'), 25)
+
+        summary = delete_ledger.import_stream(lines + bad_lines[:1])
+        self.assertEqual((summary.rows_skipped, summary.txns_recorded), (2, 1))
+
+    def test_reverse_txn(self):
+        txn = self.sample_ledger.record_txn(100, 'john', 'mary', '2017-01-16')
+        other = self.sample_ledger.record_txn(30, 'mary', 'insurance', '2017-01-17')
+        reversal = self.sample_ledger.reverse_txn(txn.id, '2017-01-20')
+        self.assertEqual((reversal.payer_name, reversal.recipient_name, reversal.amount),
+                         ('mary', 'john', 100))
+        self.assertIsNone(self.sample_ledger.reverse_txn('unknown'))
+        self.assertEqual(self.sample_ledger.get_account_balance('john', '2017-01-20'), 0)
+        self.assertEqual(self.sample_ledger.get_account_balance('john', '2017-01-16'), -100)
+
+        reversals = self.sample_ledger.reverse_txns([txn.id, other.id])
+        self.assertEqual([reversal.date for reversal in reversals], ['2017-01-16', '2017-01-17'])
+        self.assertEqual(len(self.sample_ledger.transactions), 5)
+        self.assertEqual(self.sample_ledger.account_repository.balances(),
+                         {'john': 100, 'mary': -100, 'insurance': 0})
+
+    def test_flows(self):
+        flow_ledger = ledger.Ledger(json_datastore.JsonDatastore(), flows='month')
+        flow_ledger.import_txns(os.path.abspath('./sample_ledger.csv'), batch_size=2)
+        txn = flow_ledger.record_txn(10, 'john', 'mary', '2017-03-01')
+
+        self.assertEqual(flow_ledger.get_flow('john', 'mary').amount, 135)
+        self.assertEqual(flow_ledger.get_flow('john', 'mary', '2017-03-01', '2017-03-31').amount, 10)
+        self.assertEqual([(flow.recipient_name, flow.amount)
+                          for flow in flow_ledger.top_counterparties('mary')],
+                         [('john', 135), ('insurance', 100)])
+        self.assertEqual(flow_ledger.get_degree('mary'), {'in': 1, 'out': 1})
+
+        flow_ledger.delete_txn(txn.id)
+        self.assertEqual(flow_ledger.get_flow('john', 'mary', '2017-03-01', '2017-03-31').count, 0)
+        self.assertEqual(flow_ledger.get_flow('john', 'mary').amount, 125)
+
+        self.sample_ledger.import_txns(os.path.abspath('./sample_ledger.csv'))
+        with self.assertRaises(ValueError):
+            self.sample_ledger.get_flow('john', 'mary')
+        reopened_ledger = ledger.Ledger(self.sample_datastore, flows=True)
+        reopened_ledger.rebuild_flows()
+        self.assertEqual(reopened_ledger.get_degree('supermarket'), {'in': 2, 'out': 0})
+
+    def test_restore(self):
+        datastore = json_datastore.JsonDatastore()
+        checkpoint_ledger = ledger.Ledger(datastore, checkpoint_interval=2)
+        checkpoint_ledger.import_txns(os.path.abspath('./sample_ledger.csv'))
+        balances = checkpoint_ledger.account_repository.balances()
+
+        john = checkpoint_ledger.account_repository.get_by_name('john')
+        john.balance = 1000
+        checkpoint_ledger.account_repository.update(john)
+        checkpoint_ledger.account_repository.delete(
+            checkpoint_ledger.account_repository.get_by_name('mary'))
+
+        restarted_ledger = ledger.Ledger(datastore, checkpoint_interval=2)
+        self.assertEqual(restarted_ledger.restore(), 2)
+        self.assertEqual(restarted_ledger.account_repository.balances(), balances)
+        self.assertEqual(restarted_ledger.restore(), 0)
+
+    def test_positions_continue_after_restart(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'ledger.log')
+            with log_datastore.LogDatastore(path) as datastore:
+                first_ledger = ledger.Ledger(datastore, checkpoint_interval=2)
+                for _ in xrange(3):
+                    first_ledger.record_txn(1, 'john', 'mary', '2017-09-01')
+            with log_datastore.LogDatastore(path) as datastore:
+                second_ledger = ledger.Ledger(datastore, checkpoint_interval=2)
+                self.assertEqual(second_ledger.txn_repository.position, 3)
+                second_ledger.record_txn(1, 'mary', 'john', '2017-09-02')
+                self.assertEqual(second_ledger.checkpoint_repository.positions(), [2, 4])
+                self.assertEqual(second_ledger.balances_at(3), {'john': -3, 'mary': 3})
+        finally:
+            shutil.rmtree(directory)
+
+    def test_rollups_match_transactions(self):
+        ledger_file_path = os.path.abspath('./sample_ledger.csv')
+        rollup_ledger = ledger.Ledger(json_datastore.JsonDatastore(), rollups=True)
+        rollup_ledger.import_txns(ledger_file_path, batch_size=2)
+        rollup_ledger.record_txn(7, 'john', 'mary', '2015-02-01')
+
+        for name in ['john', 'mary', 'supermarket']:
+            for period in ['day', 'month']:
+                expected = {}
+                for txn in rollup_ledger.txn_repository.list_by_name(name):
+                    label = txn.date if period == 'day' else txn.date[:7]
+                    net = expected.get(label, 0.0)
+                    if txn.recipient_name == name:
+                        net += txn.amount
+                    if txn.payer_name == name:
+                        net -= txn.amount
+                    expected[label] = net
+                rollups = rollup_ledger.get_rollups(name, '2000-01-01', '2030-12-31', period)
+                self.assertEqual([rollup.label for rollup in rollups], sorted(expected))
+                self.assertEqual(dict((rollup.label, rollup.net) for rollup in rollups), expected)
+
+    def test_rebuild_rollups(self):
+        self.sample_ledger.record_txn(5, 'john', 'mary', '2017-09-01')
+        with self.assertRaises(ValueError):
+            self.sample_ledger.get_rollups('john', '2017-09-01', '2017-09-30')
+
+        rollup_ledger = ledger.Ledger(self.sample_datastore, rollups=True)
+        self.assertEqual(rollup_ledger.get_rollups('john', '2017-09-01', '2017-09-30'), [])
+        self.assertEqual(rollup_ledger.rebuild_rollups(), 4)
+        rollup, = rollup_ledger.get_rollups('mary', '2017-09-01', '2017-09-30', 'month')
+        self.assertEqual((rollup.inflow, rollup.count), (5, 1))
+
+    def test_iter_transactions_reads_only_a_page(self):
+        instrumented_ledger = ledger.Ledger(json_datastore.JsonDatastore(), instrument=True)
+        instrumented_ledger.import_txns(os.path.abspath('./sample_ledger.csv'), batch_size=5)
+        instrumented_ledger.stats.reset()
+
+        txns = list(instrumented_ledger.iter_transactions(limit=2))
+        self.assertEqual([(txn.payer_name, txn.recipient_name) for txn in txns],
+                         [('john', 'mary'), ('john', 'supermarket')])
+        self.assertEqual(
+            instrumented_ledger.stats.to_dict()['datastore']['scan']['transactions']['records_read'], 2)
+
+        for account in instrumented_ledger.iter_accounts(order_by='name'):
+            break
+        self.assertEqual(account.name, 'insurance')
+        self.assertEqual(len(instrumented_ledger.accounts), 5)
+
+    def test_instrument(self):
+        self.assertIsNone(self.sample_ledger.stats)
+        instrumented_ledger = ledger.Ledger(json_datastore.JsonDatastore(), instrument=True)
+        instrumented_ledger.import_txns(os.path.abspath('./sample_ledger.csv'), batch_size=2)
+        instrumented_ledger.record_txn(5, 'john', 'mary', '2017-09-01')
+
+        stats = instrumented_ledger.stats.to_dict()
+        self.assertEqual(stats['ledger']['record_txn']['calls'], 2)
+        self.assertEqual(stats['ledger']['_record_batch']['calls'], 2)
+        self.assertEqual(stats['ledger']['import_stream']['calls'], 1)
+        self.assertEqual(stats['ledger']['import_txns']['records_written'],
+                         stats['ledger']['import_stream']['records_written'])
+        self.assertEqual(stats['datastore']['create_many']['transactions']['records_written'], 4)
+        self.assertGreater(stats['ledger']['record_txn']['records_read'], 0)
+
+    def test_import_capture(self):
+        capture = Capture('cpu')
+        self.sample_ledger.import_txns(os.path.abspath('./sample_ledger.csv'), capture=capture)
+        self.assertIn('record_txn', capture.report())
+
+
+class TestConcurrentLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.sample_ledger = ledger.Ledger(json_datastore.JsonDatastore(), concurrent=True)
+        self.check_interval = sys.getcheckinterval()
+        # switch threads as often as possible to provoke races
+        sys.setcheckinterval(1)
+
+    def tearDown(self):
+        sys.setcheckinterval(self.check_interval)
+
+    def run_threads(self, plans):
+        errors = []
+
+        def record(plan):
+            try:
+                for amount, payer, recipient in plan:
+                    self.sample_ledger.record_txn(amount, payer, recipient, '2017-09-01')
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=record, args=(plan,)) for plan in plans]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_no_lost_updates_under_contention(self):
+        names = ['account{0}'.format(i) for i in xrange(5)]
+        generator = random.Random(0)
+        plans = [[(generator.randint(1, 10),) + tuple(generator.sample(names, 2))
+                  for _ in xrange(100)] for _ in xrange(8)]
+        self.run_threads(plans)
+
+        expected = dict((name, 0.0) for name in names)
+        for plan in plans:
+            for amount, payer, recipient in plan:
+                expected[payer] -= amount
+                expected[recipient] += amount
+
+        self.assertEqual(len(self.sample_ledger.transactions), 800)
+        self.assertEqual(dict((account.name, account.balance)
+                              for account in self.sample_ledger.accounts), expected)
+        self.assertEqual(sorted(self.sample_ledger.account_registry.names), sorted(names))
+
+    def test_opposite_transfers_dont_deadlock(self):
+        plans = [[(1, 'john', 'mary')] * 200, [(1, 'mary', 'john')] * 200,
+                 [(1, 'john', 'john')] * 200]
+        self.run_threads(plans)
+        self.assertEqual(self.sample_ledger.get_account_balance('john', '2017-09-01'), 0)
+        self.assertEqual(self.sample_ledger.get_account_balance('mary', '2017-09-01'), 0)
+
+    def test_checkpoints_under_contention(self):
+        checkpoint_ledger = ledger.Ledger(json_datastore.JsonDatastore(), concurrent=True,
+                                          checkpoint_interval=25)
+        self.sample_ledger = checkpoint_ledger
+        names = ['account{0}'.format(i) for i in xrange(5)]
+        generator = random.Random(1)
+        plans = [[(generator.randint(1, 10),) + tuple(generator.sample(names, 2))
+                  for _ in xrange(50)] for _ in xrange(4)]
+        self.run_threads(plans)
+
+        # every checkpoint matches a replay of the log up to its position
+        repository = checkpoint_ledger.checkpoint_repository
+        self.assertGreater(repository.count(), 0)
+        for position in repository.positions():
+            checkpoint = repository.nearest(position)
+            replayed = {}
+            for txn in checkpoint_ledger.txn_repository.list_range(0, position):
+                replayed[txn.payer_name] = replayed.get(txn.payer_name, 0) - txn.amount
+                replayed[txn.recipient_name] = replayed.get(txn.recipient_name, 0) + txn.amount
+            self.assertEqual(dict((checkpoint_ledger.account_registry.name(account_id), balance)
+                                  for account_id, balance in checkpoint.balances.iteritems()),
+                             replayed)
+        self.assertEqual(checkpoint_ledger.balances_at(),
+                         checkpoint_ledger.account_repository.balances())
+
+    def test_concurrent_batches(self):
+        lines = ['2017-01-{0:02d},account{1},account{2},1'.format(day % 28 + 1, day % 3, day % 4)
+                 for day in xrange(200)]
+        threads = [threading.Thread(target=self.sample_ledger.import_stream,
+                                    args=(lines,), kwargs={'batch_size': 7})
+                   for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        serial_ledger = ledger.Ledger(json_datastore.JsonDatastore())
+        for _ in xrange(4):
+            serial_ledger.import_stream(lines, batch_size=7)
+        self.assertEqual(
+            dict((account.name, account.balance) for account in self.sample_ledger.accounts),
+            dict((account.name, account.balance) for account in serial_ledger.accounts))
+
+    def test_sqlite_datastore_under_contention(self):
+        with sqlite_datastore.SqliteDatastore() as datastore:
+            self.sample_ledger = ledger.Ledger(datastore, concurrent=True)
+            plans = [[(1, 'john', 'mary')] * 50, [(2, 'mary', 'alice')] * 50,
+                     [(3, 'alice', 'john')] * 50]
+            self.run_threads(plans)
+            self.assertEqual(len(self.sample_ledger.transactions), 150)
+            self.assertEqual(self.sample_ledger.account_repository.balances(),
+                             {'john': 100, 'mary': -50, 'alice': -50})
+
+    def test_deletes_while_recording(self):
+        txns = [self.sample_ledger.record_txn(1, 'john', 'mary', '2017-09-01')
+                for _ in xrange(100)]
+        deleter = threading.Thread(target=lambda: [self.sample_ledger.delete_txn(txn.id)
+                                                   for txn in txns[:50]])
+        deleter.start()
+        self.run_threads([[(2, 'mary', 'john')] * 50, [(1, 'john', 'alice')] * 50])
+        deleter.join()
+        self.sample_ledger.delete_txns([txn.id for txn in txns[50:]])
+
+        self.assertEqual(self.sample_ledger.account_repository.balances(),
+                         {'john': 50, 'mary': -100, 'alice': 50})
+
+    def test_rejects_account_cache(self):
+        with self.assertRaises(ValueError):
+            ledger.Ledger(json_datastore.JsonDatastore(), account_cache_size=10, concurrent=True)
@@ -0,0 +1,34 @@
+import unittest
+
+from moazna.locking import AccountLocks
+
+
+class TestAccountLocks(unittest.TestCase):
+
+    def setUp(self):
+        self.locks = AccountLocks(stripes=8)
+
+    def test_stripes_are_sorted_and_distinct(self):
+        stripes = self.locks.stripes(['mary', 'john', 'mary'])
+        self.assertEqual(stripes, sorted(set(stripes)))
+        self.assertEqual(self.locks.stripes(['john', 'mary']), self.locks.stripes(['mary', 'john']))
+
+    def test_hold_releases_locks(self):
+        with self.locks.hold('john', 'mary', 'john'):
+            stripe = self.locks.stripes(['john'])[0]
+            self.assertFalse(self.locks._locks[stripe].acquire(False))
+        with self.locks.hold('john'):
+            pass
+
+    def test_hold_releases_locks_on_error(self):
+        with self.assertRaises(KeyError):
+            with self.locks.hold('john'):
+                raise KeyError('john')
+        with self.locks.hold('john'):
+            pass
+
+    def test_hold_all(self):
+        with self.locks.hold_all():
+            self.assertFalse(any(lock.acquire(False) for lock in self.locks._locks))
+        with self.locks.hold('john', 'mary'):
+            pass
@@ -0,0 +1,155 @@
+import unittest
+import threading
+
+from moazna import ledger
+from moazna.datastores import json_datastore, sqlite_datastore
+from moazna.pipeline import AsyncLedger, PendingResult
+
+
+class TestPendingResult(unittest.TestCase):
+
+    def test_resolve(self):
+        pending = PendingResult()
+        done = []
+        pending.add_done_callback(done.append)
+        self.assertFalse(pending.done())
+        with self.assertRaises(RuntimeError):
+            pending.result(timeout=0)
+        pending._resolve(5)
+        self.assertEqual(pending.result(), 5)
+        self.assertIsNone(pending.exception())
+        self.assertEqual(done, [pending])
+        pending.add_done_callback(done.append)
+        self.assertEqual(len(done), 2)
+
+    def test_resolve_exception(self):
+        pending = PendingResult()
+        pending._resolve(exception=KeyError('john'))
+        self.assertIsInstance(pending.exception(), KeyError)
+        with self.assertRaises(KeyError):
+            pending.result()
+
+
+class TestAsyncLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.sample_ledger = ledger.Ledger(json_datastore.JsonDatastore())
+        self.async_ledger = AsyncLedger(self.sample_ledger, max_batch=50)
+
+    def tearDown(self):
+        self.async_ledger.close()
+
+    def test_record_txn(self):
+        pending = self.async_ledger.record_txn(125, 'john', 'mary', '2017-01-16')
+        txn = pending.result(timeout=5)
+        self.assertEqual((txn.amount, txn.payer_name, txn.recipient_name), (125, 'john', 'mary'))
+        self.assertEqual(self.async_ledger.get_account_balance(
+            'mary', '2017-01-16').result(timeout=5), 125)
+
+    def test_invalid_date_is_rejected_right_away(self):
+        with self.assertRaises(ValueError):
+            self.async_ledger.record_txn(125, 'john', 'mary', '16/01/2017')
+
+    def test_invalid_rows_are_rejected_right_away(self):
+        for row in [('12', 'john', 'mary'), (float('nan'), 'john', 'mary'),
+                    (True, 'john', 'mary'), (12, '', 'mary'), (12, 'john', None)]:
+            with self.assertRaises(ValueError):
+                self.async_ledger.record_txn(*(row + ('2017-01-16',)))
+
+    def record_batch(self, async_ledger, payers):
+        """Queue transactions to mary as a single batch, failing the ones paid by 'broken'."""
+        repository = async_ledger.ledger.account_repository
+
+        def failing(save):
+            def save_accounts(instances):
+                if any(account.name == 'broken' for account in instances):
+                    raise KeyError('broken')
+                return save(instances)
+            return save_accounts
+        repository.create_many = failing(repository.create_many)
+        repository.update_many = failing(repository.update_many)
+
+        # hold the writer so the transactions are queued as a single batch
+        release = threading.Event()
+        async_ledger.call(release.wait)
+        pendings = [async_ledger.record_txn(1, payer, 'mary', '2017-01-16')
+                    for payer in payers]
+        release.set()
+        async_ledger.flush(timeout=5)
+        return pendings
+
+    def test_failing_batch_is_not_retried(self):
+        self.assertFalse(self.sample_ledger.atomic_writes)
+        pendings = self.record_batch(self.async_ledger, ['john', 'broken', 'alice'])
+        self.assertTrue(all(isinstance(pending.exception(), KeyError) for pending in pendings))
+        self.assertEqual(len(self.sample_ledger.transactions), 3)
+
+    def test_failing_transaction_of_a_batch_is_isolated(self):
+        with sqlite_datastore.SqliteDatastore() as datastore:
+            sample_ledger = ledger.Ledger(datastore)
+            self.assertTrue(sample_ledger.atomic_writes)
+            with AsyncLedger(sample_ledger) as async_ledger:
+                pendings = self.record_batch(async_ledger, ['john', 'broken', 'alice'])
+
+            self.assertIsInstance(pendings[1].exception(), KeyError)
+            self.assertEqual([pending.result().payer_name for pending in pendings[::2]],
+                             ['john', 'alice'])
+            self.assertEqual(len(sample_ledger.transactions), 2)
+            # the ids handed out in the rolled back batch are still on record
+            reopened = ledger.Ledger(datastore)
+            self.assertEqual(reopened.get_account_balance('mary', '2017-01-16'), 2)
+            self.assertEqual(reopened.get_account_balance('alice', '2017-01-16'), -1)
+            self.assertEqual(reopened.account_registry.name(
+                sample_ledger.account_registry.get_id('broken')), 'broken')
+
+    def test_sqlite_datastore(self):
+        with sqlite_datastore.SqliteDatastore() as datastore:
+            with AsyncLedger(ledger.Ledger(datastore)) as async_ledger:
+                pendings = [async_ledger.record_txn(i, 'john', 'mary', '2017-01-16')
+                            for i in xrange(1, 11)]
+                self.assertEqual(async_ledger.get_account_balance(
+                    'mary', '2017-01-16').result(timeout=5), 55)
+            self.assertTrue(all(pending.exception() is None for pending in pendings))
+
+    def test_concurrent_writers_match_serial_ledger(self):
+        serial_ledger = ledger.Ledger(json_datastore.JsonDatastore())
+        rows = [(i % 7 + 1, 'account{0}'.format(i % 5), 'account{0}'.format(i % 3),
+                 '2017-01-{0:02d}'.format(i % 28 + 1)) for i in xrange(400)]
+        for row in rows:
+            serial_ledger.record_txn(*row)
+
+        pendings = []
+        lock = threading.Lock()
+
+        def write(part):
+            for row in part:
+                pending = self.async_ledger.record_txn(*row)
+                with lock:
+                    pendings.append(pending)
+
+        # each writer keeps its own rows in order, interleaving doesn't change balances
+        threads = [threading.Thread(target=write, args=(rows[i::4],)) for i in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.async_ledger.flush(timeout=10)
+
+        self.assertTrue(all(pending.done() for pending in pendings))
+        self.assertEqual(len(self.sample_ledger.transactions), 400)
+        self.assertEqual(
+            dict((account.name, account.balance) for account in self.sample_ledger.accounts),
+            dict((account.name, account.balance) for account in serial_ledger.accounts))
+
+    def test_import_txns(self):
+        lines = ['2017-01-16,john,mary,125.00', '2017-01-17,john,supermarket,abc']
+        summary = self.async_ledger.import_txns(iter(lines)).result(timeout=5)
+        self.assertEqual(summary.txns_recorded, 1)
+        self.assertEqual(summary.rows_rejected, 1)
+
+    def test_closed_ledger_rejects_calls(self):
+        pending = self.async_ledger.record_txn(1, 'john', 'mary', '2017-01-16')
+        self.async_ledger.close()
+        self.assertTrue(pending.done())
+        with self.assertRaises(RuntimeError):
+            self.async_ledger.record_txn(1, 'john', 'mary', '2017-01-16')
@@ -0,0 +1,58 @@
+import unittest
+
+from moazna.reports import LedgerReport, TransactionFrame
+
+
+class TestTransactionFrame(unittest.TestCase):
+
+    def test_from_records(self):
+        frame = TransactionFrame.from_records([
+            {'amount': 10, 'payer_name': 'john', 'recipient_name': 'mary', 'date': '2017-01-16'},
+            {'amount': 5, 'payer_name': 'mary', 'recipient_name': 'john', 'date': '2017-01-17'},
+        ])
+        self.assertEqual(len(frame), 2)
+        self.assertEqual(frame.names, ['john', 'mary'])
+        self.assertEqual(list(frame.payers), [0, 1])
+        self.assertEqual(list(frame.recipients), [1, 0])
+        self.assertEqual(list(frame.amounts), [10.0, 5.0])
+
+
+class TestLedgerReport(unittest.TestCase):
+
+    def setUp(self):
+        frame = TransactionFrame.from_records([
+            {'amount': 125, 'payer_name': 'john', 'recipient_name': 'mary', 'date': '2017-01-16'},
+            {'amount': 20, 'payer_name': 'john', 'recipient_name': 'supermarket', 'date': '2017-01-17'},
+            {'amount': 100, 'payer_name': 'mary', 'recipient_name': 'insurance', 'date': '2017-02-17'},
+            # recorded out of order
+            {'amount': 25, 'payer_name': 'insurance', 'recipient_name': 'mary', 'date': '2017-01-01'},
+        ])
+        self.report = LedgerReport(frame, {
+            'john': -145, 'mary': 50, 'supermarket': 20, 'insurance': 75, 'idle': 10})
+
+    def test_trial_balance(self):
+        self.assertEqual(self.report.trial_balance(), {
+            'john': -145, 'mary': 50, 'supermarket': 20, 'insurance': 75, 'idle': 10})
+        self.assertEqual(self.report.trial_balance('2017-01-16'), {
+            'john': -125, 'mary': 150, 'supermarket': 0, 'insurance': -25, 'idle': 10})
+        self.assertEqual(self.report.balance('mary', '2016-12-31'), 0)
+        self.assertIsNone(self.report.balance('nobody'))
+
+    def test_opening_closing(self):
+        result = self.report.opening_closing('2017-01-17', '2017-01-31')
+        self.assertEqual(result['john'], (-125, -145))
+        self.assertEqual(result['insurance'], (-25, -25))
+
+    def test_net_flows(self):
+        labels, matrix = self.report.net_flows('2017-01-01', '2017-03-15')
+        self.assertEqual(labels, ['2017-01', '2017-02', '2017-03'])
+        self.assertEqual(matrix['mary'], [150, -100, 0])
+        self.assertEqual(matrix['idle'], [0, 0, 0])
+
+        labels, matrix = self.report.net_flows('2017-01-16', '2017-01-17', 'day')
+        self.assertEqual(labels, ['2017-01-16', '2017-01-17'])
+        self.assertEqual(matrix['john'], [-125, -20])
+
+    def test_net_flows_unknown_period(self):
+        self.assertRaises(ValueError, self.report.net_flows,
+                          '2017-01-01', '2017-03-15', 'week')
@@ -0,0 +1,57 @@
+import unittest
+
+from moazna.accounts import AccountRegistry
+from moazna.datastores import json_datastore
+from moazna.rollups import RollupRepository
+from moazna.transactions import Transaction
+
+
+class TestRollupRepository(unittest.TestCase):
+
+    def setUp(self):
+        self.sample_datastore = json_datastore.JsonDatastore()
+        self.rollup_repository = RollupRepository(
+            self.sample_datastore, AccountRegistry(self.sample_datastore))
+
+    def test_add(self):
+        self.rollup_repository.add([Transaction(10, 'john', 'mary', '2017-01-31'),
+                                    Transaction(4, 'mary', 'john', '2017-01-31')])
+        self.rollup_repository.add([Transaction(1.5, 'john', 'mary', '2017-02-01')])
+
+        days = self.rollup_repository.list_range('john', '2017-01-01', '2017-02-28')
+        self.assertEqual([dict(rollup) for rollup in days], [
+            {'account_name': 'john', 'period': 'day', 'label': '2017-01-31',
+             'inflow': 4, 'outflow': 10, 'net': -6, 'count': 2},
+            {'account_name': 'john', 'period': 'day', 'label': '2017-02-01',
+             'inflow': 0, 'outflow': 1.5, 'net': -1.5, 'count': 1}])
+
+        months = self.rollup_repository.list_range('mary', '2016-12-15', '2017-02-15', 'month')
+        self.assertEqual([(rollup.label, rollup.net, rollup.count) for rollup in months],
+                         [('2017-01', 6, 2), ('2017-02', 1.5, 1)])
+
+    def test_self_transfer_counts_once(self):
+        self.rollup_repository.add([Transaction(3, 'john', 'john', '2017-01-01')])
+        rollup, = self.rollup_repository.list_range('john', '2017-01-01', '2017-01-01')
+        self.assertEqual((rollup.inflow, rollup.outflow, rollup.count), (3, 3, 1))
+
+    def test_remove(self):
+        txns = [Transaction(10, 'john', 'mary', '2017-01-31'),
+                Transaction(4, 'john', 'mary', '2017-02-01')]
+        self.rollup_repository.add(txns)
+        self.rollup_repository.remove(txns[1:])
+
+        self.assertEqual(len(self.rollup_repository.list_range('john', '2017-01-01', '2017-02-28')), 1)
+        rollup, = self.rollup_repository.list_range('mary', '2017-01-01', '2017-02-28', 'month')
+        self.assertEqual((rollup.label, rollup.inflow, rollup.count), ('2017-01', 10, 1))
+
+    def test_list_range(self):
+        self.assertEqual(self.rollup_repository.list_range('nobody', '2017-01-01', '2017-12-31'), [])
+        with self.assertRaises(ValueError):
+            self.rollup_repository.list_range('john', '2017-01-01', '2017-12-31', 'year')
+
+    def test_rebuild(self):
+        self.rollup_repository.add([Transaction(10, 'john', 'mary', '2017-01-31')])
+        self.rollup_repository.rebuild([Transaction(2, 'john', 'mary', '2017-03-01')])
+        self.assertEqual(self.rollup_repository.list_range('john', '2017-01-01', '2017-01-31'), [])
+        rollup, = self.rollup_repository.list_range('mary', '2017-01-01', '2017-12-31', 'month')
+        self.assertEqual((rollup.label, rollup.inflow), ('2017-03', 2))
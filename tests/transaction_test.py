@@ -21,6 +21,20 @@ class TestTransaction(unittest.TestCase):
         txn_dict['id'] = sample_txn.id
         self.assertDictEqual(dict(sample_txn), txn_dict)
 
+    def test_from_dict_with_id(self):
+        txn_dict = {
+            'id': 'some-id',
+            'amount': 12,
+            'payer_name': 'mr payer',
+            'recipient_name': 'mr recipient',
+            'date': '2017-05-12'
+        }
+
+        sample_txn = Transaction.from_dict(txn_dict)
+        self.assertEqual(sample_txn.id, 'some-id')
+        self.assertDictEqual(dict(sample_txn), txn_dict)
+        self.assertFalse(hasattr(sample_txn, '__dict__'))
+
 
 class TestTransactionRepository(unittest.TestCase):
 
@@ -101,6 +115,24 @@ class TestTransactionRepository(unittest.TestCase):
         result = self.txn_repository.list_by_name('john')
         self.assertEqual(len(result), 3)
 
+    def test_list_by_payer_matches_whole_names(self):
+        self.txn_repository.create(123, 'john', 'mr recipient', '2017-09-01')
+        self.txn_repository.create(123, 'johnny', 'john', '2017-09-01')
+        self.assertEqual(len(self.txn_repository.list_by_payer('john')), 1)
+        self.assertEqual(len(self.txn_repository.list_by_name('john')), 2)
+        self.assertEqual(len(self.txn_repository.list_by_name('johnny')), 1)
+
+    def test_list_by_name_is_ordered_by_date(self):
+        self.txn_repository.create(1, 'john', 'mary', '2017-09-03')
+        self.txn_repository.create(2, 'john', 'john', '2017-09-02')
+        self.txn_repository.create(3, 'mary', 'john', '2017-09-01')
+        self.txn_repository.create(4, 'john', 'mary', '2017-09-01')
+        self.assertEqual([txn.amount for txn in self.txn_repository.list_by_name('john')], [3, 4, 2, 1])
+        self.assertEqual([txn.amount for txn in self.txn_repository.list_by_payer('john')], [4, 2, 1])
+        self.assertEqual([txn.amount for txn in self.txn_repository.list_by_recipient('john')], [3, 2])
+        self.assertEqual([txn.amount for txn in self.txn_repository.list_by_date_range(
+            '2017-09-01', '2017-09-02', 'john')], [3, 4, 2])
+
     def test_update(self):
         sample_txn = self.txn_repository.create(
             123, 'mr payer', 'mr recipient', '2017-09-01')
@@ -118,3 +150,121 @@ class TestTransactionRepository(unittest.TestCase):
         self.txn_repository.delete(sample_txn)
         result = self.txn_repository.list()
         self.assertEqual(len(result), 1)
+
+    def test_delete_many(self):
+        first = self.txn_repository.create(123, 'mr payer', 'mr recipient', '2017-09-01')
+        second = self.txn_repository.create(5, 'mr payer', 'mr recipient', '2017-09-02')
+        deleted = self.txn_repository.delete_many([second.id, 'unknown', first.id])
+        self.assertEqual([(txn.id, position) for txn, position in deleted],
+                         [(second.id, 1), (first.id, 0)])
+        self.assertEqual(self.txn_repository.list(), [])
+
+    def test_net_by_account(self):
+        self.txn_repository.create(10.5, 'mr payer', 'mr recipient', '2017-09-01')
+        self.txn_repository.create(2.25, 'mr recipient', 'john', '2017-09-02')
+        self.assertDictEqual(self.txn_repository.net_by_account(), {
+            'mr payer': -10.5, 'mr recipient': 8.25, 'john': 2.25})
+
+    def test_sum_by_date_range(self):
+        self.txn_repository.create(10.5, 'mr payer', 'mr recipient', '2017-09-01')
+        self.txn_repository.create(2.25, 'mr recipient', 'john', '2017-09-02')
+        self.txn_repository.create(4, 'john', 'mr payer', '2017-09-03')
+        self.assertEqual(self.txn_repository.sum_by_date_range('2017-09-02', '2017-09-03'), 6.25)
+        self.assertEqual(self.txn_repository.sum_by_date_range('2017-10-01', '2017-10-31'), 0)
+
+
+    def test_iterate(self):
+        txns = [self.txn_repository.create(amount, 'mr payer', 'mr recipient',
+                                           '2017-09-0{0}'.format(5 - amount))
+                for amount in xrange(4)]
+        self.assertEqual([txn.id for txn in self.txn_repository.iterate(limit=2, offset=1)],
+                         [txns[1].id, txns[2].id])
+
+        by_date = list(self.txn_repository.iterate(order_by='date', limit=2))
+        self.assertEqual([txn.amount for txn in by_date], [3, 2])
+        last = by_date[-1]
+        self.assertEqual([txn.amount for txn in self.txn_repository.iterate(
+            order_by='date', after=(last.date, last.id))], [1, 0])
+
+        by_id = sorted(txns, key=lambda txn: txn.id)
+        self.assertEqual([txn.id for txn in self.txn_repository.iterate(
+            order_by='id', after=by_id[1].id)], [txn.id for txn in by_id[2:]])
+        with self.assertRaises(ValueError):
+            self.txn_repository.iterate(order_by='amount')
+
+    def test_list_by_date_range(self):
+        self.txn_repository.create(1, 'mr payer', 'mr recipient', '2017-09-03')
+        self.txn_repository.create(2, 'john', 'mr payer', '2017-09-01')
+        self.txn_repository.create(3, 'mr recipient', 'john', '2017-09-02')
+        self.txn_repository.create(4, 'mr payer', 'mr payer', '2017-10-01')
+
+        def amounts(*args, **kwargs):
+            return [txn.amount for txn in self.txn_repository.list_by_date_range(*args, **kwargs)]
+
+        self.assertEqual(amounts('2017-09-01', '2017-09-30'), [2, 3, 1])
+        self.assertEqual(amounts('2017-09-02', '2017-12-31', account='mr payer'), [1, 4])
+        self.assertEqual(amounts('2017-09-01', '2017-09-02', account='john'), [2, 3])
+        self.assertEqual(amounts('2017-09-01', '2017-09-30', account='nobody'), [])
+        with self.assertRaises(ValueError):
+            self.txn_repository.list_by_date_range('2017-09', '2017-10')
+
+    def test_list_range(self):
+        txns = [self.txn_repository.create(amount, 'mr payer', 'mr recipient', '2017-09-01')
+                for amount in xrange(5)]
+        self.txn_repository.delete(txns[2])
+        self.assertEqual(self.txn_repository.position, 5)
+        self.assertEqual([txn.id for txn in self.txn_repository.list_range(1, 4)],
+                         [txns[1].id, txns[3].id])
+        self.assertEqual(self.txn_repository.list_range(5, 10), [])
+
+        self.txn_repository.skip_to(8)
+        self.txn_repository.create_many([Transaction(9, 'mr payer', 'john', '2017-09-02')])
+        self.assertEqual([txn.amount for txn in self.txn_repository.list_range(4, 9)], [4, 9])
+
+    def test_position_is_persisted(self):
+        txns = [self.txn_repository.create(amount, 'mr payer', 'mr recipient', '2017-09-01')
+                for amount in xrange(3)]
+        self.txn_repository.delete(txns[2])
+        reopened = TransactionRepository(self.sample_datastore, registry=self.txn_repository.registry)
+        self.assertEqual(reopened.position, 3)
+
+    def test_position_without_sequence(self):
+        txns = [self.txn_repository.create(amount, 'mr payer', 'mr recipient', '2017-09-01')
+                for amount in xrange(4)]
+        self.txn_repository.delete(txns[1])
+        self.sample_datastore.delete('sequences', 'name', 'transactions')
+        reopened = TransactionRepository(self.sample_datastore, registry=self.txn_repository.registry)
+        self.assertEqual(reopened.position, 4)
+        self.assertEqual(self.sample_datastore.retrieve('sequences', 'name', 'transactions')['next'], 4)
+
+
+class TestColumnarTransactionRepository(TestTransactionRepository):
+
+    def setUp(self):
+        self.sample_datastore = json_datastore.JsonDatastore()
+        self.txn_repository = TransactionRepository(self.sample_datastore, columnar=True)
+
+    def test_transactions_stay_out_of_the_datastore(self):
+        self.txn_repository.create(123, 'mr payer', 'mr recipient', '2017-09-01')
+        self.assertEqual(self.sample_datastore.count('transactions'), None)
+
+    def test_position_is_persisted(self):
+        # columnar transactions and their positions only live in memory
+        self.txn_repository.create(1, 'mr payer', 'mr recipient', '2017-09-01')
+        reopened = TransactionRepository(self.sample_datastore, columnar=True)
+        self.assertEqual(reopened.position, 0)
+
+    def test_position_without_sequence(self):
+        self.assertEqual(self.sample_datastore.count('sequences'), None)
+
+    def test_amounts_are_stored_as_cents(self):
+        txn = self.txn_repository.create(0.1 + 0.2, 'mr payer', 'mr recipient', '2017-09-01')
+        self.assertEqual(self.txn_repository.get_by_id(txn.id).amount, 0.3)
+
+    def test_to_frame_skips_deleted_transactions(self):
+        txn = self.txn_repository.create(1, 'mr payer', 'mr recipient', '2017-09-01')
+        self.txn_repository.create(2, 'mr recipient', 'john', '2017-09-02')
+        self.txn_repository.delete(txn)
+        frame = self.txn_repository.to_frame()
+        self.assertEqual(list(frame.amounts), [2.0])
+        self.assertEqual([frame.names[i] for i in frame.payers], ['mr recipient'])